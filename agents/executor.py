@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import asyncio
+import os
+
+# Upper bound on plan steps running at the same time (per turn)
+MAX_WORKERS = int(os.getenv("SUPERVISOR_MAX_WORKERS", "4"))
+
+
+def build_dependencies(tools: list) -> list:
+    """
+    Builds the dependency graph for a routed plan.
+
+    Rules:
+    - market / search steps are independent
+    - chart steps wait for every earlier market step (their data) and every
+      earlier chart step (so figures keep plan order)
+    - logic steps wait for every market step (analytics run on its data)
+    - email steps wait for every other step, except emails planned after them
+
+    Args:
+        tools: Routed tool name for each plan step, in plan order
+
+    Returns:
+        List of sets; entry i holds the indices step i depends on
+    """
+    dependencies = []
+
+    for i, tool in enumerate(tools):
+        if tool == 'chart':
+            deps = {j for j in range(i) if tools[j] in ('market', 'chart')}
+        elif tool == 'logic':
+            deps = {j for j in range(len(tools)) if tools[j] == 'market'}
+        elif tool == 'email':
+            deps = {j for j in range(len(tools)) if j != i and (j < i or tools[j] != 'email')}
+        else:
+            deps = set()
+        dependencies.append(deps)
+
+    return dependencies
+
+
+def run_steps(dependencies: list, execute, max_workers: int = MAX_WORKERS) -> list:
+    """
+    Executes plan steps concurrently while respecting their dependencies.
+
+    Args:
+        dependencies: Output of build_dependencies
+        execute: Callable(index, upstream) -> output, where upstream is the list
+                 of outputs of the step's dependencies in plan order
+        max_workers: Size of the worker pool
+
+    Returns:
+        List of step outputs in plan order (independent of completion order)
+    """
+    total = len(dependencies)
+    outputs = [None] * total
+    done = set()
+    pending = set(range(total))
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            # Submit every step whose dependencies have all finished
+            ready = sorted(i for i in pending if dependencies[i] <= done)
+            for i in ready:
+                upstream = [outputs[j] for j in sorted(dependencies[i])]
+                running[pool.submit(execute, i, upstream)] = i
+                pending.discard(i)
+
+            if not running:
+                # Only reachable with a cyclic graph; run the rest in order
+                for i in sorted(pending):
+                    outputs[i] = execute(i, [outputs[j] for j in sorted(dependencies[i]) if j in done])
+                    done.add(i)
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                outputs[i] = future.result()
+                done.add(i)
+
+    return outputs
+
+
+async def arun_steps(dependencies: list, execute, max_workers: int = MAX_WORKERS) -> list:
+    """
+    Async run_steps: each step is a task that waits for its dependencies,
+    and a semaphore bounds how many steps run at the same time.
+
+    Args:
+        dependencies: Output of build_dependencies (must be acyclic)
+        execute: Coroutine function (index, upstream) -> output
+        max_workers: Maximum number of steps running at once
+
+    Returns:
+        List of step outputs in plan order (independent of completion order)
+    """
+    total = len(dependencies)
+    outputs = [None] * total
+    finished = [asyncio.Event() for _ in range(total)]
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def run(i):
+        try:
+            for j in sorted(dependencies[i]):
+                await finished[j].wait()
+            async with semaphore:
+                outputs[i] = await execute(i, [outputs[j] for j in sorted(dependencies[i])])
+        finally:
+            # Never leave dependents waiting, even if this step raised
+            finished[i].set()
+
+    await asyncio.gather(*(run(i) for i in range(total)))
+    return outputs
@@ -1,7 +1,8 @@
 from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableLambda
 from agents.state import AgentState
-from agents.planner import planner_node
-from agents.supervisor import supervisor_node
+from agents.planner import planner_node, aplanner_node
+from agents.supervisor import supervisor_node, asupervisor_node
 
 def check_ambiguity(state: AgentState):
     """
@@ -15,8 +16,10 @@ def check_ambiguity(state: AgentState):
 workflow = StateGraph(AgentState)
 
 # 2. Add Nodes
-workflow.add_node("planner", planner_node)
-workflow.add_node("supervisor", supervisor_node)
+# Each node has a sync and an async implementation: graph.stream() (CLI) runs
+# the sync one, graph.astream() (Chainlit) the async one
+workflow.add_node("planner", RunnableLambda(planner_node, afunc=aplanner_node, name="planner"))
+workflow.add_node("supervisor", RunnableLambda(supervisor_node, afunc=asupervisor_node, name="supervisor"))
 
 # 3. Define Entry Point
 workflow.set_entry_point("planner")
@@ -1,22 +1,96 @@
 import os
+import threading
+import httpx
 from langchain_groq import ChatGroq
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_llm():
+from agents.llm_cache import CachedLLM
+from agents.rate_limit import RateLimitedLLM
+
+# Set LLM_CACHE=0 to always hit the API
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+
+# Connection pool shared by every client (all purposes, all Chainlit sessions)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "10"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+
+# Per-purpose client settings. max_tokens covers the model's reasoning tokens too,
+# so keep it generous; the timeout is what mostly differs between call sites.
+LLM_PROFILES = {
+    "router": {"timeout": 15, "max_tokens": 1024},
+    "planner": {"timeout": 30, "max_tokens": 2048},
+    "email_subject": {"timeout": 15, "max_tokens": 512},
+    "summary": {"timeout": 30, "max_tokens": 1024},
+    "codegen": {"timeout": 30, "max_tokens": 2048},
+    "email_body": {"timeout": 60, "max_tokens": 4096},
+    "synthesis": {"timeout": 60, "max_tokens": 4096},
+    "default": {"timeout": 60, "max_tokens": None},
+}
+
+_registry = {}
+_registry_lock = threading.Lock()
+_http_clients = {}
+
+
+def _get_http_clients():
+    """Lazily creates the shared keep-alive HTTP clients (sync + async)."""
+    if not _http_clients:
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS
+        )
+        _http_clients["sync"] = httpx.Client(limits=limits)
+        _http_clients["async"] = httpx.AsyncClient(limits=limits)
+    return _http_clients["sync"], _http_clients["async"]
+
+
+def _get_client(purpose: str) -> ChatGroq:
+    """
+    Returns the process-wide ChatGroq client for a purpose, building it once.
+    All clients share one pooled HTTP connection set, so TLS handshakes are
+    paid once per connection instead of once per call.
     """
-    Returns the initialized ChatGroq model.
+    profile_name = purpose if purpose in LLM_PROFILES else "default"
+
+    with _registry_lock:
+        if profile_name not in _registry:
+            api_key = os.getenv("GROQ_API_KEY")
+            if not api_key:
+                print("Warning: GROQ_API_KEY not found in environment. Using mock/fallback if available.")
+
+            profile = LLM_PROFILES[profile_name]
+            http_client, http_async_client = _get_http_clients()
+
+            # We use Llama 3.3 70B Versatile for high intelligence + good rate limits
+            # Free tier: 30 RPM, 14,400 TPD
+            _registry[profile_name] = ChatGroq(
+                temperature=0,
+                model_name="openai/gpt-oss-120b",
+                api_key=api_key,
+                timeout=profile["timeout"],
+                max_tokens=profile["max_tokens"],
+                max_retries=0,  # Retries are scheduled by agents/rate_limit.py
+                http_client=http_client,
+                http_async_client=http_async_client
+            )
+        return _registry[profile_name]
+
+
+def get_llm(purpose: str = "default"):
+    """
+    Returns the shared ChatGroq model for a call site.
     Reads GROQ_API_KEY from environment.
+
+    Calls go through the process-wide rate limiter; cache hits skip it.
+
+    Args:
+        purpose: Call site ("planner", "router", "synthesis", ...); selects the
+                 client profile (LLM_PROFILES), the response cache TTL
+                 (see agents/llm_cache.CACHE_TTLS) and the scheduling priority
+                 (see agents/rate_limit.PRIORITIES)
     """
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        print("Warning: GROQ_API_KEY not found in environment. Using mock/fallback if available.")
-    
-    # We use Llama 3.3 70B Versatile for high intelligence + good rate limits
-    # Free tier: 30 RPM, 14,400 TPD
-    return ChatGroq(
-        temperature=0, 
-        model_name="openai/gpt-oss-120b", 
-        api_key=api_key
-    )
+    llm = RateLimitedLLM(_get_client(purpose), purpose)
+    return CachedLLM(llm, purpose) if LLM_CACHE_ENABLED else llm
@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+LLM_CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", CACHE_DIR / "llm_cache.sqlite"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+
+# Seconds a response stays valid, per call site. 0 disables caching for that site.
+CACHE_TTLS = {
+    "router": 24 * 3600,       # decide_tool: step text -> tool, very stable
+    "planner": 600,            # keyed on the full conversation
+    "email_subject": 3600,
+    "summary": 24 * 3600,      # same old messages -> same summary
+    "codegen": 24 * 3600,      # same calculation + tickers -> same code
+    "email_body": 600,
+    "synthesis": 300,          # tool results include live prices / news
+    "default": 300,
+}
+
+
+class LLMCache:
+    """
+    On-disk (SQLite) response store with per-entry expiry and LRU eviction.
+    Safe to share between threads and Chainlit sessions.
+    """
+
+    def __init__(self, path: Path = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    purpose TEXT,
+                    content TEXT,
+                    expires_at REAL,
+                    last_access REAL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str, purpose: str):
+        """Returns cached content or None; counts the hit/miss for `purpose`."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT content, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row and row[1] > now:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits[purpose] = self.hits.get(purpose, 0) + 1
+                return row[0]
+
+            if row:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+            self.misses[purpose] = self.misses.get(purpose, 0) + 1
+            return None
+
+    def set(self, key: str, purpose: str, content: str, ttl: float):
+        """Stores content, then evicts least recently used entries over the size bound."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, purpose, content, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, purpose, content, now + ttl, now)
+            )
+            conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters per call site since process start."""
+        with self._lock:
+            purposes = sorted(set(self.hits) | set(self.misses))
+            return {
+                purpose: {
+                    "hits": self.hits.get(purpose, 0),
+                    "misses": self.misses.get(purpose, 0),
+                }
+                for purpose in purposes
+            }
+
+
+_cache = LLMCache()
+
+
+def cache_stats() -> dict:
+    """Returns hit/miss counters of the shared LLM response cache."""
+    return _cache.stats()
+
+
+def normalize_messages(messages) -> list:
+    """
+    Converts dict or LangChain messages into a canonical [{"role", "content"}] list.
+    Content is kept verbatim apart from line endings and surrounding
+    whitespace: layout matters in tables and code.
+    """
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+
+    normalized = []
+    for msg in messages:
+        if isinstance(msg, dict):
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+        else:
+            role = getattr(msg, "type", "user")
+            content = getattr(msg, "content", "")
+        if not isinstance(content, str):
+            content = json.dumps(content, sort_keys=True)
+        normalized.append({"role": role, "content": content.replace("\r\n", "\n").strip()})
+    return normalized
+
+
+class CachedLLM:
+    """
+    Wraps a chat model so identical prompts (same messages, model and
+    temperature) are answered from the shared cache. Anything other than
+    invoke() / stream() and their async variants is delegated to the
+    wrapped model.
+    """
+
+    def __init__(self, llm, purpose: str = "default", cache: LLMCache = None):
+        self.llm = llm
+        self.purpose = purpose
+        self.cache = cache or _cache
+        self.ttl = CACHE_TTLS.get(purpose, CACHE_TTLS["default"])
+
+    def _key(self, messages) -> str:
+        payload = {
+            "model": getattr(self.llm, "model_name", None),
+            "temperature": getattr(self.llm, "temperature", None),
+            "messages": normalize_messages(messages),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str):
+        try:
+            content = self.cache.get(key, self.purpose)
+        except sqlite3.Error as e:
+            print(f"[LLM CACHE ERROR] {e}")
+            return None
+        if content is not None:
+            print(f"[LLM CACHE] hit ({self.purpose})")
+        return content
+
+    def _store(self, key: str, content):
+        if isinstance(content, str) and content.strip():
+            try:
+                self.cache.set(key, self.purpose, content, self.ttl)
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE ERROR] {e}")
+
+    def invoke(self, messages, **kwargs):
+        if self.ttl <= 0:
+            return self.llm.invoke(messages, **kwargs)
+
+        key = self._key(messages)
+        content = self._lookup(key)
+        if content is not None:
+            return AIMessage(content=content)
+
+        response = self.llm.invoke(messages, **kwargs)
+        self._store(key, response.content)
+        return response
+
+    def stream(self, messages, **kwargs):
+        """Streams chunks; a cache hit is replayed as a single chunk."""
+        if self.ttl <= 0:
+            yield from self.llm.stream(messages, **kwargs)
+            return
+
+        key = self._key(messages)
+        content = self._lookup(key)
+        if content is not None:
+            yield AIMessageChunk(content=content)
+            return
+
+        parts = []
+        for chunk in self.llm.stream(messages, **kwargs):
+            if isinstance(chunk.content, str):
+                parts.append(chunk.content)
+            yield chunk
+
+        self._store(key, "".join(parts))
+
+    # Async variants: SQLite access runs in a worker thread so the event loop never waits on disk
+
+    async def ainvoke(self, messages, **kwargs):
+        if self.ttl <= 0:
+            return await self.llm.ainvoke(messages, **kwargs)
+
+        key = self._key(messages)
+        content = await asyncio.to_thread(self._lookup, key)
+        if content is not None:
+            return AIMessage(content=content)
+
+        response = await self.llm.ainvoke(messages, **kwargs)
+        await asyncio.to_thread(self._store, key, response.content)
+        return response
+
+    async def astream(self, messages, **kwargs):
+        """Async stream(); a cache hit is replayed as a single chunk."""
+        if self.ttl <= 0:
+            async for chunk in self.llm.astream(messages, **kwargs):
+                yield chunk
+            return
+
+        key = self._key(messages)
+        content = await asyncio.to_thread(self._lookup, key)
+        if content is not None:
+            yield AIMessageChunk(content=content)
+            return
+
+        parts = []
+        async for chunk in self.llm.astream(messages, **kwargs):
+            if isinstance(chunk.content, str):
+                parts.append(chunk.content)
+            yield chunk
+
+        await asyncio.to_thread(self._store, key, "".join(parts))
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
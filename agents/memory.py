@@ -0,0 +1,164 @@
+import os
+import re
+from agents.llm import get_llm
+
+# Messages kept verbatim at the end of the history; older ones are summarized
+MEMORY_KEEP_LAST = int(os.getenv("MEMORY_KEEP_LAST", "6"))
+# Summarize in batches so the summary LLM call happens every few turns, not every turn
+MEMORY_SUMMARY_BATCH = 4
+
+# Approximate prompt tokens each call site may spend on history / collected data
+TOKEN_BUDGETS = {
+    "planner": 2000,
+    "email": 3000,
+    "synthesis": 3000,
+    "documents": 1500,  # Excerpts of uploaded files in the synthesis prompt
+}
+
+EMAIL_PATTERN = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+TICKER_PATTERN = re.compile(r'\$?\b([A-Z]{1,5}(?:[.-][A-Z]{1,3})?)\b')
+NOT_TICKERS = {
+    'I', 'A', 'AI', 'CEO', 'CFO', 'USD', 'EUR', 'US', 'USA', 'UK', 'EU', 'ETF', 'IPO', 'EPS', 'PE',
+    'OK', 'THE', 'AND', 'FOR', 'NEWS', 'API', 'GDP', 'CPI', 'FED', 'SEC', 'Q1', 'Q2', 'Q3', 'Q4',
+    'YTD', 'ATH', 'RSI', 'SMA', 'EMA', 'CSV', 'PDF', 'PNG', 'HTML', 'NOTE', 'TLDR', 'USER', 'ASSISTANT',
+}
+
+SUMMARY_PROMPT = """You maintain the running memory of a financial-analysis chat.
+Update the summary with the new messages. Keep: tickers and companies discussed,
+key numbers and conclusions, user preferences, email addresses, open requests.
+Max 150 words. Output only the summary.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """Cuts text to roughly `budget` tokens."""
+    max_chars = budget * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "... (truncated)"
+
+
+def new_memory() -> dict:
+    return {"summary": "", "summarized": 0, "scanned": 0, "tickers": [], "emails": []}
+
+
+def extract_entities(text: str) -> tuple:
+    """Returns (tickers, email addresses) mentioned in text."""
+    emails = EMAIL_PATTERN.findall(text)
+    text_without_emails = EMAIL_PATTERN.sub(' ', text)
+    tickers = [t for t in TICKER_PATTERN.findall(text_without_emails) if t not in NOT_TICKERS and len(t) > 1]
+    return tickers, emails
+
+
+def _merge(existing: list, new: list) -> list:
+    merged = list(existing)
+    for item in new:
+        if item in merged:
+            merged.remove(item)
+        merged.append(item)  # Most recently mentioned last
+    return merged[-20:]
+
+
+def update_memory(memory: dict, messages: list) -> dict:
+    """
+    Folds messages that fell out of the verbatim window into the running
+    summary (one LLM call per MEMORY_SUMMARY_BATCH messages) and records
+    tickers / email addresses from every new message.
+
+    Args:
+        memory: Memory dict from context_data (or None for a new session)
+        messages: Full chat history
+
+    Returns:
+        Updated memory dict
+    """
+    memory = dict(memory or new_memory())
+
+    # Entities: scan each message once
+    for msg in messages[memory["scanned"]:]:
+        tickers, emails = extract_entities(msg.get('content', ''))
+        memory["tickers"] = _merge(memory["tickers"], tickers)
+        memory["emails"] = _merge(memory["emails"], emails)
+    memory["scanned"] = len(messages)
+
+    # Summary: only once enough old messages have accumulated
+    cutoff = max(0, len(messages) - MEMORY_KEEP_LAST)
+    if cutoff - memory["summarized"] >= MEMORY_SUMMARY_BATCH:
+        new_messages = "\n".join(
+            f"{m.get('role', 'user').upper()}: {m.get('content', '')[:1500]}"
+            for m in messages[memory["summarized"]:cutoff]
+        )
+        try:
+            response = get_llm("summary").invoke([{
+                "role": "user",
+                "content": SUMMARY_PROMPT.format(summary=memory["summary"] or "(empty)", messages=new_messages)
+            }])
+            memory["summary"] = response.content.strip()
+            memory["summarized"] = cutoff
+            print(f"[MEMORY] Summarized {cutoff} message(s)")
+        except Exception as e:
+            # Keep the old summary; the next turn retries with a larger batch
+            print(f"[MEMORY ERROR] {e}")
+
+    return memory
+
+
+def _memory_note(memory: dict) -> str:
+    lines = []
+    if memory.get("summary"):
+        lines.append(f"Summary of earlier conversation: {memory['summary']}")
+    if memory.get("tickers"):
+        lines.append(f"Tickers mentioned: {', '.join(memory['tickers'])}")
+    if memory.get("emails"):
+        lines.append(f"Email addresses mentioned: {', '.join(memory['emails'])}")
+    return "\n".join(lines)
+
+
+def _recent_messages(memory: dict, messages: list, budget: int) -> list:
+    """Newest-first fill of the verbatim window within `budget` tokens."""
+    start = min(memory.get("summarized", 0), max(0, len(messages) - MEMORY_KEEP_LAST))
+    recent = []
+    used = 0
+    for msg in reversed(messages[start:]):
+        content = msg.get('content', '')
+        cost = estimate_tokens(content)
+        if recent and used + cost > budget:
+            break
+        if not recent and cost > budget:
+            content = truncate_to_budget(content, budget)
+            cost = budget
+        recent.append({"role": msg.get('role', 'user'), "content": content})
+        used += cost
+    return list(reversed(recent))
+
+
+def build_context_messages(memory: dict, messages: list, budget: int) -> list:
+    """
+    Chat messages for an LLM call: a memory note (summary + entities) followed
+    by as many of the latest messages as fit in `budget` tokens.
+    """
+    memory = memory or new_memory()
+    note = _memory_note(memory)
+    context = []
+    if note:
+        context.append({"role": "system", "content": note})
+        budget -= estimate_tokens(note)
+    return context + _recent_messages(memory, messages, max(budget, 200))
+
+
+def history_text(memory: dict, messages: list, budget: int) -> str:
+    """Plain-text conversation context (summary + recent messages) within `budget` tokens."""
+    return "\n".join(
+        f"{m['role'].upper()}: {m['content']}"
+        for m in build_context_messages(memory, messages, budget)
+    )
@@ -1,14 +1,24 @@
 from agents.llm import get_llm
 from agents.state import AgentState
+from agents.routing import validate_tool_call
+from agents.memory import update_memory, build_context_messages, TOKEN_BUDGETS
+from agents.rate_limit import RateLimitTimeout
+import asyncio
 import json
+import os
 import re
 
+# "structured": plan steps come back as routed tool calls (no per-step decide_tool call)
+# "text": legacy free-text steps, each routed later by decide_tool
+PLANNER_MODE = os.getenv("PLANNER_MODE", "structured").lower()
+
 SYSTEM_PROMPT = """You are a Financial Intelligence Planner with access to these tools:
 - Market Data: Fetch stock/crypto prices
 - Web Search: Find news, analysis, trends
 - Chart Generation: Create visualizations  
-- Python Execution: Run calculations
+- Python Execution: Run calculations (returns, volatility, moving averages, RSI, drawdown, correlation of fetched prices)
 - Email: Send reports
+- Uploaded Files: CSV / Excel / PDF files the user attached are searched automatically when answering (no step needed)
 
 YOUR PRIMARY DIRECTIVE: **TAKE ACTION**.
 
@@ -18,15 +28,19 @@ Only ask questions if:
 2. User asks to "email me" but no email address is in the prompt OR conversation history
 3. Request is truly impossible without more info
 
+Questions answered by an attached file alone are DOCUMENT: no plan, the answer is written from the file.
+Never put an attached file's contents (names, figures, holdings) into a web search query.
+
 CLASSIFICATION:
 1. CHAT - Pure small talk, greetings, or "Thanks" with NO financial content regarding stocks/market
 2. VAGUE - Missing ticker OR missing email address → Ask for clarification
-3. ACTIONABLE - Everything else (even vague financial questions)
+3. DOCUMENT - Question about an attached file ("[Attached ...]" in the conversation) that needs no other tool
+4. ACTIONABLE - Everything else (even vague financial questions)
 
 
 RESPONSE FORMAT (JSON):
 {
-  "intent": "CHAT|VAGUE|ACTIONABLE",
+  "intent": "CHAT|VAGUE|DOCUMENT|ACTIONABLE",
   "response": "message" (CHAT or VAGUE only),
   "plan": ["step 1", "step 2"] (ACTIONABLE only)
 }
@@ -51,6 +65,9 @@ User: "Bitcoin"
 User: "Calculate compound interest $10k at 5% for 10 years"
 {"intent": "ACTIONABLE", "plan": ["Use Python to calculate: P=10000, r=0.05, t=10"]}
 
+User: "What was total revenue in the report?" (after "[Attached 10k.pdf: ...]")
+{"intent": "DOCUMENT"}
+
 User: "Send this to my email"
 {"intent": "VAGUE", "response": "Sure! What is your email address?"}
 
@@ -89,57 +106,182 @@ If user says "Show me NVDA" → YES CHART
 
 Output ONLY valid JSON."""
 
+STRUCTURED_FORMAT = """
+
+**STRUCTURED PLAN FORMAT (overrides the plan format above)**
+Write every ACTIONABLE plan step as an object that already names its tool:
+{"step": "human readable step", "tool": "market|search|chart|logic|email", "params": {...}}
+
+Params per tool:
+- market: {"tickers": ["NVDA", "AMD"]}
+- search: {"query": "NVIDIA stock recent news"}
+- chart: {"tickers": ["NVDA"]}
+- logic: {"expression": "compound interest P=10000, r=0.05, t=10"}
+  For returns / volatility / RSI / drawdown / correlation of fetched prices, also name them:
+  {"expression": "volatility and RSI", "tickers": ["NVDA"]}
+- email: {"recipient": "name@example.com", "subject": "optional subject"}
+
+EXAMPLE:
+User: "Show me NVDA and send it to project707@gmail.com"
+{"intent": "ACTIONABLE", "plan": [
+  {"step": "Fetch market data for NVDA", "tool": "market", "params": {"tickers": ["NVDA"]}},
+  {"step": "Generate chart for NVDA", "tool": "chart", "params": {"tickers": ["NVDA"]}},
+  {"step": "Email report to project707@gmail.com", "tool": "email", "params": {"recipient": "project707@gmail.com"}}
+]}
+
+Output ONLY valid JSON."""
+
 def planner_node(state: AgentState):
     """
     Universal financial task planner with conversation context.
     """
     messages = state['messages']
     
-    llm = get_llm()
+    llm = get_llm("planner")
+    
+    # Rolling memory: older turns live in a summary, recent ones stay verbatim
+    context_data = dict(state.get('context_data') or {})
+    context_data['memory'] = update_memory(context_data.get('memory'), messages)
+    
+    try:
+        response = llm.invoke(planner_messages(context_data['memory'], messages))
+        return plan_from_response(response.content, messages, context_data)
+    
+    except Exception as e:
+        print(f"\n[PLANNER ERROR] {e}")
+        return planner_error(context_data, e)
+
+
+async def aplanner_node(state: AgentState):
+    """
+    Async planner_node for graph.astream(); the LLM call is awaited so other
+    sessions keep running while this one plans.
+    """
+    messages = state['messages']
     
-    # Build the full conversation for context
-    llm_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    llm = get_llm("planner")
     
-    # Add conversation history
-    for msg in messages:
-        role = msg.get('role', 'user')
-        content = msg.get('content', '')
-        llm_messages.append({"role": role, "content": content})
+    # The summary call is sync (and rare); keep it off the event loop
+    context_data = dict(state.get('context_data') or {})
+    context_data['memory'] = await asyncio.to_thread(update_memory, context_data.get('memory'), messages)
     
     try:
-        response = llm.invoke(llm_messages)
-        content = response.content.strip()
-        content = re.sub(r'```json\s*|\s*```', '', content).strip()
-        
-        print(f"\n[PLANNER] {content[:300]}...")
-        
-        data = json.loads(content)
-        intent = data.get("intent", "ACTIONABLE")  # Default to action!
-        
-        if intent in ["CHAT", "VAGUE"]:
-            return {
-                "is_ambiguous": True,
-                "clarifying_question": data.get("response", "Hello! How can I help?"),
-                "plan": []
-            }
-        
-        else:  # ACTIONABLE
-            plan = data.get("plan", [])
-            if not plan:
-                # Emergency fallback - try to search for whatever they said
-                last_msg = messages[-1]['content']
-                plan = [f"Search web for {last_msg}"]
-            
-            return {
-                "is_ambiguous": False,
-                "clarifying_question": "",
-                "plan": plan
-            }
+        response = await llm.ainvoke(planner_messages(context_data['memory'], messages))
+        return plan_from_response(response.content, messages, context_data)
     
     except Exception as e:
         print(f"\n[PLANNER ERROR] {e}")
+        return planner_error(context_data, e)
+
+
+def planner_messages(memory: dict, messages: list) -> list:
+    """System prompt plus conversation context (summary + entities + recent turns within budget)."""
+    structured = PLANNER_MODE == "structured"
+    system_prompt = SYSTEM_PROMPT + STRUCTURED_FORMAT if structured else SYSTEM_PROMPT
+    llm_messages = [{"role": "system", "content": system_prompt}]
+    llm_messages.extend(build_context_messages(memory, messages, TOKEN_BUDGETS["planner"]))
+    return llm_messages
+
+
+def plan_from_response(content: str, messages: list, context_data: dict) -> dict:
+    """
+    Turns the planner's JSON reply into the node's state update.
+    Raises on malformed JSON (callers fall back to planner_error).
+    """
+    content = content.strip()
+    content = re.sub(r'```json\s*|\s*```', '', content).strip()
+    
+    print(f"\n[PLANNER] {content[:300]}...")
+    
+    data = json.loads(content)
+    intent = data.get("intent", "ACTIONABLE")  # Default to action!
+    
+    if intent in ["CHAT", "VAGUE"]:
+        return {
+            "is_ambiguous": True,
+            "clarifying_question": data.get("response", "Hello! How can I help?"),
+            "plan": [],
+            "tool_calls": [],
+            "context_data": context_data
+        }
+    
+    if intent == "DOCUMENT" and not context_data.get("documents"):
         return {
             "is_ambiguous": True,
-            "clarifying_question": "I had trouble understanding. Could you rephrase your request?",
-            "plan": []
+            "clarifying_question": "I don't see an attached file yet. Could you upload it?",
+            "plan": [],
+            "tool_calls": [],
+            "context_data": context_data
         }
+    
+    # ACTIONABLE (or DOCUMENT: an empty plan, answered from the uploads' excerpts)
+    plan, tool_calls = [], []
+    if intent != "DOCUMENT":
+        plan, tool_calls = parse_plan(data.get("plan", []))
+    if not plan and not context_data.get("documents"):
+        # Emergency fallback - try to search for whatever they said
+        # (never with uploads: the message may quote the file)
+        last_msg = messages[-1]['content']
+        plan = [f"Search web for {last_msg}"]
+        tool_calls = [{"tool": "search", "params": {"query": last_msg}}]
+    
+    routed = sum(1 for call in tool_calls if call)
+    print(f"[PLANNER] {routed}/{len(plan)} steps pre-routed")
+    
+    return {
+        "is_ambiguous": False,
+        "clarifying_question": "",
+        "plan": plan,
+        "tool_calls": tool_calls,
+        "context_data": context_data
+    }
+
+
+def planner_error(context_data: dict, error: Exception = None) -> dict:
+    if isinstance(error, RateLimitTimeout):
+        question = "I'm handling a lot of requests right now. Please try again in a minute."
+    else:
+        question = "I had trouble understanding. Could you rephrase your request?"
+    return {
+        "is_ambiguous": True,
+        "clarifying_question": question,
+        "plan": [],
+        "tool_calls": [],
+        "context_data": context_data
+    }
+
+
+def parse_plan(raw_plan: list) -> tuple:
+    """
+    Splits the planner's plan into display text and routed tool calls.
+    
+    Args:
+        raw_plan: Plan items, either strings (text mode) or
+                  {"step", "tool", "params"} objects (structured mode)
+    
+    Returns:
+        (plan, tool_calls): step strings, and a parallel list holding the
+        validated tool call for each step or None where the supervisor
+        must fall back to decide_tool
+    """
+    plan = []
+    tool_calls = []
+    
+    if not isinstance(raw_plan, list):
+        return plan, tool_calls
+    
+    for item in raw_plan:
+        if isinstance(item, str):
+            plan.append(item)
+            tool_calls.append(None)
+        elif isinstance(item, dict):
+            call = validate_tool_call(item)
+            step = item.get("step")
+            if not isinstance(step, str) or not step.strip():
+                if not call:
+                    continue
+                step = f"{call['tool']}: {json.dumps(call['params'])}"
+            plan.append(step)
+            tool_calls.append(call)
+    
+    return plan, tool_calls
@@ -0,0 +1,298 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+# Groq quota shared by every session in this process. <= 0 disables a bucket.
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "8000"))
+
+# Lower number = served first when several calls wait for quota
+PRIORITIES = {
+    "synthesis": 0,       # the user is watching the answer stream in
+    "planner": 1,
+    "router": 1,
+    "codegen": 1,
+    "email_body": 2,
+    "default": 2,
+    "summary": 3,         # memory upkeep, nobody waits on it directly
+    "email_subject": 4,   # has a static fallback
+}
+
+# Seconds a call may wait (queueing + 429 retries) before giving up
+DEADLINES = {
+    "synthesis": 45,
+    "planner": 30,
+    "router": 15,
+    "codegen": 30,
+    "email_body": 60,
+    "default": 30,
+    "summary": 20,
+    "email_subject": 10,
+}
+
+# Tokens reserved for the reply until the real usage is known
+COMPLETION_ESTIMATE = 512
+MAX_RETRIES = 4
+RETRY_BASE_SECONDS = 1.0
+POLL_SECONDS = 0.05
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call cannot get quota before its deadline."""
+
+
+class TokenBucket:
+    """Classic token bucket; the level may go negative to record overspending."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it is now)."""
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class RateLimiter:
+    """
+    Process-wide scheduler for LLM calls: a request bucket and a token bucket,
+    with waiting calls served strictly by (priority, arrival order).
+    Usable from threads (acquire) and coroutines (aacquire).
+    """
+
+    def __init__(self, rpm: int = GROQ_RPM, tpm: int = GROQ_TPM):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        self._queue = []  # heap of (priority, seq) tickets
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _enqueue(self, purpose: str) -> tuple:
+        ticket = (PRIORITIES.get(purpose, PRIORITIES["default"]), next(self._seq))
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _cancel(self, ticket: tuple):
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+
+    def _try_acquire(self, ticket: tuple, cost: int) -> float:
+        """Takes quota for the ticket and returns 0, or returns seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if self._queue[0] != ticket:
+                return POLL_SECONDS  # A higher-priority / earlier call goes first
+
+            wait = max(0.0, self.paused_until - now)
+            if self.requests:
+                self.requests.refill(now)
+                wait = max(wait, self.requests.wait_time(1))
+            if self.tokens:
+                self.tokens.refill(now)
+                wait = max(wait, self.tokens.wait_time(min(cost, self.tokens.capacity)))
+            if wait > 0:
+                return wait
+
+            if self.requests:
+                self.requests.level -= 1
+            if self.tokens:
+                self.tokens.level -= cost
+            heapq.heappop(self._queue)
+            return 0.0
+
+    def acquire(self, purpose: str, cost: int, deadline: float):
+        """Blocks until the call may run; raises RateLimitTimeout past `deadline` (monotonic)."""
+        ticket = self._enqueue(purpose)
+        try:
+            while True:
+                wait = self._try_acquire(ticket, cost)
+                if wait == 0:
+                    return
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitTimeout(f"No LLM quota for '{purpose}' within its deadline")
+                time.sleep(wait)
+        finally:
+            self._cancel(ticket)
+
+    async def aacquire(self, purpose: str, cost: int, deadline: float):
+        """Async acquire(): waits with asyncio.sleep so the event loop keeps running."""
+        ticket = self._enqueue(purpose)
+        try:
+            while True:
+                wait = self._try_acquire(ticket, cost)
+                if wait == 0:
+                    return
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitTimeout(f"No LLM quota for '{purpose}' within its deadline")
+                await asyncio.sleep(wait)
+        finally:
+            self._cancel(ticket)
+
+    def record_usage(self, reserved: int, used: int):
+        """Corrects the token bucket once a call's real usage is known."""
+        if self.tokens and used:
+            with self._lock:
+                self.tokens.level -= used - reserved
+
+    def pause(self, seconds: float):
+        """Holds every queued call back (after a 429 from the API)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_limiter = RateLimiter()
+
+
+def estimate_cost(messages) -> int:
+    """Rough token cost of a call: prompt (~4 chars per token) plus a reply allowance."""
+    if isinstance(messages, str):
+        chars = len(messages)
+    else:
+        chars = sum(
+            len(str(m.get("content", "") if isinstance(m, dict) else getattr(m, "content", "")))
+            for m in messages
+        )
+    return chars // 4 + COMPLETION_ESTIMATE
+
+
+def retry_delay(error: Exception, attempt: int):
+    """
+    Seconds to wait before retrying a failed call, or None if it should not be retried.
+    Retries 429 (honouring Retry-After) and 5xx responses with full jitter.
+    """
+    status = getattr(error, "status_code", None)
+    if status != 429 and not (isinstance(status, int) and status >= 500):
+        return None
+    if attempt >= MAX_RETRIES:
+        return None
+
+    backoff = random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt)
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(float(retry_after), backoff) if retry_after else backoff
+    except ValueError:
+        return backoff
+
+
+def _used_tokens(message) -> int:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0)
+
+
+class RateLimitedLLM:
+    """
+    Wraps a chat model so every call goes through the shared RateLimiter
+    and 429 / 5xx responses are retried with jittered backoff until the
+    purpose's deadline. Anything else is delegated to the wrapped model.
+    """
+
+    def __init__(self, llm, purpose: str = "default", limiter: RateLimiter = None):
+        self.llm = llm
+        self.purpose = purpose
+        self.limiter = limiter or _limiter
+        self.max_wait = DEADLINES.get(purpose, DEADLINES["default"])
+
+    def _backoff(self, error: Exception, attempt: int, deadline: float) -> float:
+        delay = retry_delay(error, attempt)
+        if delay is None:
+            return None
+        if time.monotonic() + delay > deadline:
+            raise RateLimitTimeout(f"LLM '{self.purpose}' still rate limited at its deadline") from error
+        if getattr(error, "status_code", None) == 429:
+            self.limiter.pause(delay)
+        print(f"[RATE LIMIT] {self.purpose}: {getattr(error, 'status_code', '')} from API, retrying in {delay:.1f}s")
+        return delay
+
+    def invoke(self, messages, **kwargs):
+        deadline = time.monotonic() + self.max_wait
+        cost = estimate_cost(messages)
+        for attempt in itertools.count():
+            self.limiter.acquire(self.purpose, cost, deadline)
+            try:
+                response = self.llm.invoke(messages, **kwargs)
+            except Exception as e:
+                delay = self._backoff(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.limiter.record_usage(cost, _used_tokens(response))
+            return response
+
+    def stream(self, messages, **kwargs):
+        """Streams chunks; only failures before the first chunk are retried."""
+        deadline = time.monotonic() + self.max_wait
+        cost = estimate_cost(messages)
+        for attempt in itertools.count():
+            self.limiter.acquire(self.purpose, cost, deadline)
+            started = False
+            used = 0
+            try:
+                for chunk in self.llm.stream(messages, **kwargs):
+                    started = True
+                    used = max(used, _used_tokens(chunk))
+                    yield chunk
+            except Exception as e:
+                delay = None if started else self._backoff(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.limiter.record_usage(cost, used)
+            return
+
+    async def ainvoke(self, messages, **kwargs):
+        deadline = time.monotonic() + self.max_wait
+        cost = estimate_cost(messages)
+        for attempt in itertools.count():
+            await self.limiter.aacquire(self.purpose, cost, deadline)
+            try:
+                response = await self.llm.ainvoke(messages, **kwargs)
+            except Exception as e:
+                delay = self._backoff(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.limiter.record_usage(cost, _used_tokens(response))
+            return response
+
+    async def astream(self, messages, **kwargs):
+        """Async stream()."""
+        deadline = time.monotonic() + self.max_wait
+        cost = estimate_cost(messages)
+        for attempt in itertools.count():
+            await self.limiter.aacquire(self.purpose, cost, deadline)
+            started = False
+            used = 0
+            try:
+                async for chunk in self.llm.astream(messages, **kwargs):
+                    started = True
+                    used = max(used, _used_tokens(chunk))
+                    yield chunk
+            except Exception as e:
+                delay = None if started else self._backoff(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.limiter.record_usage(cost, used)
+            return
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
@@ -0,0 +1,74 @@
+import re
+
+# Schema for routed tool calls: parameter name -> expected type, plus required params.
+# Shared by the planner (structured plans) and decide_tool (per-step fallback).
+TOOL_SCHEMA = {
+    "market": {"params": {"tickers": list}, "required": ["tickers"]},
+    "search": {"params": {"query": str}, "required": ["query"]},
+    "chart": {"params": {"tickers": list}, "required": ["tickers"]},
+    "logic": {"params": {"expression": str, "tickers": list}, "required": []},  # tickers: price analytics scope
+    "email": {"params": {"recipient": str, "subject": str}, "required": []},
+}
+
+TICKER_PATTERN = re.compile(r'^[A-Z0-9\^][A-Z0-9.\-=\^]{0,11}$')
+
+
+def _coerce_tickers(value) -> list:
+    """Accepts a list of tickers or a comma-separated string; returns clean symbols."""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        return []
+    tickers = []
+    for item in value:
+        if not isinstance(item, str):
+            continue
+        ticker = item.upper().strip()
+        if TICKER_PATTERN.match(ticker) and ticker not in tickers:
+            tickers.append(ticker)
+    return tickers
+
+
+def validate_tool_call(call) -> dict:
+    """
+    Validates a routed tool call against TOOL_SCHEMA and normalizes it.
+
+    Accepts both the planner's shape ({"tool", "params": {"tickers": [...]}})
+    and decide_tool's legacy shape ({"tool", "params": {"ticker": "A, B"}}).
+
+    Returns:
+        {"tool": name, "params": {...}} in the form the supervisor consumes
+        (market/chart also get a comma-joined 'ticker'), or None if invalid
+    """
+    if not isinstance(call, dict):
+        return None
+
+    tool = call.get("tool")
+    if not isinstance(tool, str) or tool.lower().strip() not in TOOL_SCHEMA:
+        return None
+    tool = tool.lower().strip()
+    schema = TOOL_SCHEMA[tool]
+
+    raw_params = call.get("params") or {}
+    if not isinstance(raw_params, dict):
+        return None
+
+    params = {}
+    for name, expected in schema["params"].items():
+        if expected is list:
+            value = raw_params.get(name, raw_params.get("ticker"))
+            tickers = _coerce_tickers(value) if value is not None else []
+            if tickers:
+                params[name] = tickers
+        else:
+            value = raw_params.get(name)
+            if isinstance(value, str) and value.strip():
+                params[name] = value.strip()
+
+    if any(name not in params for name in schema["required"]):
+        return None
+
+    if "tickers" in params:
+        params["ticker"] = ", ".join(params["tickers"])
+
+    return {"tool": tool, "params": params}
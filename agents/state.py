@@ -1,4 +1,4 @@
-from typing import TypedDict, Annotated, List
+from typing import TypedDict, Annotated, List, Optional
 import operator
 
 class AgentState(TypedDict):
@@ -13,6 +13,10 @@ class AgentState(TypedDict):
     # The Plan generated by the Planner (e.g., ["Fetch NVDA", "Chart it"])
     plan: List[str]
     
+    # Routed tool call for each plan step ({"tool", "params"}), parallel to plan.
+    # None entries are routed by the supervisor's decide_tool fallback.
+    tool_calls: List[Optional[dict]]
+    
     # Flags for control flow
     is_ambiguous: bool       # True if we need to ask the user a question
     clarifying_question: str # The question to ask (if ambiguous)
@@ -27,6 +31,9 @@ class AgentState(TypedDict):
     # Sources/citations from search results
     sources: List[dict]  # List of {title, url} dicts
 
-    # Persistent context data (market data csvs, chart paths)
+    # Outbox ids of emails queued this turn (delivery is confirmed afterwards)
+    queued_emails: List[int]
+
+    # Persistent context data (market data tables, chart figures)
     # This persists across conversation turns
     context_data: dict
@@ -1,140 +1,444 @@
 from agents.state import AgentState
 from agents.llm import get_llm
-from tools.market import get_stock_prices
-from tools.search import search_web
+from agents.llm_cache import cache_stats
+from agents.memory import history_text as memory_history_text, truncate_to_budget, TOKEN_BUDGETS
+from tools.market import get_stock_prices, get_stock_prices_bulk
+from tools.search import search_web, asearch_web, search_key
 from tools.chart import generate_chart, generate_comparison_chart
-from tools.email import send_email
+from tools.attachments import build_attachments
+from tools.analytics import compute_analytics, format_analytics, requested_metrics, tickers_in
+from tools.sandbox import run_code
+from tools.retrieval import search_documents, format_excerpts
+from tools.outbox import queue_email
+from agents.routing import validate_tool_call
+from agents.executor import build_dependencies, run_steps, arun_steps, MAX_WORKERS
+from concurrent.futures import ThreadPoolExecutor
+from langgraph.config import get_stream_writer
+import asyncio
 import re
 import json
 
 def supervisor_node(state: AgentState):
     """
     Intelligent supervisor that routes plan steps to the right tools using LLM.
+    Independent steps run concurrently; results keep plan order for synthesis.
     """
     plan = state['plan']
     
     if not plan:
-        return {"final_report": "No plan to execute.", "charts": [], "sources": []}
+        # No tool steps: answer from the uploaded files alone
+        excerpts = document_excerpts(state.get('context_data') or {}, state['messages'])
+        if not excerpts:
+            return {"final_report": "No plan to execute.", "charts": [], "sources": []}
+        return finish_turn(synthesize([], [], excerpts), [], [], [], *document_turn(state))
     
-    results = []
-    results = []
+    context_data, tool_choices, unrouted = load_turn(state)
+    if unrouted:
+        print(f"[SUPERVISOR] Routing {len(unrouted)} step(s) via decide_tool")
+        # One LLM call per unrouted step, issued concurrently
+        with ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS)) as pool:
+            for i, choice in zip(unrouted, pool.map(decide_tool, [plan[i] for i in unrouted])):
+                tool_choices[i] = choice
+    
+    ctx, dependencies = prepare_steps(state, tool_choices, context_data)
+    
+    def execute(index, upstream):
+        return execute_step(index + 1, len(plan), plan[index], tool_choices[index], ctx, upstream)
+    
+    results, charts, sources = collect_outputs(run_steps(dependencies, execute))
+    excerpts = document_excerpts(context_data, state['messages'])
+    final_report = synthesize(results, charts, excerpts)
+    return finish_turn(final_report, results, charts, sources, context_data, ctx)
+
+
+async def asupervisor_node(state: AgentState):
+    """
+    Async supervisor_node for graph.astream(). LLM calls and searches are
+    awaited; blocking tools (yfinance, plotly/kaleido, SMTP) run in worker
+    threads, so the event loop stays free for other sessions.
+    """
+    plan = state['plan']
+    
+    if not plan:
+        excerpts = await asyncio.to_thread(document_excerpts, state.get('context_data') or {}, state['messages'])
+        if not excerpts:
+            return {"final_report": "No plan to execute.", "charts": [], "sources": []}
+        return finish_turn(await asynthesize([], [], excerpts), [], [], [], *document_turn(state))
     
+    context_data, tool_choices, unrouted = load_turn(state)
+    if unrouted:
+        print(f"[SUPERVISOR] Routing {len(unrouted)} step(s) via decide_tool")
+        choices = await asyncio.gather(*(adecide_tool(plan[i]) for i in unrouted))
+        for i, choice in zip(unrouted, choices):
+            tool_choices[i] = choice
+    
+    ctx, dependencies = prepare_steps(state, tool_choices, context_data)
+    
+    async def execute(index, upstream):
+        return await aexecute_step(index + 1, len(plan), plan[index], tool_choices[index], ctx, upstream)
+    
+    results, charts, sources = collect_outputs(await arun_steps(dependencies, execute))
+    excerpts = await asyncio.to_thread(document_excerpts, context_data, state['messages'])
+    final_report = await asynthesize(results, charts, excerpts)
+    return finish_turn(final_report, results, charts, sources, context_data, ctx)
+
+
+def load_turn(state: AgentState) -> tuple:
+    """
+    Returns (context_data, tool_choices, unrouted): the planner's routed tool
+    calls, with None (and the index listed in unrouted) where decide_tool is needed.
+    """
+    plan = state['plan']
     # Load persistent context
-    context_data = state.get('context_data', {'market_data': {}, 'chart_paths': []})
-    market_data = context_data.get('market_data', {})
-    chart_paths = context_data.get('chart_paths', [])
+    context_data = state.get('context_data', {'market_data': {}, 'chart_figures': []})
+    
+    # Use the planner's routed tool calls; only unrouted steps need decide_tool
+    planned_calls = state.get('tool_calls') or []
+    tool_choices = [
+        planned_calls[i] if i < len(planned_calls) and planned_calls[i] else None
+        for i in range(len(plan))
+    ]
+    unrouted = [i for i, choice in enumerate(tool_choices) if choice is None]
+    return context_data, tool_choices, unrouted
+
+
+def document_turn(state: AgentState) -> tuple:
+    """(context_data, ctx) for a turn without tool steps, for finish_turn."""
+    context_data, _, _ = load_turn(state)
+    ctx, _ = prepare_steps(state, [], context_data)
+    return context_data, ctx
+
+
+def prepare_steps(state: AgentState, tool_choices: list, context_data: dict) -> tuple:
+    """Builds the turn-wide step context and the dependency graph of a routed plan."""
+    plan = state['plan']
+    tools = [choice['tool'].lower().strip() for choice in tool_choices]
+    dependencies = build_dependencies(tools)
+    
+    # In-turn dedup: a search matching an earlier step's normalized query
+    # reuses that step's results instead of repeating them
+    duplicate_searches = {}
+    seen_searches = {}
+    for i, (tool, choice) in enumerate(zip(tools, tool_choices), 1):
+        if tool == 'search':
+            key = search_key(choice['params'].get('query', plan[i - 1]))
+            if key in seen_searches:
+                duplicate_searches[i] = seen_searches[key]
+            else:
+                seen_searches[key] = i
     
+    ctx = {
+        "messages": state['messages'],
+        "memory": context_data.get('memory'),
+        "market_data": context_data.get('market_data', {}),
+        "prior_tickers": list(context_data.get('market_data', {})),  # Loaded before this turn
+        "chart_figures": context_data.get('chart_figures', []),  # PNGs are rendered only for emails
+        "charts": [],  # Shared by chart steps, which run one at a time
+        "duplicate_searches": duplicate_searches,
+        "queued_emails": [],  # Outbox ids, confirmed by the UI once delivered
+    }
+    return ctx, dependencies
+
+
+def collect_outputs(outputs: list) -> tuple:
+    """Flattens step outputs (in plan order) into (results, charts, sources)."""
+    results = []
     charts = []  # Store new Plotly figures for UI display
     sources = []  # Store search sources for citation
+    for output in outputs:
+        results.extend(output['results'])
+        charts.extend(output['charts'])
+        sources.extend(output['sources'])
+    return results, charts, sources
+
+
+def document_excerpts(context_data: dict, messages: list) -> str:
+    """
+    The uploaded-file chunks most relevant to the latest user message,
+    formatted for the synthesis prompt ("" without uploads or matches).
+    """
+    documents = context_data.get('documents')
+    if not documents:
+        return ""
+    question = next((m['content'] for m in reversed(messages) if m.get('role') == 'user'), "")
+    hits = search_documents(documents, question)
+    if not hits:
+        return ""
+    print(f"[RETRIEVAL] {len(hits)} excerpt(s): " + ", ".join(f"{h['name']} {h['location']}" for h in hits))
+    return truncate_to_budget(format_excerpts(hits), TOKEN_BUDGETS["documents"])
+
+
+def synthesis_prompt(results: list, excerpts: str = "") -> tuple:
+    """Returns (prompt, results_text) for the final synthesis call."""
+    # Truncate results to the synthesis token budget
+    results_text = truncate_to_budget("\n".join(results), TOKEN_BUDGETS["synthesis"])
+    if not results:
+        results_text = "(No tools were needed: answer from the uploaded files below.)"
+    documents_text = ""
+    if excerpts:
+        documents_text = f"""
+Relevant excerpts from the user's uploaded files (cite the file and page/rows when you use them):
+
+{excerpts}
+"""
+
+    prompt = f"""You are a smart financial assistant.
+The user asked a question and we ran some tools to get data.
+Here is the raw data collected:
+
+{results_text}
+{documents_text}
+
+YOUR TASK:
+Synthesize this into a direct, human-like answer.
+- IGNORE tool log messages like "Fetched 20 rows" or "Using cached data".
+- Focus on the *actual values* (prices, dates, news headlines).
+- If asked about a trend, describe the trend (up/down/volatility) using the data.
+- Do not meta-explain ("Based on the data...", "The tools found..."). Just answer.
+- Be concise but professional."""
+    return prompt, results_text
+
+
+def is_chart_only(results: list, charts: list) -> bool:
+    # Chart-only request: the user just wants charts, no text synthesis
+    return len(charts) > 0 and len(results) <= len(charts)
+
+
+def synthesize(results: list, charts: list, excerpts: str = "") -> str:
+    """
+    FINAL SYNTHESIS: Use LLM to create a coherent natural language summary.
+    Tokens are streamed to the UI as they arrive (graph custom stream).
+    """
+    print("\n[SUPERVISOR] Synthesizing final report...")
+    if is_chart_only(results, charts) and not excerpts:
+        return ""
     
-    for i, step in enumerate(plan, 1):
-        print(f"\n[SUPERVISOR] Step {i}/{len(plan)}: {step}")
-        
-        # Ask LLM which tool to use
-        tool_choice = decide_tool(step)
-        tool_name = tool_choice['tool'].lower().strip()
-        print(f"[SUPERVISOR] Routing to: {tool_name}")
-        
-        step_result = f"### Step {i}: {step}\n\n"
-        
+    llm = get_llm("synthesis")
+    prompt, results_text = synthesis_prompt(results, excerpts)
+    
+    try:
+        write = token_writer()
+        parts = []
+        for chunk in llm.stream([{"role": "user", "content": prompt}]):
+            if isinstance(chunk.content, str) and chunk.content:
+                parts.append(chunk.content)
+                write({"type": "token", "content": chunk.content})
+        return "".join(parts)
+    except Exception as e:
+        print(f"[SYNTHESIS ERROR] {e}")
+        # Retry with shorter prompt if first fails
+        try:
+            short_prompt = f"Summarize this data briefly: {results_text[:4000]}"
+            response = llm.invoke([{"role": "user", "content": short_prompt}])
+            return response.content
+        except:
+            return "I gathered the data but couldn't generate a summary. Please check the logs."
+
+
+async def asynthesize(results: list, charts: list, excerpts: str = "") -> str:
+    """Async synthesize()."""
+    print("\n[SUPERVISOR] Synthesizing final report...")
+    if is_chart_only(results, charts) and not excerpts:
+        return ""
+    
+    llm = get_llm("synthesis")
+    prompt, results_text = synthesis_prompt(results, excerpts)
+    
+    try:
+        write = token_writer()
+        parts = []
+        async for chunk in llm.astream([{"role": "user", "content": prompt}]):
+            if isinstance(chunk.content, str) and chunk.content:
+                parts.append(chunk.content)
+                write({"type": "token", "content": chunk.content})
+        return "".join(parts)
+    except Exception as e:
+        print(f"[SYNTHESIS ERROR] {e}")
         try:
-            if tool_name == 'market':
-                raw_ticker = tool_choice['params'].get('ticker', extract_ticker(step))
-                # Support multiple tickers comma-separated
-                tickers = [t.strip() for t in raw_ticker.split(',')]
-                
-                for ticker in tickers:
-                    if ticker and ticker not in market_data:
-                        result = get_stock_prices(ticker)
-                        if result['error']:
-                            step_result += f"Error fetching {ticker}: {result['message']}\n"
-                        else:
-                            market_data[ticker] = result['csv']  # Store pure CSV
-                            step_result += f"Fetched {len(result['csv'].splitlines())} rows for {ticker}\n"
-                            
-                            # Add data excerpt for LLM synthesis (First 5 and Last 5 rows)
-                            lines = result['csv'].splitlines()
-                            excerpt = "\n".join(lines[:6]) + "\n...\n" + "\n".join(lines[-5:]) if len(lines) > 10 else result['csv']
-                            
-                            results.append(f"Market Data for {ticker}:\n{excerpt}")
-                    elif ticker:
-                        step_result += f"Using cached data for {ticker}\n"
+            short_prompt = f"Summarize this data briefly: {results_text[:4000]}"
+            response = await llm.ainvoke([{"role": "user", "content": short_prompt}])
+            return response.content
+        except:
+            return "I gathered the data but couldn't generate a summary. Please check the logs."
+
+
+def finish_turn(final_report: str, results: list, charts: list, sources: list, context_data: dict, ctx: dict) -> dict:
+    """Appends email (queued) notices and builds the supervisor's state update."""
+    print(f"[LLM CACHE] {cache_stats()}")
+    
+    # Check for queued emails in results and append to final report if not present
+    email_confirmations = [r for r in results if "queued for delivery" in r]
+    if email_confirmations:
+        for confirmation in email_confirmations:
+            # Extract just the relevant line
+            lines = confirmation.split('\n')
+            for line in lines:
+                if "queued for delivery" in line:
+                    final_report += f"\n\n📤 {line}"
+    
+    return {
+        "final_report": final_report, 
+        "charts": charts, 
+        "sources": sources,
+        "queued_emails": ctx['queued_emails'],
+        "context_data": {
+            **context_data,
+            "market_data": ctx['market_data'],
+            "chart_figures": ctx['chart_figures']
+        }
+    }
+
+
+def token_writer():
+    """Custom-stream writer of the running graph (no-op outside a graph run)."""
+    try:
+        return get_stream_writer()
+    except Exception:
+        return lambda _: None
+
+
+def visible_market_data(ctx: dict, upstream: list) -> dict:
+    """
+    Market data a step may use: tickers loaded before this turn plus those
+    loaded by its upstream market steps. Market steps planned later may be
+    running at the same time; their tickers stay invisible, so the result
+    is the same as running the plan in order.
+    """
+    visible = set(ctx['prior_tickers'])
+    for output in upstream:
+        visible.update(output.get('tickers', []))
+    snapshot = dict(ctx['market_data'])
+    return {ticker: table for ticker, table in snapshot.items() if ticker in visible}
+
+
+def execute_step(i: int, total: int, step: str, tool_choice: dict, ctx: dict, upstream: list) -> dict:
+    """
+    Runs a single routed plan step.
+    
+    Args:
+        i: 1-based step number
+        total: Number of steps in the plan
+        step: Plan step text
+        tool_choice: Routing decision ({"tool", "params"})
+        ctx: Turn-wide state shared between steps (market data, chart paths, ...)
+        upstream: Outputs of the steps this one depends on, in plan order
+    
+    Returns:
+        Dict with 'results' (text for synthesis), 'charts' and 'sources'
+    """
+    print(f"\n[SUPERVISOR] Step {i}/{total}: {step}")
+    
+    tool_name = tool_choice['tool'].lower().strip()
+    print(f"[SUPERVISOR] Routing to: {tool_name}")
+    
+    market_data = ctx['market_data']
+    chart_figures = ctx['chart_figures']
+    
+    results = []
+    charts = []
+    sources = []
+    loaded_tickers = []  # Tickers a market step leaves available to its dependents
+    step_result = f"### Step {i}: {step}\n\n"
+    
+    try:
+        if tool_name == 'market':
+            raw_ticker = tool_choice['params'].get('ticker', extract_ticker(step))
+            # Support multiple tickers comma-separated
+            tickers = [t.strip() for t in raw_ticker.split(',')]
             
-            elif tool_name == 'search':
-                query = tool_choice['params'].get('query', step)
-                result = search_web(query)
-                step_result += result['content']
-                sources.extend(result['sources'])  # Collect sources
+            # One batched download for every ticker not already in the session
+            missing = [t for t in tickers if t and t not in market_data]
+            fetched = get_stock_prices_bulk(missing) if missing else {}
             
-            elif tool_name == 'chart':
-                ticker = tool_choice['params'].get('ticker', extract_ticker(step))
-                # Check if this is a comparison request (multiple tickers in market_data)
-                if len(market_data) > 1:
-                    # Generate comparison chart with all tickers
-                    fig = generate_comparison_chart(market_data)
-                    if isinstance(fig, str):
-                        print(f"[CHART ERROR] {fig}")
-                        step_result += f"Chart generation skipped"
-                    else:
-                        if fig not in charts:  # Avoid duplicate charts
-                            charts.append(fig)
-                            # Save persistent image
-                            try:
-                                path = f"/tmp/chart_comparison_{len(chart_paths)}.png"
-                                fig.write_image(path)
-                                chart_paths.append(path)
-                            except Exception as e:
-                                print(f"Failed to save chart image: {e}")
-                        step_result += f"Comparison chart generated for {', '.join(market_data.keys())}"
-                elif ticker and ticker in market_data:
-                    fig = generate_chart(ticker, market_data[ticker])
-                    if isinstance(fig, str):
-                        print(f"[CHART ERROR] {fig}")
-                        step_result += f"Chart generation skipped for {ticker}"
+            for ticker in tickers:
+                if ticker and ticker not in market_data:
+                    result = fetched.get(ticker.upper()) or get_stock_prices(ticker)
+                    if result['error']:
+                        step_result += f"Error fetching {ticker}: {result['message']}\n"
                     else:
+                        table = result['data']
+                        market_data[ticker] = table  # Columnar PriceTable; CSV only on export
+                        loaded_tickers.append(ticker)
+                        step_result += f"Fetched {len(table)} rows for {ticker}\n"
+                        
+                        # Add data excerpt for LLM synthesis (First 5 and Last 5 rows)
+                        results.append(f"Market Data for {ticker}:\n{table.excerpt(5, 5)}")
+                elif ticker:
+                    loaded_tickers.append(ticker)
+                    step_result += f"Using cached data for {ticker}\n"
+        
+        elif tool_name == 'search' and i in ctx.get('duplicate_searches', {}):
+            step_result += f"Same search as step {ctx['duplicate_searches'][i]}; see its results."
+        
+        elif tool_name == 'search':
+            query = tool_choice['params'].get('query', step)
+            result = search_web(query)
+            step_result += result['content']
+            sources.extend(result['sources'])  # Collect sources
+        
+        elif tool_name == 'chart':
+            ticker = tool_choice['params'].get('ticker', extract_ticker(step))
+            # Only data from before this turn or from the market steps this chart waited for
+            snapshot = visible_market_data(ctx, upstream)
+            # Check if this is a comparison request (multiple tickers in market_data)
+            if len(snapshot) > 1:
+                # Generate comparison chart with all tickers
+                fig = generate_comparison_chart(snapshot)
+                if isinstance(fig, str):
+                    print(f"[CHART ERROR] {fig}")
+                    step_result += f"Chart generation skipped"
+                else:
+                    if fig not in ctx['charts']:  # Avoid duplicate charts
+                        ctx['charts'].append(fig)
                         charts.append(fig)
-                        # Save persistent image
-                        try:
-                            path = f"/tmp/chart_{ticker}_{len(chart_paths)}.png"
-                            fig.write_image(path)
-                            chart_paths.append(path)
-                        except Exception as e:
-                            print(f"Failed to save chart image: {e}")
-                        step_result += f"Chart generated for {ticker}"
+                        chart_figures.append(fig)  # Kept for email attachments
+                    step_result += f"Comparison chart generated for {', '.join(snapshot.keys())}"
+            elif ticker and ticker in snapshot:
+                fig = generate_chart(ticker, snapshot[ticker])
+                if isinstance(fig, str):
+                    print(f"[CHART ERROR] {fig}")
+                    step_result += f"Chart generation skipped for {ticker}"
                 else:
-                    step_result += f"Note: Chart skipped - no market data for {ticker}"
+                    ctx['charts'].append(fig)
+                    charts.append(fig)
+                    chart_figures.append(fig)  # Kept for email attachments
+                    step_result += f"Chart generated for {ticker}"
+            else:
+                step_result += f"Note: Chart skipped - no market data for {ticker}"
+        
+        elif tool_name == 'email':
+            from tools.email import format_report_html
+            
+            # Everything the email reports on comes from the steps it waited for
+            prior_results = [r for output in upstream for r in output['results']]
+            prior_sources = [s for output in upstream for s in output['sources']]
+            
+            # Default to user's configured email ONLY if explicitly requested as "my email"
+            # Otherwise, if recipient is missing or generic, we should have caught this in planner
+            recipient = tool_choice['params'].get('recipient', '')
+            
+            # Regex Fallback: If LLM failed to extract email but it's in the step description
+            if not recipient or '@' not in recipient:
+                match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', step)
+                if match:
+                    recipient = match.group(0)
+                    print(f"[SUPERVISOR] Recovered recipient from step text: {recipient}")
+            
+            if not recipient or recipient == 'user@example.com':
+                step_result += "Error: No recipient email provided. Please specify an email address."
+                return {"results": [step_result], "charts": charts, "sources": sources}
+            
+            # Generate smart email body using LLM
+            # Conversation context: running summary + recent turns, within the email budget
+            history_text = memory_history_text(ctx['memory'], ctx['messages'], TOKEN_BUDGETS["email"])
+            
+            email_prompt = f"""You are a professional financial assistant drafting an email report.
             
-            elif tool_name == 'email':
-                from tools.email import format_report_html
-                import os
-                
-                # Default to user's configured email ONLY if explicitly requested as "my email"
-                # Otherwise, if recipient is missing or generic, we should have caught this in planner
-                recipient = tool_choice['params'].get('recipient', '')
-                
-                # Regex Fallback: If LLM failed to extract email but it's in the step description
-                if not recipient or '@' not in recipient:
-                    match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', step)
-                    if match:
-                        recipient = match.group(0)
-                        print(f"[SUPERVISOR] Recovered recipient from step text: {recipient}")
-                
-                if not recipient or recipient == 'user@example.com':
-                     step_result += "Error: No recipient email provided. Please specify an email address."
-                     results.append(step_result)
-                     continue
-                
-                # Generate smart email body using LLM
-                # Use FULL conversation history for context
-                history_text = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in state['messages']])
-                
-                email_prompt = f"""You are a professional financial assistant drafting an email report.
-                
 CONTEXT from conversation history:
 {history_text}
 
 NEW FINDINGS from current tool execution:
-{chr(10).join(results)}
+{chr(10).join(prior_results)}
 
 TASK:
 Write a comprehensive email body.
@@ -143,28 +447,28 @@ Write a comprehensive email body.
 - Mention that charts and data are attached.
 - Be professional and concise."""
 
-                subject = tool_choice['params'].get('subject', 'Financial Analysis Report')
-                
-                # If subject is generic, try to make it dynamic from history
-                if subject == 'Financial Analysis Report':
-                    try:
-                        subject_prompt = f"Generate a short email subject (max 5 words) based on this conversation:\n{company_names if 'company_names' in locals() else history_text[:500]}\n\nSubject:"
-                        subject_response = llm.invoke([{"role": "user", "content": subject_prompt}])
-                        dynamic_subject = subject_response.content.strip().strip('"').strip("'")
-                        subject = f"Multi-Agent Task Solver | {dynamic_subject}"
-                    except:
-                        pass # Keep default
-                
+            subject = tool_choice['params'].get('subject', 'Financial Analysis Report')
+            
+            # If subject is generic, try to make it dynamic from history
+            if subject == 'Financial Analysis Report':
                 try:
-                    email_body_response = llm.invoke([{"role": "user", "content": email_prompt}])
-                    email_body_text = email_body_response.content
+                    subject_prompt = f"Generate a short email subject (max 5 words) based on this conversation:\n{history_text[:500]}\n\nSubject:"
+                    subject_response = get_llm("email_subject").invoke([{"role": "user", "content": subject_prompt}])
+                    dynamic_subject = subject_response.content.strip().strip('"').strip("'")
+                    subject = f"Multi-Agent Task Solver | {dynamic_subject}"
                 except:
-                    email_body_text = ""
+                    pass # Keep default
+            
+            try:
+                email_body_response = get_llm("email_body").invoke([{"role": "user", "content": email_prompt}])
+                email_body_text = email_body_response.content
+            except:
+                email_body_text = ""
 
-                # Robust Fallback: If AI returns empty/short gibberish, use conversation summary
-                if not email_body_text or len(email_body_text) < 50:
-                    print("[EMAIL WARNING] AI generated empty body. Using fallback.")
-                    email_body_text = f"""
+            # Robust Fallback: If AI returns empty/short gibberish, use conversation summary
+            if not email_body_text or len(email_body_text) < 50:
+                print("[EMAIL WARNING] AI generated empty body. Using fallback.")
+                email_body_text = f"""
 Hello,
 
 Here is the financial report you requested based on our conversation.
@@ -175,116 +479,160 @@ SUMMARY OF RECENT ACTIVITY:
 Please find the requested charts and data attached.
 """
 
-                # Format report as HTML
-                html_body = format_report_html(
-                    title=subject,
-                    content=email_body_text,
-                    sources=sources if sources else None
-                )
-                
-                # Attachments: ALL Charts (accumulated) + ALL Data (accumulated)
-                email_attachments = []
-                
-                # 1. Accumulated Charts
-                email_attachments.extend(chart_paths)
-                
-                # 2. Accumulated CSV Data
-                for ticker, csv_content in market_data.items():
-                    csv_path = f"/tmp/{ticker}_data.csv"
-                    with open(csv_path, 'w') as f:
-                        f.write(csv_content)
-                    email_attachments.append(csv_path)
-                
-                # Send email with attachments
-                print(f"[EMAIL] Sending to {recipient} with {len(email_attachments)} attachments...")
-                result = send_email(recipient, subject, html_body, attachments=email_attachments if email_attachments else None)
-                print(f"[EMAIL] Result: {result}")
-                step_result += result
+            # Attachments: ALL Data (accumulated, one ZIP) + ALL Charts (accumulated),
+            # content-addressed on disk and capped by a total size budget
+            bundle = build_attachments(chart_figures, visible_market_data(ctx, upstream))
+            email_attachments = bundle["paths"]
+            if bundle["skipped"]:
+                email_body_text += f"\n\nNot attached (size limit): {', '.join(bundle['skipped'])}"
             
-            elif tool_choice['tool'] == 'logic':
-                # Python code execution would go here
-                step_result += "(Logic tool not yet implemented)"
+            # Format report as HTML
+            html_body = format_report_html(
+                title=subject,
+                content=email_body_text,
+                sources=prior_sources if prior_sources else None
+            )
             
+            # Queue email with attachments; the outbox delivers it in the background
+            print(f"[EMAIL] Queueing for {recipient} with {len(email_attachments)} attachments...")
+            queued = queue_email(recipient, subject, html_body, attachments=email_attachments if email_attachments else None)
+            if "error" in queued:
+                step_result += queued["error"]
             else:
-                step_result += "(No suitable tool found for this step)"
+                ctx['queued_emails'].append(queued["id"])
+                step_result += queued["message"]
+            print(f"[EMAIL] Result: {step_result}")
         
-        except Exception as e:
-            step_result += f"Error: {str(e)}"
+        elif tool_name == 'logic':
+            expression = f"{step} {tool_choice['params'].get('expression', '')}"
+            metrics = requested_metrics(expression)
+            snapshot = visible_market_data(ctx, upstream)
+            # Price analytics only for steps about specific tickers (named by the
+            # planner or in the text); "compound return of $10000" is a calculation
+            named = tool_choice['params'].get('tickers') or tickers_in(expression, snapshot)
+            if metrics and named:
+                loaded = [t for t in named if t in snapshot]
+                if loaded:
+                    # Returns / volatility / RSI / ... computed locally, not by the LLM
+                    report = format_analytics(compute_analytics(snapshot), metrics, loaded)
+                    step_result += f"Computed from loaded price data:\n{report}"
+                else:
+                    step_result += f"No market data loaded for {', '.join(named)}; fetch prices before computing analytics."
+            else:
+                # Anything else: LLM-written Python, run in the sandbox pool
+                step_result += run_calculation(expression, snapshot)
         
-        results.append(step_result)
+        else:
+            step_result += "(No suitable tool found for this step)"
     
-    # FINAL SYNTHESIS: Use LLM to create a coherent natural language summary
-    print("\n[SUPERVISOR] Synthesizing final report...")
+    except Exception as e:
+        step_result += f"Error: {str(e)}"
+    
+    results.append(step_result)
+    return {"results": results, "charts": charts, "sources": sources, "tickers": loaded_tickers}
+
+
+async def aexecute_step(i: int, total: int, step: str, tool_choice: dict, ctx: dict, upstream: list) -> dict:
+    """
+    Async execute_step. Searches are awaited directly; every other tool
+    blocks on network, CPU or SMTP and runs in a worker thread.
+    """
+    tool_name = tool_choice['tool'].lower().strip()
     
-    # Check if this is a chart-only request (no text needed)
-    chart_only = len(charts) > 0 and len(results) <= len(charts)
+    if tool_name != 'search' or i in ctx.get('duplicate_searches', {}):
+        return await asyncio.to_thread(execute_step, i, total, step, tool_choice, ctx, upstream)
     
-    if chart_only:
-        # User only wants charts, skip text synthesis
-        final_report = ""
-    else:
-        # Generate text summary
-        llm = get_llm()
-        # Truncate results to avoid token limits
-        results_text = "\n".join(results)
-        if len(results_text) > 12000:
-            results_text = results_text[:12000] + "... (truncated)"
-
-        synthesis_prompt = f"""You are a smart financial assistant.
-The user asked a question and we ran some tools to get data.
-Here is the raw data collected:
+    print(f"\n[SUPERVISOR] Step {i}/{total}: {step}")
+    print(f"[SUPERVISOR] Routing to: {tool_name}")
+    
+    step_result = f"### Step {i}: {step}\n\n"
+    sources = []
+    try:
+        result = await asearch_web(tool_choice['params'].get('query', step))
+        step_result += result['content']
+        sources.extend(result['sources'])
+    except Exception as e:
+        step_result += f"Error: {str(e)}"
+    
+    return {"results": [step_result], "charts": [], "sources": sources}
 
-{results_text}
 
-YOUR TASK:
-Synthesize this into a direct, human-like answer.
-- IGNORE tool log messages like "Fetched 20 rows" or "Using cached data".
-- Focus on the *actual values* (prices, dates, news headlines).
-- If asked about a trend, describe the trend (up/down/volatility) using the data.
-- Do not meta-explain ("Based on the data...", "The tools found..."). Just answer.
-- Be concise but professional."""
+CODEGEN_PROMPT = """Write Python code for this calculation:
+{expression}
 
-        try:
-            synthesis_response = llm.invoke([{"role": "user", "content": synthesis_prompt}])
-            final_report = synthesis_response.content
-        except Exception as e:
-            print(f"[SYNTHESIS ERROR] {e}")
-            # Retry with shorter prompt if first fails
-            try:
-                short_prompt = f"Summarize this data briefly: {results_text[:4000]}"
-                response = llm.invoke([{"role": "user", "content": short_prompt}])
-                final_report = response.content
-            except:
-                final_report = "I gathered the data but couldn't generate a summary. Please check the logs."
+Available without importing: np (numpy), pd (pandas), math, and `prices`, a dict of
+DataFrames (columns Date, Open, High, Low, Close, Volume) for: {tickers}.
+You may also import math, statistics, datetime, decimal, fractions, itertools, collections, json, re.
+There is no file or network access.
+Assign the final answer to a variable named `result` (a number, string or small table).
+
+Output ONLY the code in a ```python block."""
+
+
+def run_calculation(expression: str, market_data: dict) -> str:
+    """
+    Has the LLM write Python for a calculation step and runs it in the sandbox.
     
-    # Check for email confirmation in results and append to final report if not present
-    email_confirmations = [r for r in results if "Email sent to" in r]
-    if email_confirmations:
-        for confirmation in email_confirmations:
-            # Extract just the relevant line
-            lines = confirmation.split('\n')
-            for line in lines:
-                if "Email sent to" in line:
-                    final_report += f"\n\n✅ {line}"
+    Returns:
+        Text for synthesis: the code, its result and printed output (or the error)
+    """
+    try:
+        prompt = CODEGEN_PROMPT.format(expression=expression, tickers=", ".join(market_data) or "(none loaded)")
+        response = get_llm("codegen").invoke([{"role": "user", "content": prompt}])
+    except Exception as e:
+        return f"Could not generate code: {e}"
     
-    return {
-        "final_report": final_report, 
-        "charts": charts, 
-        "sources": sources,
-        "context_data": {
-            "market_data": market_data,
-            "chart_paths": chart_paths
-        }
-    }
+    match = re.search(r'```(?:python)?\s*(.*?)```', response.content, re.DOTALL)
+    code = (match.group(1) if match else response.content).strip()
+    
+    run = run_code(code, market_data)
+    print(f"[SANDBOX] ok={run['ok']} in {run['seconds']:.3f}s")
+    
+    text = f"Python calculation:\n```python\n{code}\n```\n"
+    if run['ok']:
+        if run['result'] is not None:
+            text += f"Result: {run['result']}\n"
+        if run['stdout']:
+            text += f"Output:\n{run['stdout']}\n"
+    else:
+        text += f"Calculation failed: {run['error']}\n"
+    return text
 
 
 def decide_tool(step: str) -> dict:
     """
     Use LLM to decide which tool to use for a given step.
     """
-    llm = get_llm()
+    llm = get_llm("router")
+    
+    try:
+        response = llm.invoke([{"role": "user", "content": router_prompt(step)}])
+        tool_choice = route_from_response(response.content, step)
+        if tool_choice:
+            return tool_choice
+    except:
+        pass
+    
+    return keyword_route(step)
+
+
+async def adecide_tool(step: str) -> dict:
+    """Async decide_tool()."""
+    llm = get_llm("router")
+    
+    try:
+        response = await llm.ainvoke([{"role": "user", "content": router_prompt(step)}])
+        tool_choice = route_from_response(response.content, step)
+        if tool_choice:
+            return tool_choice
+    except:
+        pass
     
-    prompt = f"""You are a tool router. Given a task step, decide which tool to use.
+    return keyword_route(step)
+
+
+def router_prompt(step: str) -> str:
+    return f"""You are a tool router. Given a task step, decide which tool to use.
 
 AVAILABLE TOOLS:
 - market: Fetch stock/crypto price data (requires ticker)
@@ -302,25 +650,36 @@ Respond with JSON:
 }}
 
 Output ONLY JSON."""
-    
-    try:
-        response = llm.invoke([{"role": "user", "content": prompt}])
-        content = response.content.strip()
-        content = re.sub(r'```json\s*|\s*```', '', content)
-        return json.loads(content)
-    except:
-        # Fallback to keyword matching
-        step_lower = step.lower()
-        if any(word in step_lower for word in ['fetch', 'price', 'data', 'stock']):
-            return {"tool": "market", "params": {"ticker": extract_ticker(step)}}
-        elif any(word in step_lower for word in ['search', 'news', 'why', 'research']):
-            return {"tool": "search", "params": {"query": step}}
-        elif any(word in step_lower for word in ['chart', 'graph', 'plot', 'visualize']):
-            return {"tool": "chart", "params": {"ticker": extract_ticker(step)}}
-        elif any(word in step_lower for word in ['email', 'send']):
-            return {"tool": "email", "params": {}}
-        else:
-            return {"tool": "logic", "params": {}}
+
+
+def route_from_response(content: str, step: str):
+    """Validated tool call from the router's JSON reply, or None. Raises on malformed JSON."""
+    content = content.strip()
+    content = re.sub(r'```json\s*|\s*```', '', content)
+    data = json.loads(content)
+    tool_choice = validate_tool_call(data)
+    if not tool_choice and isinstance(data, dict):
+        # Fill required params the router left out from the step text
+        params = dict(data.get('params') or {})
+        params.setdefault('query', step)
+        params.setdefault('ticker', extract_ticker(step) or '')
+        tool_choice = validate_tool_call({"tool": data.get('tool'), "params": params})
+    return tool_choice
+
+
+def keyword_route(step: str) -> dict:
+    """Fallback to keyword matching."""
+    step_lower = step.lower()
+    if any(word in step_lower for word in ['fetch', 'price', 'data', 'stock']):
+        return {"tool": "market", "params": {"ticker": extract_ticker(step)}}
+    elif any(word in step_lower for word in ['search', 'news', 'why', 'research']):
+        return {"tool": "search", "params": {"query": step}}
+    elif any(word in step_lower for word in ['chart', 'graph', 'plot', 'visualize']):
+        return {"tool": "chart", "params": {"ticker": extract_ticker(step)}}
+    elif any(word in step_lower for word in ['email', 'send']):
+        return {"tool": "email", "params": {}}
+    else:
+        return {"tool": "logic", "params": {}}
 
 
 def extract_ticker(text: str) -> str:
@@ -1,10 +1,32 @@
 import chainlit as cl
 from agents.graph import graph
+from tools.sandbox import warm_up as warm_up_sandbox
+from tools.file_parser import parse_uploaded_file, summarize_file_for_llm
+from tools.retrieval import index_document
+from tools.outbox import email_status, resume as resume_outbox
 import plotly.graph_objects as go
+import asyncio
+import time
+
+# Token stream batching: flush to the UI every N chars or T seconds
+STREAM_FLUSH_CHARS = 40
+STREAM_FLUSH_SECONDS = 0.05
+
+# How long the UI keeps checking on queued emails before leaving them to the outbox
+EMAIL_CONFIRM_SECONDS = 120
+EMAIL_POLL_SECONDS = 1.0
+
+# Running confirm_emails tasks; the event loop only keeps weak references
+_background_tasks = set()
 
 @cl.on_chat_start
 async def start():
     """Initialize the chat session"""
+    # Calculation workers import numpy/pandas in the background before they are needed
+    warm_up_sandbox()
+    # Deliver emails still queued from a previous run
+    resume_outbox()
+    
     await cl.Message(
         content="""**Welcome to Multi-Agent Task Solver (Financial Domain)**
 
@@ -27,23 +49,94 @@ What would you like to explore?""",
     # Initialize with empty list
     # Initialize session state
     cl.user_session.set("chat_history", [])
-    cl.user_session.set("context_data", {"market_data": {}, "chart_paths": []})
+    cl.user_session.set("context_data", {"market_data": {}, "chart_figures": []})
+
+
+async def index_uploads(elements: list, context_data: dict) -> list:
+    """
+    Parses and indexes files attached to a message (off the event loop).
+    Indexed files are listed in context_data['documents'] for retrieval
+    during synthesis.
+    
+    Returns:
+        One "[Attached ...]" note per file, for the user message
+    """
+    notes = []
+    documents = context_data.setdefault("documents", [])
+    for element in elements or []:
+        path = getattr(element, "path", None)
+        if not path:
+            continue
+        parsed = await asyncio.to_thread(parse_uploaded_file, path)
+        try:
+            if "error" in parsed:
+                notes.append(f"[Attached {element.name}: {parsed['error']}]")
+                continue
+            key = await asyncio.to_thread(index_document, path, parsed)
+            summary = summarize_file_for_llm(parsed).splitlines()[0]
+            if all(doc["hash"] != key for doc in documents):
+                documents.append({"name": element.name, "hash": key, "summary": summary})
+            notes.append(f"[Attached {element.name}: {summary}]")
+        except Exception as e:
+            notes.append(f"[Attached {element.name}: could not be indexed ({e})]")
+        finally:
+            if parsed.get("workbook"):
+                parsed["workbook"].close()
+    return notes
+
+
+def email_outcome(status: dict) -> str:
+    """One-line delivery message for an outbox status."""
+    if status["status"] == "sent":
+        attachment_info = f" with {status['attachments']} attachment(s)" if status["attachments"] else ""
+        return f"✅ Email sent to {status['recipient']}{attachment_info}"
+    if status["status"] == "failed":
+        return f"❌ Email to {status['recipient']} could not be sent: {status['error']}"
+    return f"⏳ Email to {status['recipient']} is still queued (attempt {status['attempts']}); it will keep retrying in the background."
+
+
+async def confirm_emails(message_ids: list):
+    """Posts a confirmation for each queued email once the outbox has sent it (or given up)."""
+    pending = list(message_ids)
+    deadline = time.monotonic() + EMAIL_CONFIRM_SECONDS
+    while pending and time.monotonic() < deadline:
+        await asyncio.sleep(EMAIL_POLL_SECONDS)
+        for message_id in list(pending):
+            status = await asyncio.to_thread(email_status, message_id)
+            if status is None:
+                pending.remove(message_id)
+            elif status["status"] in ("sent", "failed"):
+                pending.remove(message_id)
+                await cl.Message(content=email_outcome(status)).send()
+    
+    for message_id in pending:
+        status = await asyncio.to_thread(email_status, message_id)
+        if status:
+            await cl.Message(content=email_outcome(status)).send()
 
 
 @cl.on_message
 async def main(message: cl.Message):
     """Handle incoming messages"""
     chat_history = cl.user_session.get("chat_history") or []
+    context_data = cl.user_session.get("context_data") or {"market_data": {}, "chart_figures": []}
+    
+    content = message.content
+    if message.elements:
+        async with cl.Step(name=f"Reading {len(message.elements)} file(s)", type="tool") as upload_step:
+            notes = await index_uploads(message.elements, context_data)
+            upload_step.output = "\n".join(notes)
+        cl.user_session.set("context_data", context_data)
+        content = "\n".join([content] + notes).strip()
     
     # Add user message
-    chat_history.append({"role": "user", "content": message.content})
+    chat_history.append({"role": "user", "content": content})
     cl.user_session.set("chat_history", chat_history)
     
-    context_data = cl.user_session.get("context_data") or {"market_data": {}, "chart_paths": []}
-    
     initial_state = {
         "messages": chat_history,
         "plan": [],
+        "tool_calls": [],
         "is_ambiguous": False,
         "clarifying_question": "",
         "final_report": "",
@@ -52,6 +145,11 @@ async def main(message: cl.Message):
         "context_data": context_data
     }
     
+    # Graph events: "updates" (node outputs) + "custom" (synthesis tokens).
+    # The async generator is consumed in stages so the report renders below the
+    # steps; nodes run on this event loop without blocking other sessions.
+    events = graph.astream(initial_state, stream_mode=["updates", "custom"])
+    
     # Planning step (collapsible)
     async with cl.Step(name="Planning", type="run") as planning_step:
         final_state = None
@@ -59,7 +157,9 @@ async def main(message: cl.Message):
         charts = []  # Store any charts generated
         
         try:
-            for event in graph.stream(initial_state):
+            async for mode, event in events:
+                if mode != "updates":
+                    continue
                 for key, value in event.items():
                     
                     if key == 'planner':
@@ -71,6 +171,9 @@ async def main(message: cl.Message):
                             await cl.Message(content=response).send()
                             chat_history.append({"role": "assistant", "content": response})
                             cl.user_session.set("chat_history", chat_history)
+                            # Keep the planner's conversation memory
+                            if "context_data" in value:
+                                cl.user_session.set("context_data", value["context_data"])
                             return
                         else:
                             plan = value.get('plan', [])
@@ -78,6 +181,9 @@ async def main(message: cl.Message):
                             planning_step.output = plan_text
                     
                     final_state = value
+                
+                if plan is not None:
+                    break
         
         except Exception as e:
             planning_step.output = f"Error: {e}"
@@ -90,16 +196,49 @@ async def main(message: cl.Message):
             step_list = "\n".join([f"- {step}" for step in plan])
             execution_step.output = f"Running:\n{step_list}"
     
-    # Send final response with streaming
+    # Stream the report as the synthesis produces it, flushing in small batches
+    msg = cl.Message(content="")
+    msg_sent = False
+    streamed = ""
+    buffer = []
+    last_flush = time.monotonic()
+    
+    try:
+        async for mode, event in events:
+            if mode == "custom" and event.get("type") == "token":
+                buffer.append(event["content"])
+                if sum(len(t) for t in buffer) >= STREAM_FLUSH_CHARS or time.monotonic() - last_flush >= STREAM_FLUSH_SECONDS:
+                    if not msg_sent:
+                        await msg.send()
+                        msg_sent = True
+                    text = "".join(buffer)
+                    buffer.clear()
+                    await msg.stream_token(text)
+                    streamed += text
+                    last_flush = time.monotonic()
+            elif mode == "updates":
+                for key, value in event.items():
+                    final_state = value
+    
+    except Exception as e:
+        await cl.Message(content=f"**Error:** {str(e)}").send()
+        return
+    
+    # Send final response (whatever was not streamed yet)
     if final_state and "final_report" in final_state and final_state["final_report"]:
         response = final_state["final_report"]
         
-        # Stream the response
-        msg = cl.Message(content="")
-        await msg.send()
+        if not msg_sent:
+            await msg.send()
         
-        for char in response:
-            await msg.stream_token(char)
+        if response.startswith(streamed):
+            # Remaining buffered tokens plus anything appended after synthesis
+            remainder = response[len(streamed):]
+            if remainder:
+                await msg.stream_token(remainder)
+        else:
+            # Synthesis was retried after a partial stream; show the final text
+            msg.content = response
         
         await msg.update()
         
@@ -124,8 +263,14 @@ async def main(message: cl.Message):
         chat_history.append({"role": "assistant", "content": response})
         cl.user_session.set("chat_history", chat_history)
         
-        # Persist context data (market CSVs, charts)
+        # Persist context data (market data tables, charts)
         if "context_data" in final_state:
             cl.user_session.set("context_data", final_state["context_data"])
+        
+        # Emails were only queued; confirm them when the outbox reports back
+        if final_state.get("queued_emails"):
+            task = asyncio.create_task(confirm_emails(final_state["queued_emails"]))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
     else:
         await cl.Message(content="Task completed.").send()
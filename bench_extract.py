@@ -0,0 +1,73 @@
+"""
+Benchmark: BeautifulSoup vs streaming HTML text extraction
+
+Usage:
+    python bench_extract.py [pages_dir] [max_length]
+
+pages_dir holds saved pages (*.html / *.htm). Without one, a synthetic
+multi-megabyte news page is generated so the script always runs.
+"""
+import sys
+import time
+from pathlib import Path
+from tools.search import extract_text
+from tools.html_extract import extract_text_streaming
+
+CHUNK_SIZE = 16 * 1024
+REPEAT = 5
+
+
+def synthetic_page(paragraphs: int = 20000) -> str:
+    nav = "<nav>" + "".join(f"<a href='/s{i}'>Section {i}</a>" for i in range(200)) + "</nav>"
+    script = "<script>" + "var x = 1;" * 20000 + "</script>"
+    body = "".join(f"<p>Paragraph {i}: shares moved on heavy volume as analysts updated targets.</p>" for i in range(paragraphs))
+    return f"<html><head><title>Test</title>{script}</head><body><header>Site</header>{nav}<article>{body}</article><footer>Footer</footer></body></html>"
+
+
+def chunked(html: str):
+    for i in range(0, len(html), CHUNK_SIZE):
+        yield html[i:i + CHUNK_SIZE]
+
+
+def best_time(fn) -> float:
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+pages_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else None
+max_length = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+if pages_dir and pages_dir.is_dir():
+    pages = {p.name: p.read_text(errors='replace') for p in sorted(pages_dir.glob('*.htm*'))}
+else:
+    print("No corpus directory given; using a synthetic page.")
+    pages = {"synthetic.html": synthetic_page()}
+
+print("=" * 60)
+print(f"EXTRACTION BENCHMARK ({len(pages)} page(s), max_length={max_length}, best of {REPEAT})")
+print("=" * 60)
+
+total_soup = 0.0
+total_stream = 0.0
+agree = 0
+
+for name, html in pages.items():
+    soup_time = best_time(lambda: extract_text(html, max_length))
+    stream_time = best_time(lambda: extract_text_streaming(chunked(html), max_length))
+    total_soup += soup_time
+    total_stream += stream_time
+
+    same = extract_text(html, max_length) == extract_text_streaming(chunked(html), max_length)
+    agree += same
+
+    print(f"{name[:32]:32} {len(html) / 1024:8.0f} KB  soup {soup_time * 1000:8.1f} ms  "
+          f"stream {stream_time * 1000:8.1f} ms  x{soup_time / max(stream_time, 1e-9):6.1f}  "
+          f"{'same' if same else 'DIFFERENT'}")
+
+print("-" * 60)
+print(f"Total: soup {total_soup * 1000:.1f} ms, stream {total_stream * 1000:.1f} ms "
+      f"(x{total_soup / max(total_stream, 1e-9):.1f}); identical output on {agree}/{len(pages)} page(s)")
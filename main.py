@@ -1,11 +1,17 @@
 from agents.graph import graph
+from tools.outbox import wait_for_delivery, resume as resume_outbox
+
+# Seconds to wait for queued emails before returning to the prompt
+EMAIL_CONFIRM_SECONDS = 60
 
 def main():
     print("=== Multi-Agent Financial Analyst (CLI Mode) ===")
     print("Type 'quit' to exit.")
+    resume_outbox()
     
     # Simple history setup for the session
     chat_history = []
+    context_data = {"market_data": {}, "chart_figures": []}
     
     while True:
         user_input = input("\nUser: ")
@@ -19,11 +25,13 @@ def main():
         initial_state = {
             "messages": chat_history,
             "plan": [],
+            "tool_calls": [],
             "is_ambiguous": False,
             "clarifying_question": "",
             "final_report": "",
             "charts": [],
-            "sources": []
+            "sources": [],
+            "context_data": context_data
         }
         
         print("\n[Thinking...]")
@@ -47,6 +55,10 @@ def main():
                 elif key == 'supervisor':
                     print("Execution complete.")
                 
+                # Carry memory / market data over to the next turn
+                if value.get("context_data"):
+                    context_data = value["context_data"]
+                
                 final_state = value
 
         # Handle Final Output
@@ -66,6 +78,13 @@ def main():
             
             print(f"\nAgent: {response}")
             chat_history.append({"role": "assistant", "content": response})
+            
+            # Emails are delivered by the background outbox; report how that went
+            if final_state.get("queued_emails"):
+                for status in wait_for_delivery(final_state["queued_emails"], EMAIL_CONFIRM_SECONDS):
+                    if status:
+                        print(f"[EMAIL] #{status['id']} to {status['recipient']}: {status['status']}"
+                              + (f" ({status['error']})" if status['error'] else ""))
 
 if __name__ == "__main__":
     main()
@@ -17,16 +17,16 @@ if result['error']:
 
 print(f"✓ {result['message']}")
 print("\nCSV Data (first 500 chars):")
-print(result['csv'][:500])
+print(result['data'].to_csv()[:500])
 print("\n")
 
 # Test 2: Generate chart
 print("=" * 60)
-print("TEST 2: Generating chart from pure CSV")
+print("TEST 2: Generating chart from PriceTable")
 print("=" * 60)
 
-# Pass pure CSV to chart (this is what supervisor does now)
-fig = generate_chart("NVDA", result['csv'])
+# Pass the columnar table to chart (this is what supervisor does now)
+fig = generate_chart("NVDA", result['data'])
 
 if isinstance(fig, str):
     print(f"❌ ERROR: {fig}")
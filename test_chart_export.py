@@ -0,0 +1,52 @@
+"""
+Tests for chart export pool recovery and cache eviction (run with pytest)
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import plotly.graph_objects as go
+import pytest
+
+from tools import chart_export
+
+
+def test_broken_pool_is_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(chart_export, "CHART_CACHE_DIR", tmp_path)
+    broken = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result(timeout=60)
+    monkeypatch.setattr(chart_export, "_pool", broken)
+
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]), layout={"title": {"text": "Recovery"}})
+    path, future = chart_export._submit(fig)
+    try:
+        assert path is None and future is not None
+        assert chart_export._pool is not broken
+        future.exception(timeout=120)  # Finishes either way (PNG export may be unavailable here)
+    finally:
+        chart_export._pool.shutdown(cancel_futures=True)
+
+
+def make_file(directory, name: str, size: int, age: float):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_prune_directory_evicts_old_then_least_recent(tmp_path):
+    hour = 3600
+    expired = make_file(tmp_path, "expired.png", 10, 30 * 24 * hour)
+    oldest = make_file(tmp_path, "oldest.png", 400, 5 * hour)
+    older = make_file(tmp_path, "older.png", 400, 4 * hour)
+    recent = make_file(tmp_path, "recent.png", 400, 2 * hour)
+    fresh = make_file(tmp_path, "fresh.png", 400, 60)  # Inside the grace period
+
+    chart_export.prune_directory(tmp_path, max_bytes=1000, max_age=7 * 24 * hour, pattern="*.png")
+
+    assert not expired.exists() and not oldest.exists() and not older.exists()
+    assert recent.exists() and fresh.exists()
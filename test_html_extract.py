@@ -0,0 +1,47 @@
+"""
+Regression tests: streaming HTML extraction must match the BeautifulSoup path (run with pytest)
+"""
+import pytest
+
+from tools.html_extract import extract_text_streaming
+from tools.search import extract_text
+
+PAGES = {
+    "omitted </head>": "<html><head><title>x</title><body><p>Hello world</p></body></html>",
+    "self-closing br": "<html><body><p>line1<br/>line2</p></body></html>",
+    "self-closing img": "<html><body><p>before<img src='a.png'/>after</p></body></html>",
+    "skipped subtrees": (
+        "<html><head><title>t</title><style>p {}</style></head><body><header>Site</header>"
+        "<nav>Menu</nav><p>Kept text</p><script>var x;</script><footer>Foot</footer></body></html>"
+    ),
+    "article preferred": "<html><body><p>Teaser</p><article><p>Story</p><p>More</p></article></body></html>",
+    "main preferred": "<html><body><aside>Ad</aside><main>Main text</main><p>Other</p></body></html>",
+}
+
+
+def chunked(html: str, size: int):
+    for i in range(0, len(html), size):
+        yield html[i:i + size]
+
+
+@pytest.mark.parametrize("name", PAGES)
+def test_streaming_matches_soup(name):
+    html = PAGES[name]
+    assert extract_text_streaming([html]) == extract_text(html)
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_chunk_boundaries_do_not_change_output(size):
+    for html in PAGES.values():
+        assert extract_text_streaming(chunked(html, size)) == extract_text_streaming([html])
+
+
+def test_body_content_after_unclosed_head():
+    # No <body> either: the soup path finds nothing, the head still ends at the first body-level tag
+    html = "<html><head><title>x</title><meta charset='utf-8'><p>Hello world</p></html>"
+    assert extract_text_streaming([html]) == "Hello world"
+
+
+def test_truncation_matches_soup():
+    html = "<html><body><article>" + "".join(f"<p>Paragraph {i} text.</p>" for i in range(500)) + "</article></body></html>"
+    assert extract_text_streaming(chunked(html, 1024), max_length=200) == extract_text(html, max_length=200)
@@ -0,0 +1,150 @@
+"""
+Tests for the local market store's coverage bookkeeping (run with pytest; no network)
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from tools import price_store
+
+
+class FakeMarket:
+    """Stands in for yfinance: daily bars on the given dates, plus dividends / splits."""
+
+    def __init__(self, dates, close=100.0):
+        self.closes = {pd.Timestamp(d): close for d in dates}
+        self.splits = {}
+        self.fail = False
+        self.calls = []
+
+    def split(self, date, ratio):
+        """Adjusts all earlier bars, as Yahoo does once a split happens."""
+        date = pd.Timestamp(date)
+        self.splits[date] = ratio
+        for d in self.closes:
+            if d < date:
+                self.closes[d] /= ratio
+
+    def frame(self, start, end):
+        self.calls.append((pd.Timestamp(start), pd.Timestamp(end)))
+        dates = [d for d in sorted(self.closes) if pd.Timestamp(start) <= d < pd.Timestamp(end)]
+        if self.fail or not dates:
+            return pd.DataFrame()
+        closes = [self.closes[d] for d in dates]
+        return pd.DataFrame(
+            {
+                'Open': closes, 'High': closes, 'Low': closes, 'Close': closes, 'Volume': [1000] * len(dates),
+                'Dividends': [0.0] * len(dates), 'Stock Splits': [self.splits.get(d, 0.0) for d in dates],
+            },
+            index=pd.DatetimeIndex(dates, name='Date'),
+        )
+
+    def module(self, listed=("AAA",)):
+        history = lambda start, end, interval, actions=True: self.frame(start, end)
+
+        def download(tickers, start, end, **kwargs):
+            frames = {t: self.frame(start, end) for t in tickers if t in listed}
+            return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+        return SimpleNamespace(Ticker=lambda ticker: SimpleNamespace(history=history), download=download)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(price_store, "time", SimpleNamespace(time=lambda: clock.now, monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, clock):
+    monkeypatch.setattr(price_store, "MARKET_STORE_PATH", tmp_path / "market.sqlite")
+    monkeypatch.setattr(price_store, "_conn", None)
+    monkeypatch.setattr(price_store, "_empty_until", {})
+    return price_store
+
+
+def use(monkeypatch, market):
+    monkeypatch.setattr(price_store, "yf", market.module())
+
+
+def test_pre_ipo_backfill_is_covered(store, clock, monkeypatch):
+    market = FakeMarket(pd.bdate_range("2024-03-01", "2024-03-29"))
+    use(monkeypatch, market)
+    end = datetime(2024, 3, 29)
+
+    # The first request already reaches before the listing
+    assert len(store.load_prices("NEW", datetime(2024, 2, 1), end)) == 21
+    # Further back than that: the download reaches the first stored bar, so it is not empty
+    assert len(store.load_prices("NEW", datetime(2024, 1, 1), end)) == 21
+    clock.advance(store.MARKET_EMPTY_RETRY_SECONDS + 1)  # No retry pause hiding missing coverage
+    assert store.plan_sync("NEW", datetime(2024, 1, 1), end) == []
+
+
+def test_weekend_tail_is_covered(store, clock, monkeypatch):
+    market = FakeMarket(pd.bdate_range("2024-03-01", "2024-03-08"))  # Ends on a Friday
+    use(monkeypatch, market)
+    start, sunday = datetime(2024, 3, 1), datetime(2024, 3, 10)
+
+    store.load_prices("AAA", start, sunday)
+    # Stale tail re-sync on the weekend: the window reaches back to Friday's bar
+    clock.advance(store.MARKET_REFRESH_SECONDS + 1)
+    frame = store.load_prices("AAA", start, sunday)
+    assert frame['Date'].iloc[-1] == "2024-03-08"
+    clock.advance(store.MARKET_EMPTY_RETRY_SECONDS + 1)
+    assert store.plan_sync("AAA", start, sunday) == []
+
+
+def test_failed_download_is_not_covered(store, clock, monkeypatch):
+    market = FakeMarket(pd.bdate_range("2024-03-01", "2024-03-08"))
+    market.fail = True
+    use(monkeypatch, market)
+    start, end = datetime(2024, 3, 1), datetime(2024, 3, 8)
+
+    assert store.load_prices("AAA", start, end).empty
+    assert store.plan_sync("AAA", start, end) == []  # Paused, not covered
+
+    clock.advance(store.MARKET_EMPTY_RETRY_SECONDS + 1)
+    market.fail = False
+    assert store.plan_sync("AAA", start, end) == [(start, end)]
+    assert len(store.load_prices("AAA", start, end)) == 6
+
+
+def test_split_resyncs_stored_history(store, clock, monkeypatch):
+    market = FakeMarket(pd.bdate_range("2024-03-01", "2024-03-15"))
+    use(monkeypatch, market)
+    store.load_prices("AAA", datetime(2024, 3, 1), datetime(2024, 3, 8))
+
+    market.split("2024-03-12", 2.0)
+    clock.advance(store.MARKET_REFRESH_SECONDS + 1)
+    frame = store.load_prices("AAA", datetime(2024, 3, 1), datetime(2024, 3, 15))
+    assert frame['Close'].tolist() == [50.0] * 7 + [100.0] * 4
+
+    # The split is now known: the next sync only refreshes the tail
+    market.calls.clear()
+    clock.advance(store.MARKET_REFRESH_SECONDS + 1)
+    store.load_prices("AAA", datetime(2024, 3, 1), datetime(2024, 3, 15))
+    assert market.calls and all(start >= pd.Timestamp("2024-03-15") for start, _ in market.calls)
+
+
+def test_bulk_download_reports_missing_tickers(store, clock, monkeypatch):
+    market = FakeMarket(pd.bdate_range("2024-03-01", "2024-03-08"))
+    use(monkeypatch, market)
+    start, end = datetime(2024, 3, 1), datetime(2024, 3, 8)
+
+    results = store.load_prices_bulk(["AAA", "BAD"], start, end)
+    assert len(results["AAA"]) == 6
+    assert isinstance(results["BAD"], RuntimeError)
+    clock.advance(store.MARKET_EMPTY_RETRY_SECONDS + 1)
+    assert store.plan_sync("AAA", start, end) == []
+    assert store.plan_sync("BAD", start, end) == [(start, end)]
@@ -0,0 +1,83 @@
+"""
+Tests for document chunking, the BM25 index and answering from uploads (run with pytest; no network)
+"""
+import pandas as pd
+import pytest
+
+from agents import supervisor
+from agents.planner import plan_from_response
+from tools import retrieval
+from tools.file_parser import ExcelWorkbook
+from tools.retrieval import BM25Index, chunk_document
+
+
+def test_chunks_are_produced_lazily(tmp_path, monkeypatch):
+    path = tmp_path / "rows.csv"
+    pd.DataFrame({"ticker": ["AAA", "BBB"] * 10000, "weight": range(20000)}).to_csv(path, index=False)
+    blocks = []
+    read_csv = pd.read_csv
+
+    def counting_read_csv(*args, **kwargs):
+        for block in read_csv(*args, **kwargs):
+            blocks.append(len(block))
+            yield block
+
+    monkeypatch.setattr(retrieval.pd, "read_csv", counting_read_csv)
+    chunks = chunk_document({"type": "csv", "path": str(path)})
+    assert blocks == []
+    first = next(chunks)
+    assert first["location"] == "rows 1-20" and "ticker: AAA" in first["text"]
+    assert len(blocks) == 1
+
+
+def test_excel_sheets_are_read_one_at_a_time(tmp_path, monkeypatch):
+    path = tmp_path / "book.xlsx"
+    with pd.ExcelWriter(path) as writer:
+        for name in ("Q1", "Q2", "Q3"):
+            pd.DataFrame({"segment": [f"{name} revenue"] * 30}).to_excel(writer, sheet_name=name, index=False)
+    workbook = ExcelWorkbook(str(path))
+    monkeypatch.setattr(ExcelWorkbook, "load_all", lambda self: pytest.fail("indexing decoded every sheet at once"))
+
+    index = BM25Index.build(chunk_document({"type": "excel", "workbook": workbook}))
+    assert [c["location"] for c in index.chunks] == [
+        f"sheet {name}, rows {rows}" for name in ("Q1", "Q2", "Q3") for rows in ("1-20", "21-30")
+    ]
+    assert workbook._frames == {}  # Indexing does not keep sheets decoded
+    assert index.search("Q2 revenue", 1)[0][1]["location"].startswith("sheet Q2")
+
+
+def test_chunk_cap_stops_reading(monkeypatch):
+    monkeypatch.setattr(retrieval, "MAX_CHUNKS", 3)
+    pages = iter(["alpha beta"] * 10)
+    index = BM25Index.build(chunk_document({"type": "pdf", "page_texts": pages}))
+    assert len(index.chunks) == 3
+    assert len(list(pages)) == 7
+
+
+DOCUMENTS = [{"name": "10k.pdf", "hash": "abc", "summary": "PDF, 120 pages"}]
+QUESTION = [{"role": "user", "content": "[Attached 10k.pdf: PDF, 120 pages] What was data center revenue?"}]
+
+
+@pytest.mark.parametrize("reply", [
+    '{"intent": "DOCUMENT"}',
+    '{"intent": "ACTIONABLE", "plan": []}',
+])
+def test_document_questions_plan_no_search(reply):
+    update = plan_from_response(reply, QUESTION, {"documents": DOCUMENTS})
+    assert not update["is_ambiguous"] and update["plan"] == [] and update["tool_calls"] == []
+
+
+def test_document_intent_without_upload_asks_for_it():
+    assert plan_from_response('{"intent": "DOCUMENT"}', QUESTION, {})["is_ambiguous"]
+
+
+def test_empty_plan_is_answered_from_excerpts(monkeypatch):
+    hit = {"name": "10k.pdf", "location": "page 80", "text": "Data center revenue was 47.5 billion.", "score": 3.0}
+    monkeypatch.setattr(supervisor, "search_documents", lambda documents, question: [hit])
+    prompts = []
+    monkeypatch.setattr(supervisor, "synthesize", lambda results, charts, excerpts: prompts.append(excerpts) or "47.5 billion")
+    monkeypatch.setattr(supervisor, "search_web", lambda *args, **kwargs: pytest.fail("searched the web"))
+
+    update = supervisor.supervisor_node({"plan": [], "messages": QUESTION, "context_data": {"documents": DOCUMENTS}})
+    assert update["final_report"] == "47.5 billion"
+    assert "page 80" in prompts[0]
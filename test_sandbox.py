@@ -0,0 +1,108 @@
+"""
+Tests for the calculation sandbox: isolation and the worker reply protocol (run with pytest; Linux only)
+"""
+import json
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.price_table import PriceTable
+from tools.sandbox import SandboxPool
+
+pytestmark = pytest.mark.skipif(sys.platform != "linux", reason="sandbox workers need Linux (seccomp)")
+
+FIND_FD = """
+try:
+    1 / 0
+except ZeroDivisionError as e:
+    frame = e.__traceback__.tb_frame
+while frame is not None and 'fd' not in frame.f_locals:
+    frame = frame.f_back
+fd = frame.f_locals['fd']
+"""
+
+
+class Exploit:
+    def __reduce__(self):
+        return (print, ("PWNED from the parent",))
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SandboxPool(size=1)
+    yield pool
+    while not pool._idle.empty():
+        pool._idle.get().kill()
+
+
+def test_calculation_sees_prices(pool):
+    table = PriceTable.from_frame(pd.DataFrame({"Date": pd.date_range("2024-01-01", periods=5), "Close": np.arange(1.0, 6.0)}))
+    run = pool.run("result = float(prices['AAA']['Close'].sum())\nprint('done')", {"AAA": table})
+    assert run == {"ok": True, "result": 15.0, "stdout": "done\n", "error": None, "seconds": run["seconds"]}
+
+
+def test_environment_is_not_inherited(pool, monkeypatch):
+    monkeypatch.setenv("EMAIL_PASSWORD", "hunter2")
+    run = pool.run("result = dict(pd.io.common.os.environ)")
+    assert run["ok"] and "EMAIL_PASSWORD" not in run["result"]
+
+
+@pytest.mark.parametrize("code", [
+    "result = pd.io.common.os.popen('id').read()",
+    "result = pd.io.common.os.fork()",
+    "result = pd.io.common.os.sys.modules['_socket'].socket()",
+    "result = pd.io.common.os.open(" + repr(__file__) + ", 0)",
+    "result = pd.read_csv('/etc/passwd')",
+    "result = pd.io.common.os.open('/tmp/sandbox-escape', 65)",
+])
+def test_processes_network_and_files_are_refused(pool, code):
+    run = pool.run(code)
+    assert not run["ok"] and "PermissionError" in run["error"]
+
+
+def test_shell_commands_do_not_run(pool):
+    run = pool.run("result = pd.io.common.os.system('id')")
+    assert run["result"] != 0
+
+
+def test_frames_hold_no_pipe_or_job(pool):
+    code = """
+try:
+    1 / 0
+except ZeroDivisionError as e:
+    frame = e.__traceback__.tb_frame
+names = []
+while frame is not None:
+    names += [(k, type(v).__name__) for k, v in frame.f_locals.items()]
+    frame = frame.f_back
+result = [k for k, t in names if t == 'Connection' or k in ('job', 'conn')]
+"""
+    assert pool.run(code)["result"] == []
+
+
+@pytest.mark.parametrize("payload", [
+    pickle.dumps(Exploit()),
+    json.dumps({"id": -1, "ok": True, "result": "forged", "stdout": "", "error": None, "seconds": 0}).encode(),
+    b"not json",
+])
+def test_forged_replies_are_rejected(pool, capfd, payload):
+    code = FIND_FD + f"payload = {payload!r}\npd.io.common.os.write(fd, len(payload).to_bytes(4, 'big') + payload)\nresult = 'real'"
+    run = pool.run(code)
+    assert run == {"ok": False, "result": None, "stdout": "", "error": "Sandbox returned a malformed reply", "seconds": 0.0}
+    assert "PWNED" not in capfd.readouterr().out
+    # The tampered worker was replaced
+    assert pool.run("result = 1 + 1")["result"] == 2
+
+
+def test_oversized_reply_is_shortened(pool):
+    run = pool.run("result = ['x' * 4000] * 100 + [['y' * 4000] * 100]")
+    assert run["ok"] and isinstance(run["result"], str)
+
+
+def test_timeout_replaces_worker(pool):
+    run = pool.run("while True:\n    pass", timeout=2)
+    assert not run["ok"]
+    assert pool.run("result = 'alive'")["result"] == "alive"
@@ -0,0 +1,55 @@
+"""
+Tests for search query normalization, the query cache and in-turn dedup (run with pytest; no network)
+"""
+import pytest
+
+from agents.supervisor import prepare_steps
+from tools import search
+from tools.search import normalize_query
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Apple stock", "Apple news"),
+    ("NVIDIA news today", "NVIDIA news"),
+    ("recent Tesla earnings", "Tesla earnings"),
+    ("Microsoft vs Google", "Google vs Microsoft"),
+])
+def test_different_queries_keep_different_keys(a, b):
+    assert normalize_query(a) != normalize_query(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Apple stock", "apple   STOCK"),
+    ("NVIDIA news?", "nvidia news"),
+    ("AT&T, BRK.B outlook.", "at&t brk.b outlook"),
+])
+def test_layout_only_differences_share_a_key(a, b):
+    assert normalize_query(a) == normalize_query(b)
+
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    calls = []
+
+    def uncached(query, max_results, fetch_content, timelimit):
+        calls.append(query)
+        return {"content": f"results for {query}", "sources": [{"title": query, "url": "https://example.com"}]}
+
+    monkeypatch.setattr(search, "_search_web_uncached", uncached)
+    monkeypatch.setattr(search, "_search_cache", {})
+    return calls
+
+
+def test_cache_serves_only_identical_queries(fake_search):
+    assert search.search_web("Apple stock")["content"] == "results for Apple stock"
+    assert search.search_web("Apple news")["content"] == "results for Apple news"
+    assert search.search_web("apple stock!")["content"] == "results for Apple stock"
+    assert fake_search == ["Apple stock", "Apple news"]
+
+
+def test_in_turn_dedup_only_for_identical_queries():
+    queries = ["Apple stock", "Apple news", "apple  STOCK!"]
+    state = {"plan": [f"Search {q}" for q in queries], "messages": []}
+    choices = [{"tool": "search", "params": {"query": q}} for q in queries]
+    ctx, _ = prepare_steps(state, choices, {"market_data": {}})
+    assert ctx["duplicate_searches"] == {3: 1}
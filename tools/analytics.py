@@ -0,0 +1,196 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from tools.price_table import as_price_table
+
+VOLATILITY_WINDOW = 20
+SMA_WINDOWS = (20, 50)
+RSI_PERIOD = 14
+ANALYTICS_CACHE_MAX_ENTRIES = 64
+
+# Keyword -> metric group, used to read what a plan step asks for
+METRIC_KEYWORDS = {
+    "returns": ["return", "performance", "gain", "change"],
+    "volatility": ["volatil", "risk", "std", "deviation"],
+    "sma": ["moving average", "sma", " ma ", "ma20", "ma50", "trend"],
+    "rsi": ["rsi", "relative strength", "overbought", "oversold", "momentum"],
+    "drawdown": ["drawdown", "peak", "decline from"],
+    "correlation": ["correlat", "relationship", "move together", "co-move"],
+}
+
+_cache = OrderedDict()  # (ticker, version) tuple -> analytics dict
+_cache_lock = threading.Lock()
+
+
+def requested_metrics(text: str) -> set:
+    """Metric groups mentioned in a step / expression (empty if none)."""
+    text = f" {text.lower()} "
+    return {metric for metric, words in METRIC_KEYWORDS.items() if any(word in text for word in words)}
+
+
+def _closes(market_data: dict) -> pd.DataFrame:
+    """Wide Close-price frame (one column per ticker) on the union of all dates."""
+    series = {}
+    for ticker, data in market_data.items():
+        table = as_price_table(data)
+        if table.empty or 'Close' not in table.columns:
+            continue
+        series[ticker] = pd.Series(table.columns['Close'].astype(np.float64), index=table.dates)
+    if not series:
+        return pd.DataFrame()
+    return pd.concat(series, axis=1).sort_index()
+
+
+def _periods_per_year(index: pd.DatetimeIndex) -> float:
+    """Observations per year, inferred from the data (~252 for stocks, ~365 for crypto)."""
+    span_days = (index[-1] - index[0]).total_seconds() / 86400
+    if len(index) < 2 or span_days <= 0:
+        return 252.0
+    return (len(index) - 1) / (span_days / 365.25)
+
+
+def _rsi(closes: pd.DataFrame, period: int = RSI_PERIOD) -> pd.Series:
+    """Latest Wilder RSI per column."""
+    delta = closes.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1 / period, min_periods=period, adjust=False).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1 / period, min_periods=period, adjust=False).mean()
+    rsi = 100 - 100 / (1 + gain / loss)
+    # No losses at all in the window: RSI is 100 by definition
+    rsi = rsi.where(loss != 0, 100.0).where(gain.notna())
+    return rsi.iloc[-1]
+
+
+def _metrics(closes: pd.DataFrame) -> dict:
+    """
+    Computes every metric for all columns of a gap-free Close frame at once.
+    """
+    returns = closes.pct_change(fill_method=None)
+    annualize = np.sqrt(_periods_per_year(closes.index))
+
+    running_peak = closes.cummax()
+    drawdown = closes / running_peak - 1
+    trough_dates = drawdown.idxmin()
+
+    out = {
+        "last": closes.iloc[-1],
+        "total_return": closes.iloc[-1] / closes.iloc[0] - 1,
+        "annual_volatility": returns.std() * annualize,
+        "rolling_volatility": returns.rolling(VOLATILITY_WINDOW, min_periods=VOLATILITY_WINDOW).std().iloc[-1] * annualize,
+        "rsi": _rsi(closes),
+        "max_drawdown": drawdown.min(),
+    }
+    for window in SMA_WINDOWS:
+        out[f"sma_{window}"] = closes.rolling(window, min_periods=window).mean().iloc[-1]
+
+    metrics = {}
+    for ticker in closes.columns:
+        values = {name: series[ticker] for name, series in out.items()}
+        trough = trough_dates[ticker]
+        values["drawdown_trough"] = trough
+        values["drawdown_peak"] = closes[ticker].loc[:trough].idxmax()
+        values["start"] = closes.index[0]
+        values["end"] = closes.index[-1]
+        values["rows"] = len(closes)
+        metrics[ticker] = {k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in values.items()}
+    return metrics
+
+
+def compute_analytics(market_data: dict) -> dict:
+    """
+    Computes returns, volatility, moving averages, RSI, max drawdown and
+    cross-ticker correlation for every loaded ticker, in one vectorized pass.
+    Results are memoized on each table's content version, so asking again
+    about unchanged data costs nothing.
+
+    Args:
+        market_data: context_data['market_data'] ({ticker: PriceTable or CSV})
+
+    Returns:
+        Dict with 'metrics' ({ticker: {metric: value}}) and 'correlation'
+        (DataFrame of daily-return correlations, or None with fewer than 2 tickers)
+    """
+    key = tuple(sorted((ticker, as_price_table(data).version) for ticker, data in market_data.items()))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    closes = _closes(market_data)
+    metrics = {}
+    if not closes.empty:
+        if closes.notna().all().all():
+            metrics = _metrics(closes)
+        else:
+            # Different calendars (e.g. crypto trades on weekends): one pass per ticker
+            for ticker in closes.columns:
+                metrics.update(_metrics(closes[[ticker]].dropna()))
+
+    correlation = None
+    if closes.shape[1] > 1:
+        correlation = closes.pct_change(fill_method=None).corr(min_periods=5)
+
+    result = {"metrics": metrics, "correlation": correlation}
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > ANALYTICS_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return result
+
+
+def _pct(value, signed: bool = True) -> str:
+    if value is None:
+        return "n/a"
+    return f"{value * 100:+.2f}%" if signed else f"{value * 100:.2f}%"
+
+
+def _num(value) -> str:
+    return "n/a" if value is None else f"{value:.2f}"
+
+
+def format_analytics(result: dict, metrics: set = None, tickers: list = None) -> str:
+    """
+    Formats compute_analytics output as plain text for synthesis.
+
+    Args:
+        result: compute_analytics output
+        metrics: Metric groups to show (see METRIC_KEYWORDS); None or empty shows all
+        tickers: Tickers to show; None shows all
+    """
+    metrics = metrics or set(METRIC_KEYWORDS)
+    rows = {t: m for t, m in result["metrics"].items() if not tickers or t in tickers}
+    if not rows:
+        return "No price data available for analytics."
+
+    lines = []
+    for ticker, m in rows.items():
+        lines.append(f"{ticker} ({m['rows']} bars, {m['start']:%Y-%m-%d} to {m['end']:%Y-%m-%d}, last close {_num(m['last'])}):")
+        if "returns" in metrics:
+            lines.append(f"  Total return: {_pct(m['total_return'])}")
+        if "volatility" in metrics:
+            lines.append(f"  Annualized volatility: {_pct(m['annual_volatility'], False)} "
+                         f"(last {VOLATILITY_WINDOW} bars: {_pct(m['rolling_volatility'], False)})")
+        if "sma" in metrics:
+            lines.append("  " + ", ".join(f"SMA{w}: {_num(m[f'sma_{w}'])}" for w in SMA_WINDOWS))
+        if "rsi" in metrics:
+            lines.append(f"  RSI({RSI_PERIOD}): {_num(m['rsi'])}")
+        if "drawdown" in metrics:
+            lines.append(f"  Max drawdown: {_pct(m['max_drawdown'])} "
+                         f"({m['drawdown_peak']:%Y-%m-%d} peak to {m['drawdown_trough']:%Y-%m-%d} trough)")
+
+    correlation = result["correlation"]
+    if "correlation" in metrics and correlation is not None:
+        shown = [t for t in correlation.columns if t in rows]
+        if len(shown) > 1:
+            lines.append("Correlation of returns:")
+            lines.append(correlation.loc[shown, shown].round(2).to_string())
+
+    return "\n".join(lines)
+
+
+def tickers_in(text: str, market_data: dict) -> list:
+    """Loaded tickers named in text (whole-word, case-sensitive: 'ON' is a ticker, 'on' is not)."""
+    return [t for t in market_data if re.search(rf'(?<![A-Za-z0-9]){re.escape(t)}(?![A-Za-z0-9])', text)]
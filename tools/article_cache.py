@@ -0,0 +1,138 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+ARTICLE_CACHE_PATH = Path(os.getenv("ARTICLE_CACHE_PATH", CACHE_DIR / "articles.sqlite"))
+
+# Served without contacting the site while younger than this
+ARTICLE_CACHE_TTL = int(os.getenv("ARTICLE_CACHE_TTL", "1800"))
+# Kept for conditional revalidation until this old, then evicted
+ARTICLE_CACHE_MAX_AGE = int(os.getenv("ARTICLE_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+# Total size bound for stored text; least recently used entries go first
+ARTICLE_CACHE_MAX_BYTES = int(os.getenv("ARTICLE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'guccounter', 'guce_referrer', 'ref', 'cmpid')
+
+_lock = threading.Lock()
+_conn = None
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalizes a URL so trivially different links share one cache entry:
+    lowercase scheme/host, no default port, fragment or tracking params,
+    sorted query string, no trailing slash.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+def _key(url: str) -> str:
+    return hashlib.sha256(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        ARTICLE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(ARTICLE_CACHE_PATH), check_same_thread=False)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS articles (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                max_length INTEGER,
+                text TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                last_access REAL,
+                size INTEGER
+            )"""
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_access ON articles(last_access)")
+        _conn.commit()
+    return _conn
+
+
+def lookup(url: str, max_length: int) -> dict:
+    """
+    Returns the cached entry for a URL or None.
+
+    The entry dict has 'text', 'etag', 'last_modified' and 'fresh' (True if it
+    can be served without revalidation).
+    """
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT text, etag, last_modified, fetched_at, max_length FROM articles WHERE key = ?",
+            (_key(url),)
+        ).fetchone()
+        if not row or row[4] != max_length:
+            return None
+        if now - row[3] > ARTICLE_CACHE_MAX_AGE:
+            conn.execute("DELETE FROM articles WHERE key = ?", (_key(url),))
+            conn.commit()
+            return None
+        conn.execute("UPDATE articles SET last_access = ? WHERE key = ?", (now, _key(url)))
+        conn.commit()
+
+    return {
+        "text": row[0],
+        "etag": row[1],
+        "last_modified": row[2],
+        "fresh": now - row[3] <= ARTICLE_CACHE_TTL,
+    }
+
+
+def store(url: str, max_length: int, text: str, etag: str = None, last_modified: str = None):
+    """Stores extracted text with its validators, then enforces age and size bounds."""
+    now = time.time()
+    size = len(text.encode('utf-8'))
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (_key(url), canonicalize_url(url), max_length, text, etag, last_modified, now, now, size)
+        )
+        conn.execute("DELETE FROM articles WHERE fetched_at < ?", (now - ARTICLE_CACHE_MAX_AGE,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM articles").fetchone()[0]
+        if total > ARTICLE_CACHE_MAX_BYTES:
+            excess = total - ARTICLE_CACHE_MAX_BYTES
+            freed = 0
+            victims = []
+            for key, entry_size in conn.execute("SELECT key, size FROM articles ORDER BY last_access ASC"):
+                victims.append((key,))
+                freed += entry_size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM articles WHERE key = ?", victims)
+        conn.commit()
+
+
+def mark_revalidated(url: str):
+    """Restarts the freshness window after a 304 Not Modified."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "UPDATE articles SET fetched_at = ?, last_access = ? WHERE key = ?",
+            (now, now, _key(url))
+        )
+        conn.commit()
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import zipfile
+from pathlib import Path
+
+from tools.chart_export import export_pngs, prune_directory
+from tools.price_table import as_price_table
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+ARTIFACT_DIR = CACHE_DIR / "artifacts"
+# Raw attachment bytes per email; base64 adds a third on the wire, so 18 MB stays under the common 25 MB limit
+EMAIL_ATTACHMENT_BUDGET_MB = float(os.getenv("EMAIL_ATTACHMENT_BUDGET_MB", "18"))
+# Data archives kept for reuse (least recently used evicted first)
+ARTIFACT_CACHE_MAX_MB = float(os.getenv("ARTIFACT_CACHE_MAX_MB", "500"))
+ARTIFACT_CACHE_MAX_AGE = int(os.getenv("ARTIFACT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+
+def data_archive(market_data: dict) -> str:
+    """
+    Packs every ticker's price history into one deflate-compressed ZIP
+    (one CSV per ticker). The archive is named by the content versions of
+    its tables, so unchanged data reuses the existing file without
+    re-serializing anything.
+
+    Returns:
+        Path of the archive, or None without market data
+    """
+    tables = {ticker: as_price_table(data) for ticker, data in market_data.items()}
+    tables = {ticker: table for ticker, table in tables.items() if not table.empty}
+    if not tables:
+        return None
+
+    digest = hashlib.sha256()
+    for ticker in sorted(tables):
+        digest.update(f"{ticker}:{tables[ticker].version};".encode())
+    path = ARTIFACT_DIR / f"market_data_{digest.hexdigest()[:16]}.zip"
+    if path.exists():
+        print(f"[ATTACHMENTS] Reusing {path.name}")
+        os.utime(path)  # Recently used: last in line for eviction
+        return str(path)
+
+    ARTIFACT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        for ticker in sorted(tables):
+            archive.writestr(f"{ticker}_data.csv", tables[ticker].to_csv())
+    os.replace(tmp_path, path)  # Readers never see a half-written archive
+    print(f"[ATTACHMENTS] Packed {len(tables)} table(s) into {path.name} ({path.stat().st_size // 1024} KB)")
+    prune_directory(ARTIFACT_DIR, ARTIFACT_CACHE_MAX_MB * 1024 * 1024, ARTIFACT_CACHE_MAX_AGE, "*.zip")
+    return str(path)
+
+
+def build_attachments(chart_figures: list, market_data: dict, budget_mb: float = EMAIL_ATTACHMENT_BUDGET_MB) -> dict:
+    """
+    Collects an email report's attachments: the data archive first, then
+    chart PNGs, newest first, while they fit the size budget.
+
+    Args:
+        chart_figures: Plotly figures accumulated in the session
+        market_data: context_data['market_data']
+        budget_mb: Total raw size allowed for all attachments
+
+    Returns:
+        Dict with 'paths' (in attachment order), 'skipped' (file names left
+        out for size) and 'bytes' (total size attached)
+    """
+    candidates = []
+    archive = data_archive(dict(market_data))
+    if archive:
+        candidates.append(archive)
+    # Most recent charts are the ones the user just asked about
+    candidates.extend(reversed(export_pngs(chart_figures)))
+
+    budget = int(budget_mb * 1024 * 1024)
+    paths, skipped, total = [], [], 0
+    for path in candidates:
+        size = os.path.getsize(path)
+        if total + size > budget:
+            skipped.append(Path(path).name)
+            continue
+        paths.append(path)
+        total += size
+
+    if skipped:
+        print(f"[ATTACHMENTS] Over the {budget_mb:g} MB budget, left out: {', '.join(skipped)}")
+    return {"paths": paths, "skipped": skipped, "bytes": total}
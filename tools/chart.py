@@ -1,21 +1,114 @@
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 import io
+import os
+from tools.price_table import PriceTable
 
-def generate_chart(ticker: str, data_csv: str):
+# Points kept per series (roughly one per horizontal pixel of a chart)
+CHART_TARGET_POINTS = int(os.getenv("CHART_TARGET_POINTS", "800"))
+# Above this many points in a figure, line traces use WebGL (Scattergl) instead of SVG
+CHART_WEBGL_THRESHOLD = int(os.getenv("CHART_WEBGL_THRESHOLD", "1000"))
+
+def _to_frame(data) -> pd.DataFrame:
+    """Columnar PriceTable -> DataFrame without parsing; CSV text is still accepted."""
+    if isinstance(data, PriceTable):
+        return data.to_frame()
+    return pd.read_csv(io.StringIO(data))
+
+
+def _x_numeric(values: pd.Series) -> np.ndarray:
+    """X positions for downsampling: timestamps when the column parses as dates, else row numbers."""
+    try:
+        return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+    except (ValueError, TypeError):
+        return np.arange(len(values), dtype=np.float64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    
+    Keeps the first and last point and, from each of threshold - 2 buckets,
+    the point forming the largest triangle with the previously kept point and
+    the next bucket's average, so peaks and troughs survive.
+    
+    Returns:
+        Indices of the kept points (all indices if no reduction is needed)
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    
+    return selected
+
+
+def downsample_line(df: pd.DataFrame, x_col: str, y_col: str, target: int = CHART_TARGET_POINTS) -> pd.DataFrame:
+    """LTTB-reduces a line series to about `target` points (rows with a missing y are dropped)."""
+    df = df[df[y_col].notna()]
+    if len(df) <= target:
+        return df
+    x = _x_numeric(df[x_col])
+    y = df[y_col].to_numpy(dtype=np.float64)
+    return df.iloc[lttb_indices(x, y, target)]
+
+
+def bucket_ohlc(df: pd.DataFrame, target: int = CHART_TARGET_POINTS) -> pd.DataFrame:
     """
-    Generates an interactive Plotly chart from CSV data.
+    Merges consecutive bars into about `target` candles: first Open, max High,
+    min Low, last Close (and summed Volume), dated at the bucket's first bar.
+    """
+    n = len(df)
+    if n <= target:
+        return df
+    buckets = np.arange(n) * target // n
+    agg = {'Date': 'first', 'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'}
+    if 'Volume' in df.columns:
+        agg['Volume'] = 'sum'
+    return df.groupby(buckets).agg(agg).reset_index(drop=True)
+
+
+def _line_trace(points: int):
+    """SVG Scatter for small figures, WebGL Scattergl once the figure gets large."""
+    return go.Scattergl if points > CHART_WEBGL_THRESHOLD else go.Scatter
+
+
+def generate_chart(ticker: str, data):
+    """
+    Generates an interactive Plotly chart from a PriceTable (or CSV data).
     """
     try:
-        df = pd.read_csv(io.StringIO(data_csv))
+        df = _to_frame(data)
         
         if df.empty:
             return f"Error: No data available to chart for {ticker}"
         
         fig = go.Figure()
 
+        rows = len(df)
+        
         # Check for OHLC data to create a Candlestick chart
         if all(col in df.columns for col in ['Open', 'High', 'Low', 'Close', 'Date']):
+            # Candlesticks have no WebGL trace; bucketing keeps them bounded instead
+            df = bucket_ohlc(df)
             fig.add_trace(go.Candlestick(
                 x=df['Date'],
                 open=df['Open'],
@@ -27,7 +120,8 @@ def generate_chart(ticker: str, data_csv: str):
             chart_type = "Candlestick"
         elif 'Close' in df.columns and 'Date' in df.columns:
             # Line chart with Close price
-            fig.add_trace(go.Scatter(x=df['Date'], y=df['Close'], mode='lines', name=ticker))
+            df = downsample_line(df, 'Date', 'Close')
+            fig.add_trace(_line_trace(len(df))(x=df['Date'], y=df['Close'], mode='lines', name=ticker))
             chart_type = "Line"
         else:
             # Try to find any numeric column
@@ -37,8 +131,12 @@ def generate_chart(ticker: str, data_csv: str):
             
             y_col = numeric_cols[0]
             x_col = df.columns[0]  # Use first column as X
-            fig.add_trace(go.Scatter(x=df[x_col], y=df[y_col], mode='lines', name=ticker))
+            df = downsample_line(df, x_col, y_col)
+            fig.add_trace(_line_trace(len(df))(x=df[x_col], y=df[y_col], mode='lines', name=ticker))
             chart_type = "Line"
+        
+        if len(df) < rows:
+            print(f"[CHART] {ticker}: {rows} -> {len(df)} points")
 
         fig.update_layout(
             title=f"{ticker} Analysis ({chart_type})", 
@@ -56,7 +154,7 @@ def generate_comparison_chart(tickers_data: dict):
     Generates a comparison chart for multiple tickers on the same graph.
     
     Args:
-        tickers_data: Dict of {ticker: csv_data}
+        tickers_data: Dict of {ticker: PriceTable or csv_data}
     
     Returns:
         Plotly figure with all tickers overlaid
@@ -64,20 +162,26 @@ def generate_comparison_chart(tickers_data: dict):
     try:
         fig = go.Figure()
         
-        for ticker, data_csv in tickers_data.items():
-            df = pd.read_csv(io.StringIO(data_csv))
+        series = {}
+        for ticker, data in tickers_data.items():
+            df = _to_frame(data)
             
             if df.empty:
                 continue
             
             # Use Close price for comparison
             if 'Close' in df.columns and 'Date' in df.columns:
-                fig.add_trace(go.Scatter(
-                    x=df['Date'], 
-                    y=df['Close'], 
-                    mode='lines', 
-                    name=ticker
-                ))
+                series[ticker] = downsample_line(df, 'Date', 'Close')
+        
+        # One trace type for the whole figure, chosen on its total size
+        trace = _line_trace(sum(len(df) for df in series.values()))
+        for ticker, df in series.items():
+            fig.add_trace(trace(
+                x=df['Date'], 
+                y=df['Close'], 
+                mode='lines', 
+                name=ticker
+            ))
         
         if len(fig.data) == 0:
             return "Error: No valid data to compare"
@@ -0,0 +1,183 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+CHART_CACHE_DIR = CACHE_DIR / "charts"
+# Kaleido starts a browser per export process; a small pool keeps it warm
+CHART_EXPORT_WORKERS = int(os.getenv("CHART_EXPORT_WORKERS", "2"))
+CHART_EXPORT_TIMEOUT = float(os.getenv("CHART_EXPORT_TIMEOUT", "60"))
+# Rendered PNGs: least recently used go first above the size bound, any older than the age bound
+CHART_CACHE_MAX_MB = float(os.getenv("CHART_CACHE_MAX_MB", "200"))
+CHART_CACHE_MAX_AGE = int(os.getenv("CHART_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+# Files used this recently are never evicted (they may be about to be attached)
+PRUNE_GRACE_SECONDS = 3600
+
+_pool = None
+_inflight = {}  # hash -> Future shared by concurrent exports of the same figure
+_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Lazily starts the export worker pool (caller holds _lock)."""
+    global _pool
+    if _pool is None:
+        # spawn: the parent runs threads and event loops that must not be forked
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, CHART_EXPORT_WORKERS),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Drops a pool whose worker died (caller holds _lock); the next _get_pool starts a new one."""
+    global _pool
+    if _pool is broken:
+        _pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        print("[CHART EXPORT] Export worker crashed, restarting the pool")
+
+
+def prune_directory(directory: Path, max_bytes: float, max_age: float, pattern: str = "*"):
+    """
+    Evicts cached files by modification time (refreshed on every cache hit):
+    everything older than max_age, then least recently used files until the
+    directory fits max_bytes. Files used within PRUNE_GRACE_SECONDS are kept.
+    """
+    now = time.time()
+    entries = []
+    for path in Path(directory).glob(pattern):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime < PRUNE_GRACE_SECONDS:
+            break
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def _touch(path: Path):
+    """Marks a cached file as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _render(figure_json: str, path: str) -> str:
+    """Worker: renders a figure (plotly JSON) to PNG at `path`."""
+    import plotly.io as pio
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pio.from_json(figure_json).write_image(tmp_path, format="png")
+    os.replace(tmp_path, path)  # Readers never see a half-written file
+    return path
+
+
+def chart_hash(figure_json: str) -> str:
+    """Content hash of a figure: its data and layout, as serialized by plotly."""
+    return hashlib.sha256(figure_json.encode("utf-8")).hexdigest()
+
+
+def _submit(fig):
+    """Returns (cached path, None) or (None, Future) for one figure."""
+    figure_json = fig.to_json()
+    key = chart_hash(figure_json)
+    # The file name doubles as the attachment name, so lead with the chart title
+    title = re.sub(r'[^A-Za-z0-9]+', '_', fig.layout.title.text or '').strip('_')[:40] or 'chart'
+    path = CHART_CACHE_DIR / f"{title}_{key[:16]}.png"
+    if path.exists():
+        _touch(path)
+        return str(path), None
+
+    with _lock:
+        future = _inflight.get(key)
+        if future is None:
+            CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            for attempt in range(2):
+                pool = _get_pool()
+                try:
+                    future = pool.submit(_render, figure_json, str(path))
+                    break
+                except BrokenProcessPool:
+                    _reset_pool(pool)
+                    if attempt:
+                        raise
+            _inflight[key] = future
+            future.add_done_callback(lambda done: _inflight.pop(key, None) if _inflight.get(key) is done else None)
+    return None, future
+
+
+def _collect(future):
+    """Result of a render; (None, True) if its worker pool broke."""
+    try:
+        return future.result(timeout=0), False
+    except BrokenProcessPool:
+        return None, True
+    except Exception as e:
+        print(f"[CHART EXPORT ERROR] {type(e).__name__}: {e}")
+        return None, False
+
+
+def export_pngs(figures: list, timeout: float = CHART_EXPORT_TIMEOUT) -> list:
+    """
+    Renders Plotly figures to PNG files, in parallel worker processes.
+    Figures already rendered (same data and layout) come from the on-disk cache.
+
+    Args:
+        figures: Plotly figures
+        timeout: Seconds to wait for all renders
+
+    Returns:
+        PNG paths in figure order; figures that failed or timed out are left out
+    """
+    slots = []
+    for fig in figures:
+        try:
+            slots.append(_submit(fig))
+        except Exception as e:
+            print(f"[CHART EXPORT ERROR] {e}")
+            slots.append((None, None))
+
+    deadline = time.monotonic() + timeout
+    pending = [future for _, future in slots if future is not None]
+    if pending:
+        print(f"[CHART EXPORT] Rendering {len(pending)} chart(s), {len(slots) - len(pending)} cached")
+        wait(pending, timeout=timeout)
+
+    paths = []
+    for fig, (path, future) in zip(figures, slots):
+        if future is not None:
+            path, broken = _collect(future)
+            if broken:
+                # A worker crash fails every render in flight: retry once
+                # (the broken pool refuses the submit and is replaced)
+                try:
+                    path, future = _submit(fig)
+                    if future is not None:
+                        wait([future], timeout=max(0.0, deadline - time.monotonic()))
+                        path, _ = _collect(future)
+                except Exception as e:
+                    print(f"[CHART EXPORT ERROR] {type(e).__name__}: {e}")
+                    path = None
+        if path:
+            paths.append(path)
+
+    if pending:
+        prune_directory(CHART_CACHE_DIR, CHART_CACHE_MAX_MB * 1024 * 1024, CHART_CACHE_MAX_AGE, "*.png")
+    return paths
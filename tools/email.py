@@ -1,14 +1,191 @@
+import base64
+import mimetypes
 import smtplib
+import tempfile
+import threading
+import time
+import uuid
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from email import encoders
+from email.policy import SMTP as SMTP_POLICY
 import os
 from pathlib import Path
 
+# Seconds of inactivity after which the pooled connection is re-opened
+# (servers drop idle sessions; reconnecting up front beats a failed send)
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# Attachments are read and base64-encoded this many bytes at a time
+# (a multiple of 57, so every block encodes to whole 76-character lines)
+ENCODE_BLOCK_BYTES = 57 * 1024
+# Serialized messages are written to the server in pieces of about this size
+SEND_BLOCK_BYTES = 64 * 1024
+CRLF = b"\r\n"
+
+
+def smtp_settings() -> dict:
+    """SMTP configuration from environment variables (user / password may be None)."""
+    return {
+        "host": os.getenv("EMAIL_HOST", "smtp.gmail.com"),
+        "port": int(os.getenv("EMAIL_PORT", "587")),
+        "user": os.getenv("EMAIL_USER"),
+        "password": os.getenv("EMAIL_PASSWORD"),
+    }
+
+
+class SMTPSession:
+    """
+    One authenticated SMTP connection (STARTTLS + login done once), reused
+    for every message sent through it. It is re-opened after the server
+    disconnects or after SMTP_IDLE_SECONDS without traffic.
+    """
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        settings = smtp_settings()
+        server = smtplib.SMTP(settings["host"], settings["port"], timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls()
+            server.login(settings["user"], settings["password"])
+        except Exception:
+            server.close()
+            raise
+        print(f"[EMAIL] Connected to {settings['host']}:{settings['port']}")
+        return server
+
+    def _close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+    @staticmethod
+    def _transmit(server: smtplib.SMTP, sender: str, recipient: str, message_path: str):
+        """
+        MAIL / RCPT / DATA with the message streamed from its file
+        (dot-stuffed line by line), so it is never loaded whole.
+        """
+        server.ehlo_or_helo_if_needed()
+        code, reply = server.mail(sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, reply, sender)
+        code, reply = server.rcpt(recipient)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({recipient: (code, reply)})
+        server.putcmd("data")
+        code, reply = server.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, reply)
+
+        with open(message_path, 'rb') as f:
+            pending, size = [], 0
+            for line in f:
+                line = line.rstrip(b"\r\n") + CRLF  # Also covers spool files written with bare LF
+                if line.startswith(b'.'):
+                    line = b'.' + line
+                pending.append(line)
+                size += len(line)
+                if size >= SEND_BLOCK_BYTES:
+                    server.send(b"".join(pending))
+                    pending, size = [], 0
+            pending.append(b"." + CRLF)
+            server.send(b"".join(pending))
+        code, reply = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+
+    def send(self, sender: str, recipient: str, message_path: str):
+        """Sends a message serialized by write_message; raises smtplib / socket errors."""
+        with self._lock:
+            if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+                self._close()
+            for attempt in range(2):
+                if self._server is None:
+                    self._server = self._connect()
+                try:
+                    self._transmit(self._server, sender, recipient, message_path)
+                    self._last_used = time.monotonic()
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    # Dropped since the last send: reconnect once
+                    self._server = None
+                    if attempt:
+                        raise
+                except Exception:
+                    self._close()
+                    raise
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_session = SMTPSession()
+
+
+def _write_headers(f, part):
+    for name, value in part.items():
+        f.write(part.policy.fold_binary(name, value))
+    f.write(CRLF)
+
+
+def _attachment_headers(file_path: str) -> MIMEBase:
+    """Header-only MIME part for a file; its base64 body is written by write_message."""
+    content_type, _ = mimetypes.guess_type(file_path)
+    maintype, subtype = (content_type or 'application/octet-stream').split('/', 1)
+    part = MIMEBase(maintype, subtype, policy=SMTP_POLICY)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=Path(file_path).name)
+    return part
+
+
+def write_message(f, sender: str, recipient: str, subject: str, body: str, attachments: list = None):
+    """
+    Serializes the message (HTML body plus file attachments; missing files
+    are skipped) into a binary file, with CRLF line endings ready for SMTP.
+    Each attachment is base64-encoded block by block from its file straight
+    into `f`, so no attachment is ever held in memory whole.
+    """
+    # "=_" never occurs in base64 or quoted-printable text
+    boundary = f"=_{uuid.uuid4().hex}"
+    msg = MIMEMultipart(boundary=boundary, policy=SMTP_POLICY)
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    delimiter = b"--" + boundary.encode('ascii')
+
+    _write_headers(f, msg)
+    f.write(delimiter + CRLF)
+    f.write(MIMEText(body, 'html', policy=SMTP_POLICY).as_bytes())
+
+    for file_path in attachments or []:
+        if not os.path.exists(file_path):
+            continue
+        f.write(CRLF + delimiter + CRLF)
+        _write_headers(f, _attachment_headers(file_path))
+        with open(file_path, 'rb') as source:
+            for block in iter(lambda: source.read(ENCODE_BLOCK_BYTES), b''):
+                f.write(base64.encodebytes(block).replace(b"\n", CRLF))
+
+    f.write(CRLF + delimiter + b"--" + CRLF)
+
+
+def deliver(recipient: str, message_path: str):
+    """Sends a message file written by write_message over the shared SMTP session (raises on failure)."""
+    _session.send(smtp_settings()["user"], recipient, message_path)
+
+
 def send_email(recipient: str, subject: str, body: str, attachments: list = None) -> str:
     """
     Sends an email using SMTP configuration from environment variables.
+    The authenticated connection is kept open and reused by later sends.
     
     Args:
         recipient: Email address to send to
@@ -19,58 +196,32 @@ def send_email(recipient: str, subject: str, body: str, attachments: list = None
     Returns:
         Success/error message
     """
-    # SMTP configuration from environment
-    smtp_server = os.getenv("EMAIL_HOST", "smtp.gmail.com")
-    smtp_port = int(os.getenv("EMAIL_PORT", "587"))
-    sender_email = os.getenv("EMAIL_USER")
-    sender_password = os.getenv("EMAIL_PASSWORD")
-
-    if not sender_email or not sender_password:
+    settings = smtp_settings()
+    if not settings["user"] or not settings["password"]:
         return "Email not configured. Set EMAIL_USER and EMAIL_PASSWORD in .env file."
 
+    message_path = None
     try:
-        # Create message
-        msg = MIMEMultipart()
-        msg['Subject'] = subject
-        msg['From'] = sender_email
-        msg['To'] = recipient
-
-        # Add body as HTML
-        msg.attach(MIMEText(body, 'html'))
-
-        # Add attachments if provided
-        if attachments:
-            for file_path in attachments:
-                if not os.path.exists(file_path):
-                    continue
-                    
-                with open(file_path, 'rb') as f:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(f.read())
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        'Content-Disposition',
-                        f'attachment; filename={Path(file_path).name}'
-                    )
-                    msg.attach(part)
-
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            # Log email details before sending
-            print(f"[EMAIL DEBUG] Sending to: {recipient}")
-            print(f"[EMAIL DEBUG] Subject: {subject}")
-            print(f"[EMAIL DEBUG] Body Length: {len(body)} chars")
-            print(f"[EMAIL DEBUG] Attachments: {attachments}")
-            
-            server.send_message(msg)
+        with tempfile.NamedTemporaryFile('wb', suffix='.eml', delete=False) as f:
+            message_path = f.name
+            write_message(f, settings["user"], recipient, subject, body, attachments)
+
+        # Log email details before sending
+        print(f"[EMAIL DEBUG] Sending to: {recipient}")
+        print(f"[EMAIL DEBUG] Subject: {subject}")
+        print(f"[EMAIL DEBUG] Body Length: {len(body)} chars")
+        print(f"[EMAIL DEBUG] Attachments: {attachments}")
+        
+        deliver(recipient, message_path)
             
         attachment_info = f" with {len(attachments)} attachment(s)" if attachments else ""
         return f"Email sent to {recipient}{attachment_info}"
         
     except Exception as e:
         return f"Failed to send email: {str(e)}"
+    finally:
+        if message_path:
+            Path(message_path).unlink(missing_ok=True)
 
 
 def format_report_html(title: str, content: str, sources: list = None) -> str:
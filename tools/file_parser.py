@@ -1,72 +1,380 @@
+import numpy as np
 import pandas as pd
 import PyPDF2
+import openpyxl
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+PARSED_CACHE_DIR = CACHE_DIR / "parsed"
+# Worker processes for large documents (PDF page ranges, Excel sheets)
+FILE_PARSER_WORKERS = int(os.getenv("FILE_PARSER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# PDFs with at least this many pages are split into ranges across processes
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_PREVIEW_CHARS = 5000
+# Workbooks at least this large decode their sheets in parallel processes
+EXCEL_PARALLEL_MIN_BYTES = int(os.getenv("EXCEL_PARALLEL_MIN_BYTES", str(5 * 1024 * 1024)))
+# Rows per chunk when scanning CSV uploads
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "100000"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Lazily starts the parser process pool (spawn: the app runs threads and event loops)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, FILE_PARSER_WORKERS),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def file_hash(file_path: str) -> str:
+    """SHA-256 of the file contents (read in blocks)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_path(key: str, kind: str) -> Path:
+    return PARSED_CACHE_DIR / f"{key}.{kind}.json.gz"
+
+
+def load_cached(key: str, kind: str):
+    path = _cache_path(key, kind)
+    if not path.exists():
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[FILE CACHE ERROR] {e}")
+        return None
+
+
+def store_cached(key: str, kind: str, value):
+    path = _cache_path(key, kind)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[FILE CACHE ERROR] {e}")
+
+def _chunk_stats(chunk: pd.DataFrame) -> pd.DataFrame:
+    """count / mean / m2 (sum of squared deviations) / min / max of each numeric column."""
+    numeric = chunk.select_dtypes(include=['number'])
+    count = numeric.count()
+    mean = numeric.mean()
+    return pd.DataFrame({
+        "count": count,
+        "mean": mean.fillna(0.0),
+        "m2": (numeric.var(ddof=0) * count).fillna(0.0),
+        "min": numeric.min(),
+        "max": numeric.max(),
+    }).astype(float)
+
+
+def _merge_stats(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Combines two _chunk_stats results (parallel-variance merge, Chan et al.)."""
+    columns = a.index.union(b.index, sort=False)
+    empty = {"count": 0.0, "mean": 0.0, "m2": 0.0}
+    a = a.reindex(columns).fillna(empty)
+    b = b.reindex(columns).fillna(empty)
+    
+    count = a["count"] + b["count"]
+    safe_count = count.where(count > 0, 1.0)
+    delta = b["mean"] - a["mean"]
+    return pd.DataFrame({
+        "count": count,
+        "mean": a["mean"] + delta * b["count"] / safe_count,
+        "m2": a["m2"] + b["m2"] + delta ** 2 * a["count"] * b["count"] / safe_count,
+        "min": np.fmin(a["min"], b["min"]),
+        "max": np.fmax(a["max"], b["max"]),
+    })
+
+
+def _merge_dtype(current, new):
+    if current is None or current == new:
+        return new
+    if pd.api.types.is_numeric_dtype(current) and pd.api.types.is_numeric_dtype(new):
+        # e.g. ints in the first chunk, a missing value (float) in a later one
+        return np.result_type(current, new)
+    return np.dtype(object)
+
+
 def parse_csv(file_path: str) -> dict:
     """
     Parse CSV file and return structured data.
+    
+    The file is read in chunks of CSV_CHUNK_ROWS rows: the preview comes
+    from the first chunk, and row count, column types and summary
+    statistics (count / mean / std / min / max) are merged chunk by chunk,
+    so memory stays bounded by one chunk. The data itself is not copied;
+    'path' refers back to the file.
     """
     try:
-        df = pd.read_csv(file_path)
+        rows = 0
+        columns = None
+        preview = []
+        dtypes = {}
+        stats = None
+        
+        for chunk in pd.read_csv(file_path, chunksize=CSV_CHUNK_ROWS, memory_map=True):
+            if columns is None:
+                columns = list(chunk.columns)
+                preview = chunk.head(10).to_dict('records')
+            rows += len(chunk)
+            for col, dtype in chunk.dtypes.items():
+                dtypes[col] = _merge_dtype(dtypes.get(col), dtype)
+            chunk_stats = _chunk_stats(chunk)
+            stats = chunk_stats if stats is None else _merge_stats(stats, chunk_stats)
+        
+        summary = None
+        if stats is not None:
+            # Columns that turned non-numeric in a later chunk have no meaningful stats
+            numeric = [c for c in stats.index if pd.api.types.is_numeric_dtype(dtypes[c]) and not pd.api.types.is_bool_dtype(dtypes[c])]
+            if numeric:
+                summary = {}
+                for col in numeric:
+                    count = int(stats.at[col, "count"])
+                    summary[col] = {
+                        "count": count,
+                        "mean": float(stats.at[col, "mean"]) if count else None,
+                        "std": float((stats.at[col, "m2"] / (count - 1)) ** 0.5) if count > 1 else None,
+                        "min": float(stats.at[col, "min"]) if count else None,
+                        "max": float(stats.at[col, "max"]) if count else None,
+                    }
         
         return {
             "type": "csv",
-            "rows": len(df),
-            "columns": list(df.columns),
-            "preview": df.head(10).to_dict('records'),
-            "summary": df.describe().to_dict() if df.select_dtypes(include=['number']).shape[1] > 0 else None,
-            "data": df.to_csv(index=False)
+            "rows": rows,
+            "columns": columns or [],
+            "dtypes": {col: str(dtype) for col, dtype in dtypes.items()},
+            "preview": preview,
+            "summary": summary,
+            "path": str(file_path)
         }
     except Exception as e:
         return {"error": f"Failed to parse CSV: {str(e)}"}
 
 
+def _header_names(values) -> list:
+    """Column names from a header row, named like pandas for blank cells."""
+    return [str(v) if v is not None else f"Unnamed: {i}" for i, v in enumerate(values or ())]
+
+
+def _rows_to_frame(rows) -> pd.DataFrame:
+    """DataFrame from an iterator of row tuples whose first row is the header."""
+    header = _header_names(next(rows, None))
+    width = len(header)
+    records = [row[:width] for row in rows if any(v is not None for v in row)]
+    return pd.DataFrame.from_records(records, columns=header) if header else pd.DataFrame()
+
+
+def _read_sheets(file_path: str, sheet_names: list) -> dict:
+    """Worker: decodes the given sheets of an .xlsx file (one open per worker)."""
+    book = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return {name: _rows_to_frame(book[name].iter_rows(values_only=True)) for name in sheet_names}
+    finally:
+        book.close()
+
+
+class ExcelWorkbook:
+    """
+    A workbook opened once. Sheet metadata (row count, columns, preview) is
+    read up front from the first rows; sheet contents are decoded on first
+    access via frame() and kept. .xlsx files are read with openpyxl in
+    read-only (streaming) mode; legacy .xls goes through pandas.
+    """
+
+    def __init__(self, file_path: str):
+        self.path = str(file_path)
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._streaming = Path(file_path).suffix.lower() != '.xls'
+        if self._streaming:
+            self._book = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            self.sheet_names = list(self._book.sheetnames)
+        else:
+            self._book = pd.ExcelFile(file_path)
+            self.sheet_names = list(self._book.sheet_names)
+        self.info = {name: self._sheet_info(name) for name in self.sheet_names}
+
+    def _sheet_info(self, name: str) -> dict:
+        if not self._streaming:
+            df = self.frame(name)
+            return {"rows": len(df), "columns": list(df.columns), "preview": df.head(10).to_dict('records')}
+        
+        sheet = self._book[name]
+        head = _rows_to_frame(sheet.iter_rows(max_row=11, values_only=True))
+        # Read-only sheets report their size from the stored dimension; count rows only if it is missing
+        rows = sheet.max_row - 1 if sheet.max_row else sum(1 for _ in sheet.iter_rows(values_only=True)) - 1
+        return {"rows": max(rows, 0), "columns": list(head.columns), "preview": head.to_dict('records')}
+
+    def frame(self, name: str, keep: bool = True) -> pd.DataFrame:
+        """
+        Sheet contents as a DataFrame (decoded once). With keep=False a sheet
+        not decoded yet is returned without being kept, for one-pass readers.
+        """
+        with self._lock:
+            if name in self._frames:
+                return self._frames[name]
+            if self._streaming:
+                df = _rows_to_frame(self._book[name].iter_rows(values_only=True))
+            else:
+                df = self._book.parse(name)
+            if keep:
+                self._frames[name] = df
+            return df
+
+    def load_all(self) -> dict:
+        """
+        Decodes every sheet. Large multi-sheet .xlsx files are split across
+        worker processes; otherwise sheets are read from the open workbook.
+        """
+        missing = [name for name in self.sheet_names if name not in self._frames]
+        workers = min(max(1, FILE_PARSER_WORKERS), len(missing))
+        parallel = (self._streaming and workers > 1
+                    and os.path.getsize(self.path) >= EXCEL_PARALLEL_MIN_BYTES)
+        
+        if parallel:
+            groups = [missing[i::workers] for i in range(workers)]
+            pool = _get_pool()
+            for future in [pool.submit(_read_sheets, self.path, group) for group in groups]:
+                frames = future.result()
+                with self._lock:
+                    for name, df in frames.items():
+                        self._frames.setdefault(name, df)
+        else:
+            for name in missing:
+                self.frame(name)
+        
+        return {name: self._frames[name] for name in self.sheet_names}
+
+    def close(self):
+        self._book.close()
+
+
 def parse_excel(file_path: str) -> dict:
     """
     Parse Excel file and return structured data.
+    
+    The workbook is opened once; per-sheet row counts, columns and previews
+    are returned immediately, while full sheet contents stay in the
+    returned 'workbook' (ExcelWorkbook) until something asks for them.
     """
     try:
-        # Read all sheets
-        excel_file = pd.ExcelFile(file_path)
-        sheets = {}
-        
-        for sheet_name in excel_file.sheet_names:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            sheets[sheet_name] = {
-                "rows": len(df),
-                "columns": list(df.columns),
-                "preview": df.head(10).to_dict('records'),
-                "data": df.to_csv(index=False)
-            }
+        workbook = ExcelWorkbook(file_path)
         
         return {
             "type": "excel",
-            "sheets": list(sheets.keys()),
-            "data": sheets
+            "sheets": workbook.sheet_names,
+            "data": workbook.info,
+            "workbook": workbook,
+            "path": str(file_path)
         }
     except Exception as e:
         return {"error": f"Failed to parse Excel: {str(e)}"}
 
 
+def iter_pdf_pages(file_path: str, start: int = 0, end: int = None):
+    """
+    Yields (page_number, text) lazily, one page at a time.
+    
+    Args:
+        file_path: PDF path
+        start: First page (0-based)
+        end: Stop before this page (None = last page)
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        num_pages = len(pdf_reader.pages)
+        for page_num in range(start, min(end if end is not None else num_pages, num_pages)):
+            # Image-only pages have no text layer
+            yield page_num, pdf_reader.pages[page_num].extract_text() or ""
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> list:
+    """Worker: text of pages [start, end)."""
+    return [text for _, text in iter_pdf_pages(file_path, start, end)]
+
+
+def extract_pdf_pages(file_path: str, num_pages: int) -> list:
+    """
+    Text of every page, in order. Large documents are split into page
+    ranges extracted in parallel worker processes.
+    """
+    workers = max(1, FILE_PARSER_WORKERS)
+    if num_pages < PDF_PARALLEL_MIN_PAGES or workers == 1:
+        return _extract_page_range(file_path, 0, num_pages)
+    
+    # A few ranges per worker so one slow (image-heavy) range does not hold everything up
+    step = max(1, -(-num_pages // (workers * 4)))
+    ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+    pool = _get_pool()
+    futures = [pool.submit(_extract_page_range, file_path, start, end) for start, end in ranges]
+    
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
 def parse_pdf(file_path: str) -> dict:
     """
-    Extract text from PDF file.
+    Extract text from PDF file (all pages).
+    
+    Page texts are cached by file content hash, so the same document
+    uploaded again (any name, any session) is not re-extracted.
+    
+    Returns:
+        Dict with 'pages' (count), 'text' (preview), 'page_texts' (one string
+        per page) and 'hash'
     """
     try:
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            
-            for page_num in range(min(num_pages, 10)):  # Limit to first 10 pages
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text()
+        key = file_hash(file_path)
+        page_texts = load_cached(key, "pdf")
+        
+        if page_texts is None:
+            with open(file_path, 'rb') as file:
+                num_pages = len(PyPDF2.PdfReader(file).pages)
+            page_texts = extract_pdf_pages(file_path, num_pages)
+            store_cached(key, "pdf", page_texts)
+            print(f"[PDF] Extracted {num_pages} page(s) from {Path(file_path).name}")
+        else:
+            print(f"[PDF] Cache hit for {Path(file_path).name}")
+        
+        # Preview from the leading pages only; never joins the whole document
+        preview = []
+        length = 0
+        for text in page_texts:
+            if length >= PDF_PREVIEW_CHARS:
+                break
+            preview.append(text)
+            length += len(text) + 1
         
         return {
             "type": "pdf",
-            "pages": num_pages,
-            "text": text[:5000],  # First 5000 chars
-            "full_text": text
+            "pages": len(page_texts),
+            "text": "\n".join(preview)[:PDF_PREVIEW_CHARS],
+            "page_texts": page_texts,
+            "hash": key
         }
     except Exception as e:
         return {"error": f"Failed to parse PDF: {str(e)}"}
@@ -0,0 +1,139 @@
+import codecs
+from html.parser import HTMLParser
+
+# Subtrees whose text is never useful article content
+SKIP_TAGS = {'script', 'style', 'nav', 'footer', 'header', 'aside', 'title', 'noscript', 'template', 'svg'}
+# Elements allowed in <head>; any other start tag (or text) implies the optional </head>
+HEAD_TAGS = {'base', 'link', 'meta', 'noscript', 'script', 'style', 'template', 'title'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+# Bytes to scan for an <article>/<main> before settling for plain body text
+SCAN_LIMIT = 256 * 1024
+
+
+class StreamingExtractor(HTMLParser):
+    """
+    Incremental main-text extractor.
+
+    Feed HTML chunks as they arrive; skipped subtrees (script, style, nav, ...)
+    are never materialized, text inside the first <article> (else <main>, else
+    the whole body) is preferred, and parsing stops as soon as enough useful
+    text has been collected (feed() then returns True).
+    """
+
+    def __init__(self, max_length: int = 1000, scan_limit: int = SCAN_LIMIT):
+        super().__init__(convert_charrefs=True)
+        self.max_length = max_length
+        self.scan_limit = scan_limit
+        self.fed = 0
+        self.done = False
+        self._skip_depth = 0
+        self._in_head = False
+        self._pending = []  # Raw text since the last tag (chunks may split words)
+        self._depth = {'article': 0, 'main': 0}
+        self._closed = {'article': False, 'main': False}
+        self._parts = {'article': [], 'main': [], 'body': []}
+        self._length = {'article': 0, 'main': 0, 'body': 0}
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag == 'head':
+            self._in_head = True
+            return
+        if self._in_head and tag not in HEAD_TAGS:
+            self._in_head = False
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self._depth and not self._closed[tag]:
+            self._depth[tag] += 1
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>, <img/>, <div/>: same text boundary as the start tag; non-void ones close at once
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag != 'head':
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag == 'head':
+            self._in_head = False
+        elif tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self._depth and self._depth[tag] > 0:
+            self._depth[tag] -= 1
+            if self._depth[tag] == 0:
+                # Only the first <article> / <main> is used
+                self._closed[tag] = True
+
+    def handle_data(self, data):
+        if self._skip_depth or self.done:
+            return
+        if self._in_head:
+            if not data.strip():
+                return
+            self._in_head = False  # Text cannot be in <head>: the body has started
+        self._pending.append(data)
+
+    def _flush(self):
+        """Commits text seen since the last tag to the buckets it belongs to."""
+        if not self._pending:
+            return
+        text = ' '.join(''.join(self._pending).split())
+        self._pending = []
+        if not text:
+            return
+        self._add('body', text)
+        for tag in ('article', 'main'):
+            if self._depth[tag] > 0:
+                self._add(tag, text)
+
+    def _add(self, bucket: str, text: str):
+        # Keep one char beyond max_length so truncation can be detected
+        if self._length[bucket] > self.max_length:
+            return
+        self._parts[bucket].append(text)
+        self._length[bucket] += len(text) + 1
+
+    def _enough(self) -> bool:
+        if self._closed['article'] or self._length['article'] > self.max_length:
+            return True
+        if self.fed < self.scan_limit:
+            return False
+        # Past the scan window without an article: settle for main, then body
+        return self._closed['main'] or self._length['main'] > self.max_length or self._length['body'] > self.max_length
+
+    def feed(self, data: str) -> bool:
+        """Parses another chunk; returns True once no more input is needed."""
+        if self.done:
+            return True
+        self.fed += len(data)
+        super().feed(data)
+        self.done = self._enough()
+        return self.done
+
+    def result(self) -> str:
+        self._flush()
+        for bucket in ('article', 'main', 'body'):
+            if self._parts[bucket]:
+                text = ' '.join(' '.join(self._parts[bucket]).split())
+                return text[:self.max_length] + "..." if len(text) > self.max_length else text
+        return "(Could not extract content)"
+
+
+def extract_text_streaming(chunks, max_length: int = 1000, encoding: str = None) -> str:
+    """
+    Extracts main text from an iterable of HTML chunks (str or bytes),
+    consuming only as many chunks as needed.
+    """
+    extractor = StreamingExtractor(max_length)
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if extractor.feed(chunk):
+            break
+
+    return extractor.result()
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import threading
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'
+
+# One event loop (in a daemon thread) owns the shared AsyncClient, so its
+# connection pool is reused by every caller, sync or async, across sessions.
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+
+def _start_loop():
+    global _loop
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="http-pool", daemon=True)
+    thread.start()
+    _loop = loop
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the background loop that owns the shared client (starting it once)."""
+    with _lock:
+        if _loop is None:
+            _start_loop()
+        return _loop
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared pooled AsyncClient.
+    Must only be used from coroutines running on get_loop().
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers={'User-Agent': USER_AGENT},
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS
+            )
+        )
+    return _client
+
+
+def run_sync(coro, timeout: float = None):
+    """Runs a coroutine on the pool's loop from synchronous code and waits for it."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result(timeout)
+
+
+async def run_async(coro):
+    """Awaits a coroutine on the pool's loop from any other event loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, get_loop()))
@@ -1,39 +1,85 @@
 from datetime import datetime, timedelta
-import yfinance as yf
+from tools.price_store import load_prices, load_prices_bulk
+from tools.price_table import PriceTable
 
-def get_stock_prices(ticker: str, days: int = 30) -> dict:
+def get_stock_prices(ticker: str, days: int = 30, interval: str = "1d") -> dict:
     """
-    Fetches historical stock prices for a given ticker.
-    Returns dict with 'message', 'csv', and 'error' keys.
+    Fetches historical stock prices (full OHLCV) for a given ticker.
+    Bars already in the local price store are read from disk; only the
+    missing date range is downloaded.
+    Returns dict with 'message', 'data' (PriceTable) and 'error' keys.
     """
     ticker = ticker.upper().strip()
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
     
     try:
-        stock = yf.Ticker(ticker)
-        history = stock.history(start=start_date, end=end_date)
+        clean_data = load_prices(ticker, start_date, end_date, interval)
         
-        if history.empty:
+        if clean_data.empty:
             return {
                 "error": True,
                 "message": f"No data found for '{ticker}'",
-                "csv": ""
+                "data": None
             }
         
-        clean_data = history.reset_index()[['Date', 'Close', 'Volume']]
-        clean_data['Date'] = clean_data['Date'].dt.strftime('%Y-%m-%d')
-        csv_data = clean_data.to_csv(index=False)
-        
         return {
             "error": False,
             "message": f"Fetched {len(clean_data)} rows for {ticker}",
-            "csv": csv_data
+            "data": PriceTable.from_frame(clean_data)
         }
 
     except Exception as e:
         return {
             "error": True,
             "message": f"Error fetching market data: {str(e)}",
-            "csv": ""
+            "data": None
+        }
+
+
+def get_stock_prices_bulk(tickers: list, days: int = 30, interval: str = "1d") -> dict:
+    """
+    Fetches historical prices for several tickers with a single batched download.
+    
+    Args:
+        tickers: List of ticker symbols
+        days: Lookback window in days
+        interval: yfinance interval
+    
+    Returns:
+        Dict of {ticker: {'message', 'data', 'error'}} (same shape as
+        get_stock_prices), so per-ticker errors come back alongside results
+    """
+    symbols = []
+    for ticker in tickers:
+        ticker = ticker.upper().strip()
+        if ticker and ticker not in symbols:
+            symbols.append(ticker)
+    
+    if not symbols:
+        return {}
+    
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    
+    try:
+        frames = load_prices_bulk(symbols, start_date, end_date, interval)
+    except Exception as e:
+        return {
+            ticker: {"error": True, "message": f"Error fetching market data: {str(e)}", "data": None}
+            for ticker in symbols
         }
+    
+    results = {}
+    for ticker, frame in frames.items():
+        if isinstance(frame, Exception):
+            results[ticker] = {"error": True, "message": f"Error fetching market data: {str(frame)}", "data": None}
+        elif frame.empty:
+            results[ticker] = {"error": True, "message": f"No data found for '{ticker}'", "data": None}
+        else:
+            results[ticker] = {
+                "error": False,
+                "message": f"Fetched {len(frame)} rows for {ticker}",
+                "data": PriceTable.from_frame(frame)
+            }
+    return results
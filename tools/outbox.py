@@ -0,0 +1,252 @@
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from tools.email import deliver, smtp_settings, write_message
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+OUTBOX_PATH = Path(os.getenv("OUTBOX_PATH", CACHE_DIR / "outbox.sqlite"))
+OUTBOX_SPOOL_DIR = CACHE_DIR / "outbox"
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+OUTBOX_RETRY_MAX_SECONDS = 600
+# Sent / failed rows kept this long for status lookups
+OUTBOX_KEEP_SECONDS = 7 * 24 * 3600
+
+# queued -> sending -> sent | failed (queued again after a transient error)
+FINAL_STATUSES = ("sent", "failed")
+
+
+def _is_transient(error: Exception) -> bool:
+    """4xx replies and connection problems are retried; 5xx replies (bad address, auth) are not."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, OSError)  # Disconnects, timeouts, refused connections
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter after the given number of failed attempts."""
+    return random.uniform(0.5, 1.0) * min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+class Outbox:
+    """
+    Durable email queue. Messages are serialized to a spool file and
+    recorded in SQLite when queued; one background thread delivers them
+    over the shared SMTP session, retrying transient failures with
+    backoff. Queued messages survive a restart.
+    """
+
+    def __init__(self, path: Path = OUTBOX_PATH, spool_dir: Path = OUTBOX_SPOOL_DIR):
+        self.path = Path(path)
+        self.spool_dir = Path(spool_dir)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._wake = threading.Event()
+        self._changed = threading.Condition()
+        self._worker = None
+
+    def _connect(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipient TEXT,
+                    subject TEXT,
+                    spool_path TEXT,
+                    attachments INTEGER,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt REAL,
+                    error TEXT,
+                    created_at REAL,
+                    updated_at REAL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt)")
+            # A send interrupted by a restart is tried again
+            self._conn.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending'")
+            self._conn.commit()
+        return self._conn
+
+    def start(self):
+        """Starts the delivery thread (idempotent)."""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+                self._worker.start()
+
+    def enqueue(self, recipient: str, subject: str, body: str, attachments: list = None) -> int:
+        """
+        Serializes the message (attachments are read now, so later changes
+        to those files do not matter) and queues it.
+
+        Returns:
+            Outbox message id
+        """
+        settings = smtp_settings()
+        now = time.time()
+
+        # Attachments are encoded from their files into the spool file block by block
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        spool_path = self.spool_dir / f"{time.time_ns()}_{os.getpid()}.eml"
+        tmp_path = spool_path.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as f:
+            write_message(f, settings["user"], recipient, subject, body, attachments)
+        os.replace(tmp_path, spool_path)
+        size = spool_path.stat().st_size
+
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT INTO outbox (recipient, subject, spool_path, attachments, status, next_attempt, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (recipient, subject, str(spool_path), len(attachments or []), now, now, now)
+            )
+            conn.commit()
+            message_id = cursor.lastrowid
+
+        print(f"[OUTBOX] Queued #{message_id} to {recipient} ({size // 1024} KB)")
+        self.start()
+        self._wake.set()
+        return message_id
+
+    def status(self, message_id: int) -> dict:
+        """Returns {"id", "recipient", "status", "attempts", "error", "attachments"} (None if unknown)."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT id, recipient, status, attempts, error, attachments FROM outbox WHERE id = ?", (message_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "recipient", "status", "attempts", "error", "attachments"), row))
+
+    def wait(self, message_ids: list, timeout: float) -> list:
+        """
+        Blocks until every message is sent or failed, or the timeout passes.
+
+        Returns:
+            Current status() of each message
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                statuses = [self.status(message_id) for message_id in message_ids]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or all(s is None or s["status"] in FINAL_STATUSES for s in statuses):
+                    return statuses
+                self._changed.wait(remaining)
+
+    def _claim(self):
+        """Marks the oldest due message as sending; returns (row, None) or (None, seconds until the next one)."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT id, recipient, spool_path, attempts FROM outbox "
+                "WHERE status = 'queued' AND next_attempt <= ? ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                upcoming = conn.execute("SELECT MIN(next_attempt) FROM outbox WHERE status = 'queued'").fetchone()[0]
+                return None, (upcoming - now) if upcoming is not None else None
+            conn.execute("UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?", (now, row[0]))
+            conn.commit()
+            return row, None
+
+    def _finish(self, message_id: int, status: str, attempts: int, error: str = None, next_attempt: float = None):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, error = ?, next_attempt = ?, updated_at = ? WHERE id = ?",
+                (status, attempts, error, next_attempt, now, message_id)
+            )
+            conn.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at < ?", (now - OUTBOX_KEEP_SECONDS,))
+            conn.commit()
+        with self._changed:
+            self._changed.notify_all()
+
+    def _send(self, row: tuple):
+        message_id, recipient, spool_path, attempts = row
+        attempts += 1
+        try:
+            deliver(recipient, spool_path)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if _is_transient(e) and attempts < OUTBOX_MAX_ATTEMPTS:
+                delay = retry_delay(attempts)
+                print(f"[OUTBOX] #{message_id} attempt {attempts} failed ({error}), retrying in {delay:.0f}s")
+                self._finish(message_id, "queued", attempts, error, time.time() + delay)
+            else:
+                print(f"[OUTBOX ERROR] #{message_id} to {recipient} failed: {error}")
+                self._finish(message_id, "failed", attempts, error)
+                Path(spool_path).unlink(missing_ok=True)
+            return
+
+        self._finish(message_id, "sent", attempts)
+        Path(spool_path).unlink(missing_ok=True)
+        print(f"[OUTBOX] #{message_id} sent to {recipient}")
+
+    def _run(self):
+        while True:
+            try:
+                row, wait = self._claim()
+            except sqlite3.Error as e:
+                print(f"[OUTBOX ERROR] {e}")
+                row, wait = None, OUTBOX_RETRY_BASE_SECONDS
+            if row is not None:
+                self._send(row)
+                continue
+            # Sleep until the next retry is due or a new message arrives
+            self._wake.wait(wait)
+            self._wake.clear()
+
+
+_outbox = Outbox()
+
+
+def queue_email(recipient: str, subject: str, body: str, attachments: list = None) -> dict:
+    """
+    Queues an email for background delivery and returns immediately.
+
+    Args:
+        recipient: Email address to send to
+        subject: Email subject line
+        body: Email body (HTML)
+        attachments: Optional list of file paths to attach
+
+    Returns:
+        Dict with 'id' and 'message' (status text), or 'error'
+    """
+    settings = smtp_settings()
+    if not settings["user"] or not settings["password"]:
+        return {"error": "Email not configured. Set EMAIL_USER and EMAIL_PASSWORD in .env file."}
+    try:
+        message_id = _outbox.enqueue(recipient, subject, body, attachments)
+    except Exception as e:
+        return {"error": f"Failed to queue email: {str(e)}"}
+    attachment_info = f" with {len(attachments)} attachment(s)" if attachments else ""
+    return {"id": message_id, "message": f"Email to {recipient}{attachment_info} queued for delivery (#{message_id})"}
+
+
+def email_status(message_id: int) -> dict:
+    """Delivery status of a queued email (see Outbox.status)."""
+    return _outbox.status(message_id)
+
+
+def wait_for_delivery(message_ids: list, timeout: float) -> list:
+    """Waits up to `timeout` seconds for queued emails to be sent or fail; returns their statuses."""
+    return _outbox.wait(message_ids, timeout)
+
+
+def resume():
+    """Starts delivering messages left queued by a previous run."""
+    _outbox.start()
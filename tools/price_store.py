@@ -0,0 +1,389 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+import yfinance as yf
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+MARKET_STORE_PATH = Path(os.getenv("MARKET_STORE_PATH", CACHE_DIR / "market.sqlite"))
+
+# How long the most recent bars are trusted before the tail is re-synced
+MARKET_REFRESH_SECONDS = int(os.getenv("MARKET_REFRESH_SECONDS", "900"))
+# After a download returns no rows, the series is not asked for again this long.
+# Windows of a stored series always include a stored bar, so an empty result
+# means a failed request (yfinance answers network / rate-limit errors with
+# empty frames) and is never recorded as synced coverage.
+MARKET_EMPTY_RETRY_SECONDS = int(os.getenv("MARKET_EMPTY_RETRY_SECONDS", "120"))
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+_lock = threading.Lock()
+_conn = None
+# yf.download keeps per-call results in module globals (shared._DFS), so
+# overlapping calls from concurrent steps / sessions would mix or hang
+_download_lock = threading.Lock()
+_empty_until = {}  # (ticker, interval) -> monotonic time the next download may happen
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        MARKET_STORE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(MARKET_STORE_PATH), check_same_thread=False)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS prices (
+                ticker TEXT, interval TEXT, date TEXT,
+                open REAL, high REAL, low REAL, close REAL, volume INTEGER,
+                PRIMARY KEY (ticker, interval, date)
+            )"""
+        )
+        # Date range already synced per series (requested range, not bar dates,
+        # so holidays or pre-IPO windows inside a successful download are not
+        # re-fetched forever)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS coverage (
+                ticker TEXT, interval TEXT, start TEXT, end TEXT, synced_at REAL,
+                PRIMARY KEY (ticker, interval)
+            )"""
+        )
+        # Dividend / split dates the stored (adjusted) bars already reflect
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS actions (
+                ticker TEXT, interval TEXT, date TEXT,
+                PRIMARY KEY (ticker, interval, date)
+            )"""
+        )
+        _conn.commit()
+    return _conn
+
+
+def _is_daily(interval: str) -> bool:
+    return interval.endswith(('d', 'wk', 'mo'))
+
+
+def _date_format(interval: str) -> str:
+    return '%Y-%m-%d' if _is_daily(interval) else '%Y-%m-%d %H:%M:%S'
+
+
+def _floor(moment: datetime, interval: str) -> datetime:
+    """Daily bars are stamped at midnight; align window starts to the day."""
+    if _is_daily(interval):
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment
+
+
+def _download(ticker: str, start: datetime, end: datetime, interval: str) -> tuple:
+    """
+    Downloads [start, end] from yfinance.
+
+    Returns:
+        (Date + OHLCV frame, dates of dividends / splits in the window)
+    """
+    # yfinance treats `end` as exclusive
+    history = yf.Ticker(ticker).history(
+        start=_floor(start, interval), end=end + timedelta(days=1), interval=interval, actions=True
+    )
+    return normalize_history(history, interval), action_dates(history, interval)
+
+
+def normalize_history(history: pd.DataFrame, interval: str = "1d") -> pd.DataFrame:
+    """Converts a yfinance history frame into Date (string) + OHLCV columns."""
+    if history is None or history.empty:
+        return pd.DataFrame(columns=['Date'] + OHLCV_COLUMNS)
+
+    frame = history.reset_index()
+    date_col = 'Date' if 'Date' in frame.columns else frame.columns[0]
+    frame = frame.rename(columns={date_col: 'Date'})
+    frame['Date'] = pd.to_datetime(frame['Date']).dt.strftime(_date_format(interval))
+    frame = frame[['Date'] + OHLCV_COLUMNS].dropna(subset=['Close'])
+    frame['Volume'] = frame['Volume'].fillna(0).astype('int64')
+    return frame
+
+
+def action_dates(history: pd.DataFrame, interval: str = "1d") -> list:
+    """Dates with a dividend or stock split in a yfinance history frame (actions=True)."""
+    if history is None or history.empty:
+        return []
+    columns = [c for c in ('Dividends', 'Stock Splits') if c in history.columns]
+    if not columns:
+        return []
+    has_action = (history[columns].fillna(0) != 0).any(axis=1)
+    dates = pd.to_datetime(history.index[has_action.to_numpy()])
+    return sorted(set(dates.strftime(_date_format(interval))))
+
+
+def _missing_ranges(coverage, bars, start: datetime, end: datetime, now: float) -> list:
+    """
+    Returns the (start, end) windows that must be downloaded. Each window
+    of a stored series reaches its first / last stored bar (`bars`), so a
+    working download is never empty and an empty one can be told apart
+    from a stretch without trading.
+    """
+    if coverage is None:
+        return [(start, end)]
+
+    cov_start = datetime.fromisoformat(coverage[0])
+    cov_end = datetime.fromisoformat(coverage[1])
+    synced_at = coverage[2]
+    first_bar = datetime.fromisoformat(bars[0]) if bars[0] else None
+    last_bar = datetime.fromisoformat(bars[1]) if bars[1] else None
+
+    ranges = []
+    if start < cov_start:
+        ranges.append((start, max(cov_start, first_bar) if first_bar else cov_start))
+
+    stale_tail = now - synced_at > MARKET_REFRESH_SECONDS
+    if end.date() > cov_end.date() or (stale_tail and end.date() >= cov_end.date()):
+        # Re-sync from the last covered day: its bar may have been partial
+        tail_start = max(cov_end, start)
+        if last_bar:
+            tail_start = min(tail_start, last_bar)
+        ranges.append((tail_start, end))
+
+    return ranges
+
+
+def store_history(ticker: str, frame: pd.DataFrame, start: datetime, end: datetime, interval: str = "1d", actions: list = ()):
+    """Upserts bars (and their corporate action dates) and extends the series' synced range to cover [start, end]."""
+    now = time.time()
+    rows = [
+        (ticker, interval, r.Date, float(r.Open), float(r.High), float(r.Low), float(r.Close), int(r.Volume))
+        for r in frame.itertuples(index=False)
+    ]
+
+    with _lock:
+        conn = _connect()
+        conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT OR IGNORE INTO actions VALUES (?, ?, ?)", [(ticker, interval, d) for d in actions])
+        coverage = conn.execute(
+            "SELECT start, end, synced_at FROM coverage WHERE ticker = ? AND interval = ?", (ticker, interval)
+        ).fetchone()
+        new_start, new_end, synced_at = start.isoformat(), end.isoformat(), now
+        if coverage:
+            # Back-filling older history does not refresh the tail
+            if new_end < coverage[1]:
+                synced_at = coverage[2]
+            new_start = min(new_start, coverage[0])
+            new_end = max(new_end, coverage[1])
+        conn.execute(
+            "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?)",
+            (ticker, interval, new_start, new_end, synced_at)
+        )
+        conn.commit()
+
+
+def has_new_actions(ticker: str, actions: list, interval: str = "1d") -> bool:
+    """
+    True when a download shows a dividend / split inside the stored range
+    that the stored bars predate. yfinance adjusts the whole history for it,
+    so the stored bars are on an older adjustment basis than new ones.
+    """
+    if not actions:
+        return False
+    with _lock:
+        conn = _connect()
+        coverage = conn.execute(
+            "SELECT start FROM coverage WHERE ticker = ? AND interval = ?", (ticker, interval)
+        ).fetchone()
+        if coverage is None:
+            return False
+        known = {row[0] for row in conn.execute(
+            "SELECT date FROM actions WHERE ticker = ? AND interval = ?", (ticker, interval)
+        )}
+    # Actions before the stored range happened before any stored bar was downloaded
+    cov_start = datetime.fromisoformat(coverage[0]).strftime(_date_format(interval))
+    return any(d >= cov_start and d not in known for d in actions)
+
+
+def reset_series(ticker: str, interval: str = "1d"):
+    """Drops a series' bars, coverage and action dates."""
+    with _lock:
+        conn = _connect()
+        for table in ("prices", "coverage", "actions"):
+            conn.execute(f"DELETE FROM {table} WHERE ticker = ? AND interval = ?", (ticker, interval))
+        conn.commit()
+
+
+def _rebase(ticker: str, start: datetime, end: datetime, interval: str):
+    """Replaces a series whose adjustment basis changed with a fresh download of [start, end]."""
+    print(f"[MARKET STORE] {ticker}: new dividend / split, re-syncing {start:%Y-%m-%d} -> {end:%Y-%m-%d}")
+    reset_series(ticker, interval)
+    frame, actions = _download(ticker, start, end, interval)
+    if frame.empty:
+        mark_empty(ticker, interval)
+        return
+    store_history(ticker, frame, start, end, interval, actions)
+
+
+def mark_empty(ticker: str, interval: str = "1d"):
+    """Records an empty download: no coverage, just a short pause before retrying."""
+    with _lock:
+        _empty_until[(ticker, interval)] = time.monotonic() + MARKET_EMPTY_RETRY_SECONDS
+
+
+def plan_sync(ticker: str, start: datetime, end: datetime, interval: str = "1d") -> list:
+    """
+    Returns the windows of [start, end] not yet in the store for a ticker
+    (none while the series is paused after an empty download).
+    """
+    with _lock:
+        if time.monotonic() < _empty_until.get((ticker, interval), 0):
+            return []
+        conn = _connect()
+        coverage = conn.execute(
+            "SELECT start, end, synced_at FROM coverage WHERE ticker = ? AND interval = ?",
+            (ticker, interval)
+        ).fetchone()
+        bars = conn.execute(
+            "SELECT MIN(date), MAX(date) FROM prices WHERE ticker = ? AND interval = ?", (ticker, interval)
+        ).fetchone()
+    return _missing_ranges(coverage, bars, start, end, time.time())
+
+
+def read_prices(ticker: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+    """Reads stored bars in [start, end] as a Date + OHLCV frame."""
+    fmt = _date_format(interval)
+    with _lock:
+        rows = _connect().execute(
+            """SELECT date, open, high, low, close, volume FROM prices
+               WHERE ticker = ? AND interval = ? AND date >= ? AND date <= ?
+               ORDER BY date""",
+            (ticker, interval, start.strftime(fmt), end.strftime(fmt))
+        ).fetchall()
+    return pd.DataFrame(rows, columns=['Date'] + OHLCV_COLUMNS)
+
+
+def load_prices(ticker: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+    """
+    Returns OHLCV bars for [start, end], downloading only what the local
+    store does not already cover.
+
+    Args:
+        ticker: Symbol (already normalized)
+        start: Window start
+        end: Window end (usually now)
+        interval: yfinance interval ("1d", "1h", ...)
+
+    Returns:
+        DataFrame with Date, Open, High, Low, Close, Volume
+    """
+    start = _floor(start, interval)
+    synced = True
+    
+    for fetch_start, fetch_end in plan_sync(ticker, start, end, interval):
+        print(f"[MARKET STORE] Syncing {ticker} {fetch_start:%Y-%m-%d} -> {fetch_end:%Y-%m-%d}")
+        try:
+            frame, actions = _download(ticker, fetch_start, fetch_end, interval)
+            if frame.empty:
+                print(f"[MARKET STORE] {ticker}: no rows returned, not marking {fetch_start:%Y-%m-%d} -> {fetch_end:%Y-%m-%d} as synced")
+                mark_empty(ticker, interval)
+                continue
+            if has_new_actions(ticker, actions, interval):
+                _rebase(ticker, start, end, interval)  # Covers the other windows too
+                break
+        except Exception as e:
+            print(f"[MARKET STORE ERROR] {ticker}: {e}")
+            synced = False
+            continue
+        store_history(ticker, frame, fetch_start, fetch_end, interval, actions)
+
+    frame = read_prices(ticker, start, end, interval)
+    if frame.empty and not synced:
+        raise RuntimeError(f"could not download {ticker} and no local data is stored")
+    return frame
+
+
+def _download_bulk(tickers: list, start: datetime, end: datetime, interval: str) -> dict:
+    """
+    Downloads [start, end] for several tickers in one batched yfinance request
+    (yfinance fans out over threads internally where it has to). Only one
+    batched request runs at a time in this process.
+
+    Returns:
+        {ticker: (Date + OHLCV frame, dividend / split dates)} for every requested ticker
+    """
+    with _download_lock:
+        history = yf.download(
+            tickers,
+            start=_floor(start, interval),
+            end=end + timedelta(days=1),
+            interval=interval,
+            group_by='ticker',
+            auto_adjust=True,
+            actions=True,
+            threads=True,
+            progress=False
+        )
+
+    frames = {}
+    for ticker in tickers:
+        if history is None or history.empty:
+            ticker_history = None
+        elif isinstance(history.columns, pd.MultiIndex):
+            if ticker in history.columns.get_level_values(0):
+                ticker_history = history[ticker].dropna(how='all')
+            else:
+                ticker_history = None
+        else:
+            ticker_history = history
+        frames[ticker] = (normalize_history(ticker_history, interval), action_dates(ticker_history, interval))
+    return frames
+
+
+def load_prices_bulk(tickers: list, start: datetime, end: datetime, interval: str = "1d") -> dict:
+    """
+    Batched version of load_prices for several tickers.
+
+    Tickers that need syncing are downloaded together in a single request
+    covering the union of their missing windows.
+
+    Returns:
+        {ticker: DataFrame or Exception}; errors are reported per ticker
+    """
+    start = _floor(start, interval)
+    results = {}
+
+    windows = {}
+    for ticker in tickers:
+        ranges = plan_sync(ticker, start, end, interval)
+        if ranges:
+            windows[ticker] = (min(r[0] for r in ranges), max(r[1] for r in ranges))
+
+    failed = {}
+    if windows:
+        fetch_start = min(w[0] for w in windows.values())
+        fetch_end = max(w[1] for w in windows.values())
+        print(f"[MARKET STORE] Syncing {len(windows)} ticker(s) in one request {fetch_start:%Y-%m-%d} -> {fetch_end:%Y-%m-%d}")
+        try:
+            frames = _download_bulk(list(windows), fetch_start, fetch_end, interval)
+        except Exception as e:
+            print(f"[MARKET STORE ERROR] bulk download: {e}")
+            frames = {}
+            failed = {ticker: e for ticker in windows}
+        for ticker, (frame, actions) in frames.items():
+            if frame.empty:
+                # Bad symbol or a failed / rate-limited request (yfinance does not
+                # raise): leave coverage untouched and retry after a short pause
+                failed[ticker] = "no rows returned"
+                mark_empty(ticker, interval)
+                continue
+            if has_new_actions(ticker, actions, interval):
+                try:
+                    _rebase(ticker, start, end, interval)
+                except Exception as e:
+                    print(f"[MARKET STORE ERROR] {ticker}: {e}")
+                    failed[ticker] = e
+                continue
+            store_history(ticker, frame, fetch_start, fetch_end, interval, actions)
+
+    for ticker in tickers:
+        frame = read_prices(ticker, start, end, interval)
+        if frame.empty and ticker in failed:
+            results[ticker] = RuntimeError(f"could not download {ticker}: {failed[ticker]}")
+        else:
+            results[ticker] = frame
+    return results
@@ -0,0 +1,105 @@
+import hashlib
+import io
+
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+
+# float32 keeps ~7 significant digits; print exactly that many
+FLOAT_FORMAT = '%.7g'
+
+
+class PriceTable:
+    """
+    Compact, typed price history: a datetime64 date index plus float32 price
+    columns and an int64 Volume column. This is the canonical in-memory form of
+    context_data['market_data']; CSV text is only produced on export.
+    """
+
+    __slots__ = ('dates', 'columns', '_csv', '_version')
+
+    def __init__(self, dates: np.ndarray, columns: dict):
+        self.dates = dates
+        self.columns = columns
+        self._csv = None
+        self._version = None
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> "PriceTable":
+        """Builds a table from a frame with a Date column plus OHLCV columns."""
+        dates = pd.to_datetime(frame['Date']).to_numpy()
+        unit = 'D' if len(dates) == 0 or (dates == dates.astype('datetime64[D]')).all() else 's'
+        columns = {}
+        for col in frame.columns:
+            if col == 'Date':
+                continue
+            if col == 'Volume':
+                columns[col] = frame[col].fillna(0).to_numpy(dtype=np.int64)
+            elif pd.api.types.is_numeric_dtype(frame[col]):
+                columns[col] = frame[col].to_numpy(dtype=np.float32)
+        return cls(dates.astype(f'datetime64[{unit}]'), columns)
+
+    @classmethod
+    def from_csv(cls, csv_text: str) -> "PriceTable":
+        """Parses legacy CSV text (Date + numeric columns)."""
+        return cls.from_frame(pd.read_csv(io.StringIO(csv_text)))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.dates) == 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + sum(col.nbytes for col in self.columns.values())
+
+    @property
+    def version(self) -> str:
+        """Content hash; changes whenever the underlying data changes."""
+        if self._version is None:
+            digest = hashlib.sha1(self.dates.tobytes())
+            for name in sorted(self.columns):
+                digest.update(name.encode())
+                digest.update(self.columns[name].tobytes())
+            self._version = digest.hexdigest()
+        return self._version
+
+    def date_strings(self) -> np.ndarray:
+        unit = np.datetime_data(self.dates.dtype)[0]
+        return np.datetime_as_string(self.dates, unit='D' if unit == 'D' else 's')
+
+    def to_frame(self) -> pd.DataFrame:
+        """Zero-parse DataFrame view with a Date column (datetime64)."""
+        frame = pd.DataFrame(self.columns, copy=False)
+        frame.insert(0, 'Date', self.dates)
+        return frame
+
+    def to_csv(self) -> str:
+        """Serializes to CSV (memoized, so repeated exports are free)."""
+        if self._csv is None:
+            frame = pd.DataFrame(self.columns, copy=False)
+            frame.insert(0, 'Date', self.date_strings())
+            self._csv = frame.to_csv(index=False, float_format=FLOAT_FORMAT)
+        return self._csv
+
+    def excerpt(self, head: int = 5, tail: int = 5) -> str:
+        """CSV text of the first `head` and last `tail` rows, for LLM prompts."""
+        if len(self) <= head + tail:
+            return self.to_csv()
+        frame = pd.DataFrame(self.columns, copy=False)
+        frame.insert(0, 'Date', self.date_strings())
+        top = frame.iloc[:head].to_csv(index=False, float_format=FLOAT_FORMAT)
+        bottom = frame.iloc[-tail:].to_csv(index=False, header=False, float_format=FLOAT_FORMAT)
+        return top + "...\n" + bottom
+
+
+def as_price_table(data) -> PriceTable:
+    """Accepts a PriceTable, a DataFrame or legacy CSV text."""
+    if isinstance(data, PriceTable):
+        return data
+    if isinstance(data, pd.DataFrame):
+        return PriceTable.from_frame(data)
+    return PriceTable.from_csv(data)
@@ -0,0 +1,228 @@
+import itertools
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import pandas as pd
+
+from tools.file_parser import file_hash, load_cached, store_cached
+
+# Words per text chunk, and words repeated between neighbouring chunks
+CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "200"))
+CHUNK_OVERLAP = 40
+# Table rows (CSV / Excel) per chunk
+CHUNK_ROWS = 20
+# Upper bound on chunks per document (very large tables are indexed from the top)
+MAX_CHUNKS = int(os.getenv("RETRIEVAL_MAX_CHUNKS", "20000"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Bump when chunking changes so persisted indexes are rebuilt
+INDEX_VERSION = 1
+# Hits scoring below this fraction of the best hit are dropped (terms common to every chunk)
+MIN_RELATIVE_SCORE = 0.2
+INDEX_MEMORY_MAX = 16
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'in', 'is',
+    'it', 'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'what', 'which',
+    'with', 'how', 'does', 'did', 'do', 'about', 'me', 'tell', 'show', 'please', 'file', 'document',
+}
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+
+_indexes = OrderedDict()  # file hash -> BM25Index
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list:
+    """Lowercase word / number tokens without stopwords."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _text_chunks(text: str, location: str):
+    words = text.split()
+    step = max(1, CHUNK_WORDS - CHUNK_OVERLAP)
+    for start in range(0, max(len(words), 1), step):
+        piece = " ".join(words[start:start + CHUNK_WORDS])
+        if piece:
+            yield {"text": piece, "location": location}
+        if start + CHUNK_WORDS >= len(words):
+            break
+
+
+def _table_chunks(df: pd.DataFrame, label: str, first_row: int = 0):
+    """Row groups rendered as 'column: value' lines, so headers are searchable with every row."""
+    columns = [str(c) for c in df.columns]
+    for start in range(0, len(df), CHUNK_ROWS):
+        block = df.iloc[start:start + CHUNK_ROWS]
+        lines = [
+            "; ".join(f"{col}: {val}" for col, val in zip(columns, row) if not pd.isna(val))
+            for row in block.itertuples(index=False, name=None)
+        ]
+        end = first_row + start + len(block)
+        yield {"text": "\n".join(lines), "location": f"{label}rows {first_row + start + 1}-{end}"}
+
+
+def _document_chunks(parsed: dict):
+    file_type = parsed.get("type")
+
+    if file_type == "pdf":
+        for number, text in enumerate(parsed["page_texts"], 1):
+            yield from _text_chunks(text, f"page {number}")
+
+    elif file_type == "csv":
+        # One reader block in memory at a time
+        first_row = 0
+        for block in pd.read_csv(parsed["path"], chunksize=CHUNK_ROWS * 500):
+            yield from _table_chunks(block, "", first_row)
+            first_row += len(block)
+
+    elif file_type == "excel":
+        # One sheet at a time; sheets nobody asked for are not kept decoded
+        workbook = parsed["workbook"]
+        for sheet in workbook.sheet_names:
+            yield from _table_chunks(workbook.frame(sheet, keep=False), f"sheet {sheet}, ")
+
+
+def chunk_document(parsed: dict):
+    """
+    Splits a parsed upload (parse_uploaded_file output) into retrieval chunks,
+    lazily: the source is read only as far as the first MAX_CHUNKS chunks.
+
+    Returns:
+        Iterator of {"text", "location"} dicts; location is e.g. "page 12" or "sheet Q3, rows 41-60"
+    """
+    return itertools.islice(_document_chunks(parsed), MAX_CHUNKS)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a document's chunks, held as an inverted index
+    (term -> [[chunk, term frequency], ...]) so a query only touches
+    the chunks that contain its terms.
+    """
+
+    def __init__(self, chunks: list, postings: dict, lengths: list):
+        self.chunks = chunks
+        self.postings = postings
+        self.lengths = lengths
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks) -> "BM25Index":
+        """Indexes chunks from any iterable, consuming it once."""
+        stored = []
+        postings = {}
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            stored.append(chunk)
+            terms = Counter(tokenize(chunk["text"]))
+            lengths.append(sum(terms.values()))
+            for term, count in terms.items():
+                postings.setdefault(term, []).append([i, count])
+        return cls(stored, postings, lengths)
+
+    def to_dict(self) -> dict:
+        return {"version": INDEX_VERSION, "chunks": self.chunks, "postings": self.postings, "lengths": self.lengths}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls(data["chunks"], data["postings"], data["lengths"])
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> list:
+        """Top-k chunks for the query as (score, chunk) pairs, best first."""
+        total = len(self.chunks)
+        if not total or not self.avg_length:
+            return []
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, self.chunks[i]) for i, score in best]
+
+
+def _remember(key: str, index: BM25Index):
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > INDEX_MEMORY_MAX:
+            _indexes.popitem(last=False)
+
+
+def _get_index(key: str):
+    """Index for a file hash from memory, else from the on-disk cache (None if unknown)."""
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+    data = load_cached(key, f"bm25v{INDEX_VERSION}")
+    if data is None:
+        return None
+    index = BM25Index.from_dict(data)
+    _remember(key, index)
+    return index
+
+
+def index_document(file_path: str, parsed: dict) -> str:
+    """
+    Builds (or loads) the retrieval index of an uploaded file.
+    Indexes are stored by file content hash, so re-uploads are not re-chunked.
+
+    Args:
+        file_path: Path to the uploaded file
+        parsed: parse_uploaded_file output for it
+
+    Returns:
+        The file hash identifying the index (pass it to search_documents)
+    """
+    key = parsed.get("hash") or file_hash(file_path)
+    if _get_index(key) is not None:
+        print(f"[RETRIEVAL] Index cache hit for {os.path.basename(file_path)}")
+        return key
+
+    index = BM25Index.build(chunk_document(parsed))
+    store_cached(key, f"bm25v{INDEX_VERSION}", index.to_dict())
+    _remember(key, index)
+    print(f"[RETRIEVAL] Indexed {len(index.chunks)} chunk(s) from {os.path.basename(file_path)}")
+    return key
+
+
+def search_documents(documents: list, query: str, k: int = RETRIEVAL_TOP_K) -> list:
+    """
+    Most relevant chunks across the session's uploaded documents.
+
+    Args:
+        documents: context_data['documents'] ([{"name", "hash", ...}])
+        query: The user's question
+
+    Returns:
+        Up to k dicts with 'name', 'location', 'text' and 'score', best first
+    """
+    hits = []
+    for doc in documents or []:
+        index = _get_index(doc["hash"])
+        if index is None:
+            continue
+        for score, chunk in index.search(query, k):
+            hits.append({"name": doc["name"], "location": chunk["location"], "text": chunk["text"], "score": score})
+    hits.sort(key=lambda hit: hit["score"], reverse=True)
+    if not hits or hits[0]["score"] <= 0:
+        return []
+    cutoff = hits[0]["score"] * MIN_RELATIVE_SCORE
+    return [hit for hit in hits[:k] if hit["score"] >= cutoff]
+
+
+def format_excerpts(hits: list) -> str:
+    """Renders search_documents hits as labelled excerpts for a prompt."""
+    return "\n\n".join(f"[{hit['name']}, {hit['location']}]\n{hit['text']}" for hit in hits)
@@ -0,0 +1,506 @@
+import base64
+import builtins
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Warm worker processes kept ready for calculation steps
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "10"))         # Wall clock per run
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "5"))     # CPU time per run
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "1024"))      # Address space per worker
+SANDBOX_START_TIMEOUT = 30                                          # Worker warm-up (imports)
+SANDBOX_MAX_OUTPUT = 4000
+# Larger replies are refused by the parent; the worker shortens the result to fit
+SANDBOX_MAX_REPLY_BYTES = 1024 * 1024
+# Price tables a worker keeps between runs before it is told to start over
+SANDBOX_MAX_TABLES = 32
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# Workers start from a clean environment: nothing from .env (API keys, SMTP password) reaches them
+WORKER_ENV = {
+    "PATH": os.defpath,
+    "LANG": "C.UTF-8",
+    "OPENBLAS_NUM_THREADS": "1",
+    "OMP_NUM_THREADS": "1",
+}
+# Unprivileged account the worker switches to when the app runs as root
+SANDBOX_UID = 65534  # nobody
+SANDBOX_GID = 65534
+
+# Modules user code may import (numpy / pandas are also pre-bound as np / pd).
+# This and BLOCKED_BUILTINS only keep generated code on the intended path;
+# numpy / pandas expose `os` and friends, so they are not a security boundary.
+ALLOWED_MODULES = {
+    'math', 'cmath', 'statistics', 'decimal', 'fractions', 'random', 'datetime',
+    'itertools', 'functools', 'collections', 'operator', 're', 'json', 'numpy', 'pandas',
+}
+BLOCKED_BUILTINS = {
+    'open', 'exec', 'eval', 'compile', 'input', 'breakpoint', 'help', 'exit', 'quit',
+    'globals', 'locals', 'vars', 'memoryview', '__import__',
+}
+
+
+# ---------------------------------------------------------------------------
+# Worker side (runs in the child process)
+# ---------------------------------------------------------------------------
+
+# seccomp (Linux): syscalls refused inside a worker. Process creation, exec,
+# new sockets and opening files fail with EPERM; clone is allowed for threads only.
+_SECCOMP_ARCHES = {
+    # machine: (AUDIT_ARCH, clone, clone3, denied syscalls)
+    "x86_64": (0xC000003E, 56, 435, {
+        57: "fork", 58: "vfork", 59: "execve", 322: "execveat", 41: "socket", 53: "socketpair",
+        101: "ptrace", 425: "io_uring_setup", 272: "unshare", 308: "setns", 165: "mount", 321: "bpf",
+        2: "open", 85: "creat", 257: "openat", 437: "openat2", 303: "name_to_handle_at", 304: "open_by_handle_at",
+    }),
+    "aarch64": (0xC00000B7, 220, 435, {
+        221: "execve", 281: "execveat", 198: "socket", 199: "socketpair", 117: "ptrace",
+        425: "io_uring_setup", 97: "unshare", 268: "setns", 40: "mount", 280: "bpf",
+        56: "openat", 437: "openat2", 264: "name_to_handle_at", 265: "open_by_handle_at",
+    }),
+}
+
+
+def _install_seccomp():
+    """Loads the syscall filter for this process (irreversible; raises if the kernel refuses)."""
+    import ctypes
+    import errno
+    import platform
+
+    machine = platform.machine()
+    if machine not in _SECCOMP_ARCHES:
+        raise OSError(f"seccomp filter not available for {machine}")
+    audit_arch, clone, clone3, denied = _SECCOMP_ARCHES[machine]
+
+    # Classic BPF over struct seccomp_data {int nr; u32 arch; u64 ip; u64 args[6];}
+    ld, jeq, jge, jset, ret = 0x20, 0x15, 0x35, 0x45, 0x06
+    allow, kill, fail = 0x7FFF0000, 0x80000000, 0x00050000
+    clone_thread = 0x00010000
+
+    program = [
+        (ld, 0, 0, 4),                     # arch
+        (jeq, 1, 0, audit_arch),
+        (ret, 0, 0, kill),
+        (ld, 0, 0, 0),                     # syscall number
+    ]
+    if machine == "x86_64":
+        program += [(jge, 0, 1, 0x40000000), (ret, 0, 0, fail | errno.EPERM)]  # x32 ABI
+    for number in sorted(denied):
+        program += [(jeq, 0, 1, number), (ret, 0, 0, fail | errno.EPERM)]
+    # glibc falls back from clone3 to clone, where the flags can be inspected
+    program += [(jeq, 0, 1, clone3), (ret, 0, 0, fail | errno.ENOSYS)]
+    program += [
+        (jeq, 0, 3, clone),
+        (ld, 0, 0, 16),                    # args[0] (flags), low word
+        (jset, 1, 0, clone_thread),
+        (ret, 0, 0, fail | errno.EPERM),   # new process
+        (ret, 0, 0, allow),
+    ]
+
+    class SockFilter(ctypes.Structure):
+        _fields_ = [("code", ctypes.c_ushort), ("jt", ctypes.c_ubyte), ("jf", ctypes.c_ubyte), ("k", ctypes.c_uint32)]
+
+    class SockFprog(ctypes.Structure):
+        _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.POINTER(SockFilter))]
+
+    filters = (SockFilter * len(program))(*[SockFilter(*instruction) for instruction in program])
+    fprog = SockFprog(len(program), filters)
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.prctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong]
+    pr_set_no_new_privs, pr_set_seccomp, seccomp_mode_filter = 38, 22, 2
+    if libc.prctl(pr_set_no_new_privs, 1, None, 0, 0) != 0:
+        raise OSError(ctypes.get_errno(), "prctl(PR_SET_NO_NEW_PRIVS) failed")
+    if libc.prctl(pr_set_seccomp, seccomp_mode_filter, ctypes.cast(ctypes.pointer(fprog), ctypes.c_void_p), 0, 0) != 0:
+        raise OSError(ctypes.get_errno(), "prctl(PR_SET_SECCOMP) failed")
+
+
+def _limit_resources(memory_mb: int):
+    """
+    Locks the worker down for good: memory cap, no file writes, no child
+    processes, unprivileged user (when started as root), and a seccomp
+    filter refusing fork / exec / socket creation and every file open at
+    the kernel level (the app's files, .env included, cannot be read even
+    when the app does not run as root).
+    """
+    import resource
+
+    memory = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))  # Not enforced for root, hence the switch below
+
+    if os.getuid() == 0:
+        os.setgroups([])
+        os.setgid(SANDBOX_GID)
+        os.setuid(SANDBOX_UID)
+
+    _install_seccomp()
+
+
+def _limit_cpu(seconds: int):
+    """Sets the CPU soft limit `seconds` past the time used so far (SIGXCPU kills the worker)."""
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (used + seconds, hard))
+
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name.split('.')[0] not in ALLOWED_MODULES:
+        raise ImportError(f"Import of '{name}' is not allowed in the sandbox")
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+def _describe(value) -> object:
+    """Turns a result into something JSON-friendly (tables become text)."""
+    import numpy as np
+    import pandas as pd
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.head(50).to_string()[:SANDBOX_MAX_OUTPUT]
+    if isinstance(value, np.ndarray):
+        return value.tolist() if value.size <= 100 else repr(value)[:SANDBOX_MAX_OUTPUT]
+    if isinstance(value, (list, tuple)) and len(value) <= 100:
+        return [_describe(v) for v in value]
+    if isinstance(value, dict) and len(value) <= 100:
+        return {str(k): _describe(v) for k, v in value.items()}
+    return repr(value)[:SANDBOX_MAX_OUTPUT]
+
+
+def _read_exact(fd: int, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = os.read(fd, min(size, 1024 * 1024))
+        if not chunk:
+            raise EOFError
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _read_message(fd: int) -> dict:
+    """Reads one JSON message framed like multiprocessing Connection.send_bytes."""
+    size, = struct.unpack("!i", _read_exact(fd, 4))
+    if size == -1:
+        size, = struct.unpack("!Q", _read_exact(fd, 8))
+    return json.loads(_read_exact(fd, size))
+
+
+def _write_message(fd: int, message: dict):
+    data = json.dumps(message, default=str).encode()
+    if len(data) > SANDBOX_MAX_REPLY_BYTES and "result" in message:
+        message = dict(message, result=str(message["result"])[:SANDBOX_MAX_OUTPUT])
+        data = json.dumps(message, default=str).encode()
+    view = memoryview(struct.pack("!i", len(data)) + data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _decode_array(encoded: dict):
+    import numpy as np
+
+    return np.frombuffer(base64.b64decode(encoded["data"]), dtype=np.dtype(encoded["dtype"]))
+
+
+def _run_job(job: dict, tables: dict, safe_builtins: dict) -> dict:
+    import contextlib
+    import io
+    import math
+
+    import numpy as np
+    import pandas as pd
+
+    if job.get("reset"):
+        tables.clear()
+    for version, table in job["tables"].items():
+        frame = pd.DataFrame({name: _decode_array(col) for name, col in table["columns"].items()}, copy=False)
+        frame.insert(0, 'Date', _decode_array(table["dates"]))
+        tables[version] = frame
+
+    # Copies: one run must not see another run's modifications
+    prices = {ticker: tables[version].copy() for ticker, version in job["prices"].items()}
+    job_id, code, cpu_seconds = job["id"], job["code"], job["cpu_seconds"]
+    del job  # Nothing from the request stays reachable from the user code's frames
+    env = {"__builtins__": safe_builtins, "np": np, "pd": pd, "math": math, "prices": prices}
+    stdout = io.StringIO()
+    start = time.perf_counter()
+
+    _limit_cpu(cpu_seconds)
+    try:
+        with contextlib.redirect_stdout(stdout):
+            exec(compile(code, "<calculation>", "exec"), env)
+        return {
+            "id": job_id,
+            "ok": True,
+            "result": _describe(env.get("result")),
+            "stdout": stdout.getvalue()[:SANDBOX_MAX_OUTPUT],
+            "error": None,
+            "seconds": time.perf_counter() - start,
+        }
+    except MemoryError:
+        error = f"MemoryError: exceeded {SANDBOX_MEMORY_MB} MB"
+    except BaseException as e:  # SystemExit / KeyboardInterrupt from user code included
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "id": job_id,
+        "ok": False,
+        "result": None,
+        "stdout": stdout.getvalue()[:SANDBOX_MAX_OUTPUT],
+        "error": error,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def _preload():
+    """
+    Imports everything user code may need while files are still readable
+    (after the switch to an unprivileged user the app's packages may not be).
+    """
+    import importlib
+
+    import numpy as np
+    import pandas as pd
+
+    for name in ALLOWED_MODULES:
+        importlib.import_module(name)
+    time.localtime()  # Reads /etc/localtime once; no file opens are allowed later
+    # Touch the pandas code paths calculations use, so their lazy imports happen now
+    frame = pd.DataFrame({"Date": pd.date_range("2024-01-01", periods=30), "Close": np.linspace(1.0, 2.0, 30)})
+    returns = frame["Close"].pct_change()
+    returns.rolling(5).std().ewm(alpha=0.5).mean().describe().to_string()
+    frame.set_index("Date").resample("W").last().corr().to_string()
+
+
+def _worker_main(fd: int, memory_mb: int):
+    """
+    Child process: imports the numeric stack once, locks down, then serves
+    jobs until the pipe closes. Only the raw pipe fd is held here (user code
+    can reach it anyway), so the parent treats every reply as untrusted.
+    """
+    try:
+        _preload()
+        _limit_resources(memory_mb)
+    except Exception as e:
+        # Fail closed: a worker that cannot be locked down never runs code
+        _write_message(fd, {"ready": False, "error": f"{type(e).__name__}: {e}"})
+        return
+    safe_builtins = {k: v for k, v in vars(builtins).items() if k not in BLOCKED_BUILTINS}
+    safe_builtins['__import__'] = _safe_import
+
+    tables = {}
+    _write_message(fd, {"ready": True})
+    while True:
+        try:
+            reply = _run_job(_read_message(fd), tables, safe_builtins)
+        except EOFError:
+            return
+        _write_message(fd, reply)
+
+
+def _worker_entry(fd: int, memory_mb: int):
+    """Entry point of a worker interpreter; `fd` is its end of the job pipe."""
+    _worker_main(fd, memory_mb)
+
+
+# ---------------------------------------------------------------------------
+# Parent side
+# ---------------------------------------------------------------------------
+
+# Run with -I (isolated mode): PYTHON* variables and user site-packages are ignored
+_WORKER_BOOT = "import sys; sys.path.insert(0, {root!r}); from tools.sandbox import _worker_entry; _worker_entry({fd}, {memory_mb})"
+
+
+def _encode_array(array) -> dict:
+    import numpy as np
+
+    array = np.ascontiguousarray(array)
+    return {"dtype": array.dtype.str, "data": base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def _error(message: str, seconds: float = 0.0) -> dict:
+    return {"ok": False, "result": None, "stdout": "", "error": message, "seconds": seconds}
+
+
+def _parse_reply(data: bytes, job_id: int):
+    """
+    Validates a worker reply (plain JSON, never unpickled: the worker runs
+    untrusted code). Returns the result dict, or None if it is malformed.
+    """
+    try:
+        reply = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(reply, dict) or reply.get("id") != job_id:
+        return None
+    ok, stdout, error, seconds = reply.get("ok"), reply.get("stdout"), reply.get("error"), reply.get("seconds")
+    if not isinstance(ok, bool) or not isinstance(stdout, str) or not (error is None or isinstance(error, str)):
+        return None
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)):
+        return None
+    return {"ok": ok, "result": reply.get("result"), "stdout": stdout[:SANDBOX_MAX_OUTPUT], "error": error, "seconds": float(seconds)}
+
+
+class _Worker:
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        fd = child_conn.fileno()
+        # Empty working directory, removed with the worker
+        self.workdir = tempfile.mkdtemp(prefix="sandbox-")
+        # A fresh interpreter (not a fork / multiprocessing spawn) so the
+        # environment can be replaced instead of inherited
+        self.process = subprocess.Popen(
+            [sys.executable, "-I", "-c", _WORKER_BOOT.format(root=str(REPO_ROOT), fd=fd, memory_mb=SANDBOX_MEMORY_MB)],
+            env=WORKER_ENV,
+            cwd=self.workdir,
+            pass_fds=(fd,),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        child_conn.close()
+        self.ready = False
+        self.known = set()  # Table versions the worker already holds
+
+    def wait_ready(self, timeout: float) -> bool:
+        if not self.ready and self.conn.poll(timeout):
+            try:
+                message = json.loads(self.conn.recv_bytes(SANDBOX_MAX_REPLY_BYTES))
+            except (EOFError, OSError, ValueError):
+                return False
+            self.ready = isinstance(message, dict) and message.get("ready") is True
+            if not self.ready:
+                error = message.get("error") if isinstance(message, dict) else None
+                print(f"[SANDBOX ERROR] Worker could not be locked down: {str(error)[:200]}")
+        return self.ready
+
+    def kill(self):
+        self.process.kill()
+        try:
+            self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            pass
+        self.conn.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class SandboxPool:
+    """
+    Pool of pre-warmed worker processes executing untrusted calculation code.
+
+    Each worker is a fresh interpreter with an empty environment, started
+    in an empty temporary directory. It imports numpy/pandas once, then
+    drops to an unprivileged user (when started as root) with an
+    address-space cap, no file writes and no child processes, and installs
+    a seccomp filter that refuses fork / exec / socket creation and file
+    opens. Jobs and replies are JSON; replies are validated and a worker
+    sending anything else is replaced. Each run gets a CPU limit; runs that
+    exceed the wall-clock timeout (or crash the worker) get the worker
+    killed and replaced.
+    """
+
+    def __init__(self, size: int = SANDBOX_WORKERS):
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.size = max(1, size)
+        self._started = False
+        self._job_ids = itertools.count(1)
+
+    def start(self):
+        """Spawns the workers (returns immediately; they warm up in the background)."""
+        with self._lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._idle.put(_Worker())
+                self._started = True
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        self._idle.put(_Worker())
+
+    def run(self, code: str, market_data: dict = None, timeout: float = SANDBOX_TIMEOUT) -> dict:
+        """
+        Executes code in a warm worker.
+
+        The code sees np, pd, math and `prices` ({ticker: DataFrame with Date
+        and OHLCV columns}); it reports back by assigning `result` and/or printing.
+
+        Returns:
+            {"ok", "result", "stdout", "error", "seconds"}
+        """
+        from tools.price_table import as_price_table
+
+        self.start()
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return _error("Sandbox busy")
+
+        try:
+            # A freshly spawned worker may still be importing pandas
+            if not worker.wait_ready(SANDBOX_START_TIMEOUT):
+                self._replace(worker)
+                return _error("Sandbox worker failed to start")
+
+            tables = {ticker: as_price_table(data) for ticker, data in (market_data or {}).items()}
+            job_id = next(self._job_ids)
+            job = {"id": job_id, "code": code, "cpu_seconds": SANDBOX_CPU_SECONDS, "prices": {}, "tables": {}}
+            if len(worker.known) > SANDBOX_MAX_TABLES:
+                job["reset"] = True
+                worker.known = set()
+            for ticker, table in tables.items():
+                job["prices"][ticker] = table.version
+                if table.version not in worker.known:
+                    job["tables"][table.version] = {
+                        "dates": _encode_array(table.dates),
+                        "columns": {name: _encode_array(col) for name, col in table.columns.items()},
+                    }
+
+            start = time.monotonic()
+            worker.conn.send_bytes(json.dumps(job).encode())
+            if not worker.conn.poll(timeout):
+                self._replace(worker)
+                return _error(f"Timed out after {timeout:.0f}s", time.monotonic() - start)
+            data = worker.conn.recv_bytes(SANDBOX_MAX_REPLY_BYTES)
+        except (EOFError, OSError):
+            # Killed by the CPU / memory limit, crashed, or sent an oversized reply
+            self._replace(worker)
+            return _error("Calculation exceeded the sandbox CPU or memory limit")
+
+        result = _parse_reply(data, job_id)
+        if result is None:
+            # Tampered with its pipe: the worker can no longer be trusted to stay in sync
+            self._replace(worker)
+            return _error("Sandbox returned a malformed reply")
+        worker.known.update(job["tables"])
+        self._idle.put(worker)
+        return result
+
+
+_pool = SandboxPool()
+
+
+def warm_up():
+    """Starts the shared pool's workers ahead of the first calculation step."""
+    _pool.start()
+
+
+def run_code(code: str, market_data: dict = None, timeout: float = SANDBOX_TIMEOUT) -> dict:
+    """Runs calculation code in the shared sandbox pool (see SandboxPool.run)."""
+    return _pool.run(code, market_data, timeout)
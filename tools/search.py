@@ -3,88 +3,372 @@ try:
 except ImportError:
     from duckduckgo_search import DDGS
 
-import httpx
+import asyncio
+import codecs
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
 from bs4 import BeautifulSoup
+from tools.http_pool import get_client, run_sync, run_async
+from tools import article_cache
+from tools.html_extract import StreamingExtractor
 
-def fetch_article_content(url: str, max_length: int = 1000) -> str:
+# Overall time budget for fetching all result pages of one search
+SEARCH_FETCH_DEADLINE = float(os.getenv("SEARCH_FETCH_DEADLINE", "6"))
+# Per-page timeout and download cap
+ARTICLE_TIMEOUT = float(os.getenv("ARTICLE_TIMEOUT", "5"))
+ARTICLE_MAX_BYTES = int(os.getenv("ARTICLE_MAX_BYTES", str(512 * 1024)))
+# "streaming" (incremental, stops early) or "soup" (full BeautifulSoup tree)
+ARTICLE_EXTRACTOR = os.getenv("ARTICLE_EXTRACTOR", "streaming").lower()
+
+# Query-level result cache (news goes stale quickly, so keep the TTL short)
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_MAX_ENTRIES = 500
+
+_search_cache = {}   # key -> (expires_at, result)
+_inflight = {}       # key -> Future shared by concurrent identical searches
+_search_lock = threading.Lock()
+
+
+def extract_text(html: str, max_length: int = 1000) -> str:
     """
-    Fetch and extract main text content from a URL.
+    Extract main text content from an HTML document.
     """
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'}
-        response = httpx.get(url, headers=headers, timeout=5, follow_redirects=True)
-        
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # Remove script, style, nav, footer
+    for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside']):
+        tag.decompose()
+    
+    # Try to find main content
+    content = soup.find('article') or soup.find('main') or soup.find('body')
+    
+    if not content:
+        return "(Could not extract content)"
+    
+    # Get text and clean it
+    text = content.get_text(separator=' ', strip=True)
+    text = ' '.join(text.split())  # Remove extra whitespace
+    
+    return text[:max_length] + "..." if len(text) > max_length else text
+
+
+async def _fetch_page(url: str, max_length: int, headers: dict = None, max_bytes: int = ARTICLE_MAX_BYTES) -> tuple:
+    """
+    Downloads a page over the shared pooled client and extracts its text.
+    
+    In streaming mode the HTML is parsed chunk by chunk as it arrives and the
+    download stops as soon as enough text is collected; otherwise up to
+    `max_bytes` are read and parsed with BeautifulSoup.
+    
+    Returns:
+        (status_code, text or None, response headers)
+    """
+    client = get_client()
+    async with client.stream("GET", url, headers=headers, timeout=ARTICLE_TIMEOUT) as response:
         if response.status_code != 200:
-            return "(Content unavailable)"
+            return response.status_code, None, response.headers
+        
+        encoding = response.encoding or 'utf-8'
+        size = 0
+        
+        if ARTICLE_EXTRACTOR == "streaming":
+            extractor = StreamingExtractor(max_length)
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if extractor.feed(decoder.decode(chunk)) or size >= max_bytes:
+                    break
+            return response.status_code, extractor.result(), response.headers
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        chunks = []
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                break
         
-        # Remove script, style, nav, footer
-        for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside']):
-            tag.decompose()
+        html = b''.join(chunks)[:max_bytes].decode(encoding, errors='replace')
+        # Full-tree parsing is CPU work; keep it off the shared I/O loop
+        text = await asyncio.to_thread(extract_text, html, max_length)
+        return response.status_code, text, response.headers
+
+
+async def _fetch_article(url: str, max_length: int) -> str:
+    """
+    Returns extracted text, or None if the page could not be fetched.
+    Fresh cache entries are served directly; stale ones are revalidated
+    with a conditional request (ETag / Last-Modified).
+    """
+    try:
+        cached = await asyncio.to_thread(article_cache.lookup, url, max_length)
+        if cached and cached['fresh']:
+            return cached['text']
         
-        # Try to find main content
-        content = soup.find('article') or soup.find('main') or soup.find('body')
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
         
-        if not content:
-            return "(Could not extract content)"
+        status, text, response_headers = await _fetch_page(url, max_length, headers)
         
-        # Get text and clean it
-        text = content.get_text(separator=' ', strip=True)
-        text = ' '.join(text.split())  # Remove extra whitespace
+        if status == 304 and cached:
+            await asyncio.to_thread(article_cache.mark_revalidated, url)
+            return cached['text']
+        if text is None:
+            return None
         
-        return text[:max_length] + "..." if len(text) > max_length else text
+        await asyncio.to_thread(
+            article_cache.store, url, max_length, text,
+            response_headers.get('etag'), response_headers.get('last-modified')
+        )
+        return text
+    except Exception as e:
+        print(f"[SEARCH] Error fetching {url[:50]}: {e}")
+        return None
+
+
+async def fetch_articles(urls: list, max_length: int = 1000, deadline: float = SEARCH_FETCH_DEADLINE) -> dict:
+    """
+    Fetches several pages concurrently under one overall deadline.
+    Must run on the http_pool loop (see run_sync / run_async).
     
+    Returns:
+        Dict of {url: extracted text}; failed URLs and URLs that missed the
+        deadline are absent (callers fall back to the search snippet)
+    """
+    if not urls:
+        return {}
+    
+    tasks = {asyncio.ensure_future(_fetch_article(url, max_length)): url for url in urls}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    
+    for task in pending:
+        task.cancel()
+    if pending:
+        print(f"[SEARCH] {len(pending)} page(s) missed the {deadline}s deadline")
+    
+    return {tasks[task]: task.result() for task in done if task.result() is not None}
+
+
+def fetch_article_content(url: str, max_length: int = 1000) -> str:
+    """
+    Fetch and extract main text content from a URL.
+    """
+    try:
+        contents = run_sync(fetch_articles([url], max_length), timeout=SEARCH_FETCH_DEADLINE + 1)
+        return contents.get(url, "(Content unavailable)")
     except Exception as e:
         return f"(Error fetching content: {e})"
 
 
-def search_web(query: str, max_results: int = 3, fetch_content: bool = True) -> dict:
+def normalize_query(query: str) -> str:
+    """
+    Canonical form of a query for cache keys and in-turn dedup: case,
+    whitespace and punctuation only ("NVIDIA  news?" == "nvidia news").
+    Every word is kept, in order, so "Apple stock" and "Apple news" stay apart.
+    """
+    words = (w.strip('.-') for w in re.findall(r'[a-z0-9$&.\-]+', query.lower()))
+    return ' '.join(w for w in words if w) or query.lower().strip()
+
+
+def search_key(query: str, max_results: int = 3, timelimit: str = 'm', fetch_content: bool = True) -> tuple:
+    """Cache / coalescing key for a search_web call."""
+    return (normalize_query(query), timelimit, max_results, fetch_content)
+
+
+def search_web(query: str, max_results: int = 3, fetch_content: bool = True, timelimit: str = 'm') -> dict:
     """
     Searches the web using DuckDuckGo and optionally fetches full article content.
+    Results are cached briefly per normalized query, and concurrent identical
+    searches share a single upstream call.
     Returns dict with 'content' (formatted text) and 'sources' (list of URLs).
     """
+    key = search_key(query, max_results, timelimit, fetch_content)
+    cached, future, owner = _claim_search(key, query)
+    if cached:
+        return cached
+    
+    if not owner:
+        print(f"[SEARCH] Joining in-flight search for: {query}")
+        return _copy_result(future.result())
+    
+    result = None
+    try:
+        result = _search_web_uncached(query, max_results, fetch_content, timelimit)
+    finally:
+        _release_search(key, future, result)
+    
+    return _copy_result(result)
+
+
+async def asearch_web(query: str, max_results: int = 3, fetch_content: bool = True, timelimit: str = 'm') -> dict:
+    """
+    Async search_web: same cache and in-flight sharing (with sync callers too),
+    but waits on the search and page fetches without blocking the caller's
+    event loop.
+    """
+    key = search_key(query, max_results, timelimit, fetch_content)
+    cached, future, owner = _claim_search(key, query)
+    if cached:
+        return cached
+    
+    if not owner:
+        print(f"[SEARCH] Joining in-flight search for: {query}")
+        return _copy_result(await asyncio.wrap_future(future))
+    
+    result = None
     try:
-        print(f"[SEARCH] Searching for: {query}")
+        result = await _asearch_web_uncached(query, max_results, fetch_content, timelimit)
+    finally:
+        _release_search(key, future, result)
+    
+    return _copy_result(result)
+
+
+def _copy_result(result: dict) -> dict:
+    # Callers may extend 'sources'; never hand out the cached list itself
+    return {"content": result['content'], "sources": list(result['sources'])}
+
+
+def _claim_search(key: tuple, query: str) -> tuple:
+    """
+    Looks the search up in the cache, else joins or registers the in-flight call.
+    
+    Returns:
+        (cached result or None, Future, True if the caller must run the search)
+    """
+    with _search_lock:
+        cached = _search_cache.get(key)
+        if cached and cached[0] > time.time():
+            print(f"[SEARCH] Cache hit for: {query}")
+            return _copy_result(cached[1]), None, False
         
-        ddg = DDGS()
-        # Restrict to past month ('m') for financial news
-        # Append current year to query to force relevance
-        from datetime import datetime
-        current_year = datetime.now().year
-        search_query = f"{query} {current_year}"
-        print(f"[SEARCH] Modified query: {search_query}")
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+        return None, future, owner
+
+
+def _release_search(key: tuple, future: Future, result: dict):
+    """Caches a finished search and hands the result to everyone waiting on it."""
+    with _search_lock:
+        # Failed / empty searches are not cached so the next turn retries
+        if result and result['sources']:
+            _search_cache[key] = (time.time() + SEARCH_CACHE_TTL, result)
+        _prune_search_cache()
+        _inflight.pop(key, None)
+    future.set_result(result or {"content": "Search failed.", "sources": []})
+
+
+def _prune_search_cache():
+    """Drops expired entries and keeps the cache within SEARCH_CACHE_MAX_ENTRIES."""
+    now = time.time()
+    for key in [k for k, (expires, _) in _search_cache.items() if expires <= now]:
+        del _search_cache[key]
+    while len(_search_cache) > SEARCH_CACHE_MAX_ENTRIES:
+        # Dicts keep insertion order: the oldest entry goes first
+        del _search_cache[next(iter(_search_cache))]
+
+
+def _ddg_results(query: str, max_results: int, timelimit: str) -> list:
+    """Runs the DuckDuckGo text search (blocking)."""
+    print(f"[SEARCH] Searching for: {query}")
+    
+    ddg = DDGS()
+    # Restrict to past month ('m') for financial news
+    # Append current year to query to force relevance
+    from datetime import datetime
+    current_year = datetime.now().year
+    search_query = f"{query} {current_year}"
+    print(f"[SEARCH] Modified query: {search_query}")
+    
+    results = list(ddg.text(search_query, max_results=max_results, timelimit=timelimit))
+    
+    print(f"[SEARCH] Found {len(results)} results")
+    return results
+
+
+def _fetchable_urls(results: list, fetch_content: bool) -> list:
+    fetchable = []
+    for res in results:
+        href = res.get('href', res.get('link'))
+        if fetch_content and href and not href.startswith('javascript'):
+            fetchable.append(href)
+    return fetchable
+
+
+def _format_results(results: list, contents: dict) -> dict:
+    """Formats search results; pages that were not fetched keep their snippet."""
+    formatted = ""
+    sources = []
+    
+    for i, res in enumerate(results, 1):
+        title = res.get('title', 'No title')
+        href = res.get('href', res.get('link', 'No URL'))
+        snippet = res.get('body', res.get('snippet', ''))
         
-        results = list(ddg.text(search_query, max_results=max_results, timelimit='m'))
+        # Store source for citation
+        sources.append({"title": title, "url": href})
         
-        print(f"[SEARCH] Found {len(results)} results")
+        formatted += f"\n{'='*60}\n"
+        formatted += f"Result {i}: {title}\n"
+        formatted += f"URL: {href}\n\n"
         
+        if href in contents:
+            formatted += f"Content:\n{contents[href]}\n"
+        else:
+            formatted += f"Snippet: {snippet}\n"
+    
+    return {"content": formatted, "sources": sources}
+
+
+def _search_web_uncached(query: str, max_results: int, fetch_content: bool, timelimit: str) -> dict:
+    """Runs the DuckDuckGo search and page fetches (no caching)."""
+    try:
+        results = _ddg_results(query, max_results, timelimit)
         if not results:
             return {"content": "No results found.", "sources": []}
         
-        formatted = ""
-        sources = []
-        
-        for i, res in enumerate(results, 1):
-            title = res.get('title', 'No title')
-            href = res.get('href', res.get('link', 'No URL'))
-            snippet = res.get('body', res.get('snippet', ''))
-            
-            # Store source for citation
-            sources.append({"title": title, "url": href})
-            
-            formatted += f"\n{'='*60}\n"
-            formatted += f"Result {i}: {title}\n"
-            formatted += f"URL: {href}\n\n"
-            
-            if fetch_content and href and not href.startswith('javascript'):
-                print(f"[SEARCH] Fetching content from: {href[:50]}...")
-                content = fetch_article_content(href)
-                formatted += f"Content:\n{content}\n"
-            else:
-                formatted += f"Snippet: {snippet}\n"
-        
-        return {"content": formatted, "sources": sources}
+        # Fetch every result page at once; whatever misses the deadline keeps its snippet
+        fetchable = _fetchable_urls(results, fetch_content)
+        contents = {}
+        if fetchable:
+            print(f"[SEARCH] Fetching content from {len(fetchable)} page(s) concurrently...")
+            try:
+                contents = run_sync(fetch_articles(fetchable), timeout=SEARCH_FETCH_DEADLINE + 1)
+            except Exception as e:
+                print(f"[SEARCH ERROR] Content fetch failed: {e}")
+        
+        return _format_results(results, contents)
+    
+    except Exception as e:
+        print(f"[SEARCH ERROR] {type(e).__name__}: {e}")
+        return {"content": f"Search failed: {str(e)}", "sources": []}
+
+
+async def _asearch_web_uncached(query: str, max_results: int, fetch_content: bool, timelimit: str) -> dict:
+    """Async _search_web_uncached: the DDGS client is sync-only, so it runs in a worker thread."""
+    try:
+        results = await asyncio.to_thread(_ddg_results, query, max_results, timelimit)
+        if not results:
+            return {"content": "No results found.", "sources": []}
+        
+        fetchable = _fetchable_urls(results, fetch_content)
+        contents = {}
+        if fetchable:
+            print(f"[SEARCH] Fetching content from {len(fetchable)} page(s) concurrently...")
+            try:
+                contents = await asyncio.wait_for(run_async(fetch_articles(fetchable)), SEARCH_FETCH_DEADLINE + 1)
+            except Exception as e:
+                print(f"[SEARCH ERROR] Content fetch failed: {e}")
+        
+        return _format_results(results, contents)
     
     except Exception as e:
         print(f"[SEARCH ERROR] {type(e).__name__}: {e}")